@@ -1,18 +1,13 @@
-from dataimport.analysis import Analysis
-import csv
+from dataimport.analysis import Analysis, CSVFileAnalysis, ColumnarFileAnalysis
 
 
 class CoincidentISSNs(Analysis):
     pass
 
 
-class CoincidentISSNsFromCSV(CoincidentISSNs):
-    def __init__(self, source_id, filepath):
-        super(CoincidentISSNsFromCSV, self).__init__(source_id)
-        self._filepath = filepath
+class CoincidentISSNsFromCSV(CoincidentISSNs, CSVFileAnalysis):
+    pass
+
 
-    def entries(self):
-        with open(self._filepath, "r") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                yield row
\ No newline at end of file
+class CoincidentISSNsFromColumnar(CoincidentISSNs, ColumnarFileAnalysis):
+    pass
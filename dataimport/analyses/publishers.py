@@ -1,17 +1,12 @@
-from dataimport.analysis import Analysis
-import csv
+from dataimport.analysis import Analysis, CSVFileAnalysis, ColumnarFileAnalysis
 
 class Publishers(Analysis):
     pass
 
 
-class PublishersFromCSV(Publishers):
-    def __init__(self, source_id, filepath):
-        super(Publishers, self).__init__(source_id)
-        self._filepath = filepath
+class PublishersFromCSV(Publishers, CSVFileAnalysis):
+    pass
+
 
-    def entries(self):
-        with open(self._filepath, "r") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                yield row
\ No newline at end of file
+class PublishersFromColumnar(Publishers, ColumnarFileAnalysis):
+    pass
@@ -1,3 +1,9 @@
+import csv
+import itertools
+
+from dataimport.lib import columnar, compression, mmapcsv
+
+
 class Analysis(object):
     def __init__(self, source_id):
         self._source_id = source_id
@@ -6,5 +12,49 @@ class Analysis(object):
     def source(self):
         return self._source_id
 
-    def entries(self):
-        raise NotImplementedError()
\ No newline at end of file
+    def entries(self, shard=0, shards=1):
+        # All the entries, or if shards > 1, the given shard of them.  Every entry is in exactly
+        # one shard, so the shards can be read independently (e.g. in separate processes)
+        raise NotImplementedError()
+
+
+class CSVFileAnalysis(Analysis):
+    # An analysis stored as a CSV file.  Uncompressed files are memory mapped and sharded by byte
+    # range, and support random access to their records by number; compressed ones have to be
+    # read sequentially, so are sharded by taking every shards-th row.
+    def __init__(self, source_id, filepath):
+        super(CSVFileAnalysis, self).__init__(source_id)
+        self._filepath = filepath
+
+    @property
+    def mappable(self):
+        return compression.codec_for_path(self._filepath) is None
+
+    def entries(self, shard=0, shards=1):
+        if self.mappable:
+            with mmapcsv.MappedCSV(self._filepath) as mapped:
+                for row in mapped.shard(shard, shards):
+                    yield row
+            return
+
+        with compression.open_stored(self._filepath) as f:
+            reader = csv.reader(f)
+            for row in itertools.islice(reader, shard, None, shards):
+                yield row
+
+    def mapped(self):
+        # random access to the records, e.g. with mapped().record(i); the caller must close it
+        if not self.mappable:
+            raise compression.CompressionException("{x} is compressed, so cannot be memory mapped".format(x=self._filepath))
+        return mmapcsv.MappedCSV(self._filepath)
+
+
+class ColumnarFileAnalysis(Analysis):
+    # An analysis stored as a columnar file, which is sharded by block
+    def __init__(self, source_id, filepath):
+        super(ColumnarFileAnalysis, self).__init__(source_id)
+        self._filepath = filepath
+
+    def entries(self, shard=0, shards=1):
+        for row in columnar.read_rows(self._filepath, shard, shards):
+            yield row
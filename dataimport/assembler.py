@@ -1,7 +1,5 @@
-from dataimport.file_manager import FileManager
 from dataimport import logger
-
-from datetime import datetime, timedelta
+from dataimport.lib import memo, metrics
 
 
 class Assembler(object):
@@ -27,17 +25,59 @@ class Assembler(object):
                     self.assembly(product)
 
     def gather(self, product, force_update=False):
-        self.log("Gathering data for '{x}'".format(x=product.id))
-        product.gather(force_update)
+        with metrics.stage(self.config, "assembler", product.id, "gather", product.file_manager):
+            self.log("Gathering data for '{x}'".format(x=product.id))
+            product.gather(force_update)
 
     def analyse(self, product):
-        product.file_manager.fresh()
-        self.log("Starting fresh data analysis for '{x}' in {y}".format(x=product.id, y=product.file_manager.current_instance_name))
-        product.analyse()
-        product.cleanup()
+        with metrics.stage(self.config, "assembler", product.id, "analyse", product.file_manager) as m:
+            fm = product.file_manager
+            inputs = {ds.id: memo.upstream_digest(ds.file_manager.current_instance_name, "analyse") for ds in product.get_sources()}
+            stage = memo.Memo(fm, "analyse", inputs, self.config, product.CONFIG_KEYS)
+
+            previous = stage.find()
+            if previous is not None:
+                if previous == fm.current_instance_name:
+                    m.outcome = "skipped"
+                    self.log("Sources for '{x}' are unchanged since analysis in {y}, skipping".format(x=product.id, y=previous))
+                    return
+                m.outcome = "adopted"
+                fm.fresh()
+                self.log("Sources for '{x}' are unchanged since analysis in {y}, re-using it in {z}".format(x=product.id, y=previous, z=fm.current_instance_name))
+                stage.adopt(previous)
+                fm.commit()
+                product.cleanup()
+                return
+
+            product.file_manager.fresh()
+            self.log("Starting fresh data analysis for '{x}' in {y}".format(x=product.id, y=product.file_manager.current_instance_name))
+            product.analyse()
+            stage.record([f for f in fm.list_files() if not memo.is_bookkeeping(f)])
+            fm.commit()
+            product.cleanup()
 
     def assembly(self, product):
-        product.file_manager.current(make_fresh=True)
-        self.log("Assembling product for for '{x}' in {y}".format(x=product.id, y=product.file_manager.current_instance_name))
-        product.assemble()
-        product.cleanup()
\ No newline at end of file
+        with metrics.stage(self.config, "assembler", product.id, "assemble", product.file_manager) as m:
+            product.file_manager.current(make_fresh=True)
+            fm = product.file_manager
+            analysed = memo.read_manifest(fm.current_instance_name, "analyse")
+            inputs = {"analyse": analysed.get("digest") if analysed is not None else None}
+            stage = memo.Memo(fm, "assemble", inputs, self.config, product.CONFIG_KEYS)
+
+            if stage.matches(fm.current_instance_name):
+                m.outcome = "skipped"
+                self.log("Product '{x}' is already assembled in {y}, skipping".format(x=product.id, y=fm.current_instance_name))
+                return
+
+            previous = stage.find()
+            if previous is not None:
+                m.outcome = "adopted"
+                self.log("Product '{x}' was assembled from the same analysis in {y}, re-using it".format(x=product.id, y=previous))
+                stage.adopt(previous)
+                return
+
+            self.log("Assembling product for for '{x}' in {y}".format(x=product.id, y=product.file_manager.current_instance_name))
+            product.assemble()
+            analysis_files = analysed.get("files", []) if analysed is not None else []
+            stage.record([f for f in fm.list_files() if not memo.is_bookkeeping(f) and f not in analysis_files])
+            product.cleanup()
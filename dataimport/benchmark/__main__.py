@@ -0,0 +1,66 @@
+import json
+import sys
+import tempfile
+
+import click
+
+from dataimport.benchmark import runner
+
+
+def _override(value):
+    key, _, raw = value.partition("=")
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+@click.command()
+@click.option("-s", "--scale", "scales", multiple=True, type=click.Choice(list(runner.SCALES.keys())), default=["10k"])
+@click.option("-t", "--stage", "stages", multiple=True, type=click.Choice(runner.STAGES))
+@click.option("-w", "--workdir")
+@click.option("-b", "--baseline")
+@click.option("--save-baseline", is_flag=True, default=False)
+@click.option("-r", "--results", "results_path")
+@click.option("-o", "--override", "overrides", multiple=True, help="a config override, as KEY=VALUE (VALUE as JSON)")
+@click.option("--seed", default=1)
+@click.option("--keep", is_flag=True, default=False)
+@click.option("--time-tolerance", default=runner.TIME_TOLERANCE)
+@click.option("--memory-tolerance", default=runner.MEMORY_TOLERANCE)
+def entry_point(scales, stages, workdir, baseline, save_baseline, results_path, overrides, seed, keep,
+                time_tolerance, memory_tolerance):
+    stages = list(stages) if len(stages) > 0 else None
+    overrides = dict([_override(o) for o in overrides])
+
+    results = {}
+    for scale in scales:
+        scale_dir = tempfile.mkdtemp(prefix="dataimport_benchmark_" + scale + "_", dir=workdir)
+        results[scale] = runner.run(scale, scale_dir, stages=stages, seed=seed, overrides=overrides, keep=keep)
+
+    for scale, stage_results in results.items():
+        for stage, r in stage_results.items():
+            click.echo("{s:>5} {t:<16} {x:>9.2f}s {y:>9.1f}MB {z:>12.0f} journals/s".format(
+                s=scale, t=stage, x=r["seconds"], y=r["peak_rss_mb"], z=r["journals_per_second"] or 0))
+
+    if results_path is not None:
+        runner.write_results(results_path, results)
+
+    if baseline is None:
+        return
+
+    if save_baseline:
+        runner.write_results(baseline, results)
+        click.echo("baseline written to {x}".format(x=baseline))
+        return
+
+    found = runner.regressions(results, runner.read_results(baseline), time_tolerance, memory_tolerance)
+    if len(found) > 0:
+        click.echo("Regressions against {x}:".format(x=baseline))
+        for f in found:
+            click.echo("  " + f)
+        sys.exit(1)
+    click.echo("no regressions against {x}".format(x=baseline))
+
+
+if __name__ == "__main__":
+    entry_point()
@@ -0,0 +1,227 @@
+import http.server
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import threading
+import time
+from functools import partial
+
+from dataimport import logger
+from dataimport.benchmark import synthetic
+
+# Runs each stage of the pipeline (datasource -> product -> target) against a synthetic data dump
+# served from a local HTTP server, timing it and measuring its peak memory.  Each stage runs in a
+# fresh interpreter, so that its peak memory is its own, and the stages hand their data to one
+# another through the file store just as they would in a real import.
+
+SCALES = {
+    "10k": 10000,
+    "100k": 100000,
+    "1m": 1000000
+}
+
+STAGES = ["fetch", "analyse", "gather", "product_analyse", "assemble", "prepare"]
+
+CONFIG_MODULE = "benchmark_config"
+DUMP_FILE = "origin.tar.gz"
+
+# a stage regresses if it is this much slower, or uses this much more memory, than the baseline;
+# differences in time below TIME_FLOOR seconds are treated as noise
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+TIME_FLOOR = 0.5
+
+
+class BenchmarkException(Exception):
+    pass
+
+
+def log(msg):
+    logger.log(msg, "BENCHMARK")
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class DumpServer(object):
+    # serves the directory holding the synthetic dump, standing in for the DOAJ public data dump
+    def __init__(self, directory):
+        handler = partial(_QuietHandler, directory=directory)
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{x}/{y}".format(x=self._server.server_address[1], y=DUMP_FILE)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def write_config(workdir, url, overrides=None):
+    # the benchmark config is the default settings, with the stores and metrics moved into the
+    # working directory and the DOAJ dump pointed at the local server
+    keyfile = os.path.join(workdir, "doaj_key.txt")
+    with open(keyfile, "w") as f:
+        f.write("benchmark")
+
+    databases = os.path.join(workdir, "databases")
+    settings = {
+        "DATABASES": databases,
+        "STORE_SCOPES": {
+            "doaj": os.path.join(databases, "datasources", "doaj"),
+            "jac": os.path.join(databases, "products", "jac")
+        },
+        "TARGET_DIRS": os.path.join(databases, "targets"),
+        "PRODUCT_TARGETS": {
+            "jac": [{"id": "es17", "dir": os.path.join(databases, "targets", "jac__es17")}]
+        },
+        "METRICS_JSONL_FILE": os.path.join(databases, "metrics.jsonl"),
+        "METRICS_PROMETHEUS_FILE": os.path.join(databases, "metrics", "dataimport.prom"),
+        "DOAJ_PUBLIC_DATA_DUMP": url,
+        "DOAJ_PUBLIC_DATA_DUMP_KEYFILE": keyfile,
+        "ES17_WRITE_BULKFILE": True
+    }
+    if overrides is not None:
+        settings.update(overrides)
+
+    with open(os.path.join(workdir, CONFIG_MODULE + ".py"), "w") as f:
+        f.write("from dataimport.settings import *\n\n")
+        for k, v in settings.items():
+            f.write("{x} = {y!r}\n".format(x=k, y=v))
+
+
+def _run_stage(workdir, stage, results):
+    # runs in a fresh (spawned) process
+    sys.path.insert(0, workdir)
+
+    from dataimport.lib import plugin
+    from dataimport.resolver import Resolver
+    from dataimport.assembler import Assembler
+    from dataimport.datasource_factory import DatasourceFactory
+    from dataimport.product_factory import ProductFactory
+    from dataimport.target_factory import TargetFactory
+
+    config = plugin.load_module(CONFIG_MODULE)
+    datasource = DatasourceFactory(config).get_datasource("doaj")
+    product = ProductFactory(config).get_product("jac")
+
+    start = time.perf_counter()
+    if stage == "fetch":
+        Resolver(config).fetch(datasource, force_update=True)
+    elif stage == "analyse":
+        Resolver(config).analyse(datasource)
+    elif stage == "gather":
+        Assembler(config).gather(product)
+    elif stage == "product_analyse":
+        Assembler(config).analyse(product)
+    elif stage == "assemble":
+        Assembler(config).assembly(product)
+    elif stage == "prepare":
+        # the target's own prepare, without the loader's cleanup, which needs a live index
+        target = TargetFactory(config).get_targets(product)[0]
+        target.file_manager.fresh()
+        target.prepare()
+        target.file_manager.commit()
+    elapsed = time.perf_counter() - start
+
+    # worker processes (e.g. parallel extraction) are accounted for separately, so we take
+    # whichever peaked highest
+    peak = max(_peak_rss_kb(), resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put({"seconds": elapsed, "peak_rss_mb": peak / 1024})
+
+
+def _peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so would include the peak of the process which spawned
+    # this one; the high water mark in /proc does not, so we prefer it where there is one
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_stage(workdir, stage):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(workdir, stage, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise BenchmarkException("Stage {x} failed with exit code {y}".format(x=stage, y=process.exitcode))
+    return results.get()
+
+
+def run(scale, workdir, stages=None, seed=1, overrides=None, keep=False):
+    if stages is None:
+        stages = STAGES
+    journals = SCALES[scale]
+
+    os.makedirs(workdir, exist_ok=True)
+    served = os.path.join(workdir, "served")
+    os.makedirs(served, exist_ok=True)
+
+    dump = os.path.join(served, DUMP_FILE)
+    log("generating synthetic dump of {x} journals".format(x=journals))
+    start = time.perf_counter()
+    synthetic.generate_dump(dump, journals, seed=seed)
+    log("generated {x} ({y} bytes) in {z:.1f}s".format(x=dump, y=os.path.getsize(dump), z=time.perf_counter() - start))
+
+    results = {}
+    try:
+        with DumpServer(served) as server:
+            write_config(workdir, server.url, overrides)
+            for stage in stages:
+                log("running {x} at scale {y}".format(x=stage, y=scale))
+                result = run_stage(workdir, stage)
+                result["journals_per_second"] = journals / result["seconds"] if result["seconds"] > 0 else None
+                results[stage] = result
+                log("{x}: {y:.2f}s, {z:.1f}MB peak".format(x=stage, y=result["seconds"], z=result["peak_rss_mb"]))
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def regressions(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    # compare {scale: {stage: result}} against a baseline of the same shape, and list the ways in
+    # which it is worse.  Stages or scales not in the baseline are not compared.
+    found = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if base is None:
+                continue
+
+            limit = max(base["seconds"] * (1 + time_tolerance), base["seconds"] + TIME_FLOOR)
+            if result["seconds"] > limit:
+                found.append("{s}/{t}: took {x:.2f}s, baseline {y:.2f}s".format(s=scale, t=stage, x=result["seconds"], y=base["seconds"]))
+
+            limit = base["peak_rss_mb"] * (1 + memory_tolerance)
+            if result["peak_rss_mb"] > limit:
+                found.append("{s}/{t}: peaked at {x:.1f}MB, baseline {y:.1f}MB".format(s=scale, t=stage, x=result["peak_rss_mb"], y=base["peak_rss_mb"]))
+    return found
+
+
+def read_results(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,79 @@
+import json
+import subprocess
+import sys
+import time
+
+import click
+
+# Checks the CLI's start-up against a budget: how much longer than a bare interpreter it takes to
+# import the CLI and to show its help, and that doing so does not import any of the heavy
+# dependencies which should only be imported once a stage needs them.
+
+# milliseconds over the time a bare interpreter takes to start
+STARTUP_BUDGET_MS = 100
+
+RUNS = 10
+
+# none of these should be imported just to start the CLI
+DEFERRED_MODULES = ["requests", "urllib3", "unidecode", "esprit", "asyncio", "dataimport.resolver",
+                    "dataimport.assembler", "dataimport.loader", "dataimport.scheduler"]
+
+SCENARIOS = {
+    "import": ["-c", "import dataimport.cli"],
+    "help": ["-m", "dataimport.cli", "--help"]
+}
+
+
+def _time(args, runs):
+    # the best of the runs, as the least disturbed by whatever else the machine is doing
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def imported_modules():
+    script = "import sys, json; import dataimport.cli; print(json.dumps(sorted(sys.modules.keys())))"
+    out = subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE)
+    return json.loads(out.stdout)
+
+
+def check(budget_ms=STARTUP_BUDGET_MS, runs=RUNS):
+    baseline = _time(["-c", "pass"], runs)
+    results = {name: _time(args, runs) - baseline for name, args in SCENARIOS.items()}
+
+    problems = []
+    for name, overhead in results.items():
+        if overhead > budget_ms:
+            problems.append("{x} took {y:.1f}ms over the bare interpreter, budget {z}ms".format(x=name, y=overhead, z=budget_ms))
+
+    modules = imported_modules()
+    for deferred in DEFERRED_MODULES:
+        if deferred in modules:
+            problems.append("{x} is imported at start-up".format(x=deferred))
+
+    return baseline, results, problems
+
+
+@click.command()
+@click.option("-b", "--budget", "budget_ms", default=STARTUP_BUDGET_MS)
+@click.option("-n", "--runs", default=RUNS)
+def entry_point(budget_ms, runs):
+    baseline, results, problems = check(budget_ms, runs)
+    click.echo("bare interpreter {x:.1f}ms".format(x=baseline))
+    for name, overhead in results.items():
+        click.echo("{x:<8} +{y:.1f}ms".format(x=name, y=overhead))
+
+    if len(problems) > 0:
+        click.echo("Start-up budget exceeded:")
+        for p in problems:
+            click.echo("  " + p)
+        sys.exit(1)
+    click.echo("within the start-up budget of {x}ms".format(x=budget_ms))
+
+
+if __name__ == "__main__":
+    entry_point()
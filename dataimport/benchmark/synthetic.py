@@ -0,0 +1,99 @@
+import io
+import json
+import random
+import tarfile
+
+# Generates synthetic DOAJ journal data dumps, in the same shape as the real public data dump (a
+# gzipped tarball of JSON arrays of journal records), so that the pipeline can be exercised at
+# scale without access to the real thing.
+
+BATCH_SIZE = 10000
+
+WORDS = ["Journal", "Review", "Studies", "Research", "Annals", "Letters", "Bulletin", "Science",
+         "Medicine", "History", "Economics", "Engineering", "Education", "Society", "Culture",
+         "Revista", "Zeitschrift", "Cahiers", "Anales", "Rivista", "Tijdschrift", "Acta",
+         "Ciências", "Éducation", "Über", "Ñandú", "Sociología", "Økonomi", "Łódź",
+         "Вестник", "Журнал", "Науки", "学報", "研究", "雑誌", "Δελτίο", "Επιστήμη", "مجلة", "العلوم"]
+
+JOINERS = ["of", "for", "and", "&", "de", "für", "in", "on", ":", "-"]
+
+LICENCE_TYPES = ["CC BY", "CC BY-SA", "CC BY-NC", "CC BY-ND", "CC BY-NC-SA", "CC BY-NC-ND", "CC0", "Publisher's own license"]
+
+# the proportions of records which have each of these features
+EISSN_RATE = 0.8
+PISSN_RATE = 0.7
+SHARED_ISSN_RATE = 0.05
+ALT_TITLE_RATE = 0.3
+MAX_LICENCES = 3
+
+
+def issn(number):
+    digits = "{x:07d}".format(x=number % 10000000)
+    total = sum(int(d) * (8 - i) for i, d in enumerate(digits))
+    check = (11 - total % 11) % 11
+    return digits[:4] + "-" + digits[4:] + ("X" if check == 10 else str(check))
+
+
+def title(rng):
+    parts = [rng.choice(WORDS)]
+    for i in range(rng.randint(1, 4)):
+        parts.append(rng.choice(JOINERS))
+        parts.append(rng.choice(WORDS))
+    if rng.random() < 0.2:
+        parts.append(str(rng.randint(1, 99)))
+    return " ".join(parts)
+
+
+class JournalGenerator(object):
+    def __init__(self, journals, seed=1):
+        self.journals = journals
+        self.rng = random.Random(seed)
+        self._issns = list(range(journals * 2))
+        self.rng.shuffle(self._issns)
+        self._used = []
+        self._publishers = ["Publisher " + title(self.rng) for i in range(max(journals // 20, 1))]
+
+    def _issn(self, n):
+        # usually a new ISSN, but sometimes one already used by another journal, so that the data
+        # has ISSNs which coincide across records, as the real data does
+        if len(self._used) > 0 and self.rng.random() < SHARED_ISSN_RATE:
+            return self.rng.choice(self._used)
+        value = issn(self._issns[n])
+        self._used.append(value)
+        return value
+
+    def record(self, n):
+        rng = self.rng
+        bibjson = {"title": title(rng)}
+
+        has_eissn = rng.random() < EISSN_RATE
+        has_pissn = rng.random() < PISSN_RATE
+        if not has_eissn and not has_pissn:
+            has_eissn = True
+        if has_eissn:
+            bibjson["eissn"] = self._issn(n * 2)
+        if has_pissn:
+            bibjson["pissn"] = self._issn(n * 2 + 1)
+
+        if rng.random() < ALT_TITLE_RATE:
+            bibjson["alternative_title"] = title(rng)
+
+        bibjson["publisher"] = {"name": rng.choice(self._publishers), "country": "GB"}
+        bibjson["license"] = [{"type": t} for t in rng.sample(LICENCE_TYPES, rng.randint(0, MAX_LICENCES))]
+
+        return {"id": "{x:032x}".format(x=n), "bibjson": bibjson}
+
+    def batches(self, batch_size=BATCH_SIZE):
+        for start in range(0, self.journals, batch_size):
+            yield [self.record(n) for n in range(start, min(start + batch_size, self.journals))]
+
+
+def generate_dump(path, journals, seed=1, batch_size=BATCH_SIZE):
+    generator = JournalGenerator(journals, seed)
+    with tarfile.open(path, "w:gz") as tf:
+        for i, batch in enumerate(generator.batches(batch_size)):
+            data = json.dumps(batch, ensure_ascii=False).encode("utf-8")
+            info = tarfile.TarInfo("doaj_journal_data/journal_batch_{x}.json".format(x=i + 1))
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return path
@@ -1,26 +1,26 @@
 import click
 
-from dataimport.datasource_factory import DatasourceFactory
-from dataimport.product_factory import ProductFactory
-from dataimport.target_factory import TargetFactory
-
 # FIXME: this needs to be replaced with proper config management
 # from dataimport import settings
 
-from dataimport.resolver import Resolver
-from dataimport.assembler import Assembler
-from dataimport.loader import Loader
-from dataimport.lib import plugin
+# The pipeline (and through it the datasources, products and targets, and their dependencies) is
+# only imported once we know which mode we are running, in the function for that mode, so that the
+# CLI starts quickly and rejects a bad invocation before importing anything.  See
+# dataimport.benchmark.startup for the import time budget.
+
+MODES = ["resolve", "assemble", "load", "plan"]
 
 
 @click.command()
-@click.argument("mode")
+@click.argument("mode", type=click.Choice(MODES))
 @click.argument("targets", nargs=-1)
 @click.option("-s", "--stage")
 @click.option("-o", "--only", "full_pipeline", flag_value=False)
 @click.option("-a", "--all", "full_pipeline", flag_value=True, default=True)
 @click.option("-c", "--config", "config_module")
 def entry_point(mode, targets, stage=None, full_pipeline=True, config_module=None):
+    from dataimport.lib import plugin
+
     if config_module is None:
         config_module = "dataimport.settings"
     config = plugin.load_module(config_module)
@@ -36,6 +36,9 @@ def run(config, mode:str, targets:tuple, stage:str=None, full_pipeline:bool=True
 
 
 def resolve(config, datasource_names, stage=None, full_pipeline=True):
+    from dataimport.resolver import Resolver
+    from dataimport.datasource_factory import DatasourceFactory
+
     if stage is None:
         stage = Resolver.RESOLVE_PIPELINE[-1]
 
@@ -57,6 +60,9 @@ def resolve(config, datasource_names, stage=None, full_pipeline=True):
 
 
 def assemble(config, product_names, stage=None, full_pipeline=True):
+    from dataimport.assembler import Assembler
+    from dataimport.product_factory import ProductFactory
+
     if stage is None:
         stage = Assembler.ASSEMBLE_PIPELINE[-1]
 
@@ -78,6 +84,9 @@ def assemble(config, product_names, stage=None, full_pipeline=True):
 
 
 def load(config, target_names, stage=None, full_pipeline=True):
+    from dataimport.loader import Loader
+    from dataimport.target_factory import TargetFactory
+
     if stage is None:
         stage = Loader.LOAD_PIPELINE[-1]
 
@@ -98,10 +107,24 @@ def load(config, target_names, stage=None, full_pipeline=True):
     loader.load(targets, force_update=False, stages=stages)
 
 
+def plan(config, target_names, stage=None, full_pipeline=True):
+    from dataimport.scheduler import Scheduler
+
+    # the plan always runs every stage, from fetching the datasources through to loading the targets
+    scheduler = Scheduler(config)
+
+    if len(target_names) == 0:
+        target_names = ("_all",)
+
+    nodes = scheduler.plan(list(target_names))
+    scheduler.run(nodes, force_update=False)
+
+
 MODE_MAP = {
     "resolve": resolve,
     "assemble": assemble,
-    "load": load
+    "load": load,
+    "plan": plan
 }
 
 
@@ -1,10 +1,17 @@
 from dataimport.file_manager import FileManager
 from dataimport import logger
+from dataimport.lib.fingerprint import file_hash
 
 
 class Datasource:
     ANALYSES = []
 
+    # the files produced by fetch, which determine everything produced by analyse
+    FETCHED_FILES = []
+
+    # the config which affects what analyse produces
+    CONFIG_KEYS = ["INTERMEDIATE_FORMAT", "COLUMNAR_COMPRESSION"]
+
     def __init__(self, config, id):
         self.id = id
         self.config = config
@@ -19,6 +26,11 @@ class Datasource:
     def analyse(self):
         raise NotImplementedError()
 
+    def fingerprint(self):
+        if len(self.FETCHED_FILES) == 0:
+            return None
+        return {f: file_hash(self.file_manager.file_path(f)) for f in self.FETCHED_FILES}
+
     def provides_analysis(self, analysis_class):
         return analysis_class in self.ANALYSES
 
@@ -1,36 +1,174 @@
 from dataimport.datasource import Datasource
 from dataimport.lib.secrets import get_secret
+from dataimport.lib import fanout, jsonstream, issn
 
-from dataimport.analyses.coincident_issns import CoincidentISSNs, CoincidentISSNsFromCSV
-from dataimport.analyses.titles import Titles, TitlesFromCSV
-from dataimport.analyses.publishers import Publishers, PublishersFromCSV
+from dataimport.analyses.coincident_issns import CoincidentISSNs, CoincidentISSNsFromCSV, CoincidentISSNsFromColumnar
+from dataimport.analyses.titles import Titles, TitlesFromCSV, TitlesFromColumnar
+from dataimport.analyses.publishers import Publishers, PublishersFromCSV, PublishersFromColumnar
 
-import requests
-import tarfile, json, csv
+import tarfile, json, csv, io, os, shutil
+from collections import deque
 from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+
+
+def extract_member(f, writer, chunk_size):
+    reader = io.TextIOWrapper(f, encoding="utf-8")
+    for journal in jsonstream.array_items(reader, chunk_size=chunk_size):
+        eissn = journal.get("bibjson", {}).get("eissn", "")
+        pissn = journal.get("bibjson", {}).get("pissn", "")
+        title = journal.get("bibjson", {}).get("title", "")
+        alt = journal.get("bibjson", {}).get("alternative_title", "")
+        publisher = journal.get("bibjson", {}).get("publisher", {}).get("name", "")
+        licences = json.dumps(journal.get("bibjson", {}).get("license", []))
+        row = [eissn, pissn, title, alt, publisher, licences]
+
+        licences = journal.get("bibjson", {}).get("license", [])
+        if len(licences) == 0:
+            writer.writerow(row)
+
+        for i, l in enumerate(licences):
+            lrow = deepcopy(row)
+            lrow += [
+                str(i + 1) + "/" + str(len(licences)),
+                l.get("type")
+            ]
+            writer.writerow(lrow)
+
+
+def extract_member_file(member_path, shard_path, chunk_size):
+    # runs in a worker process, so only deals in paths
+    with open(member_path, "rb") as f, open(shard_path, "w") as o:
+        extract_member(f, csv.writer(o), chunk_size)
+    os.remove(member_path)
+    return shard_path
+
+
+class CoincidentISSNsWriter(fanout.TabularAnalysisWriter):
+    FILENAME = "coincident_issns.csv"
+    COLUMNS = [("issn", "str"), ("coincident", "str")]
+
+    def start(self, stack):
+        super(CoincidentISSNsWriter, self).start(stack)
+        # the pairs are held as integer codes until they are written (see dataimport.lib.issn), in
+        # sorted runs which are spilled to a temporary directory for the duration of the analysis
+        self.codes = issn.Codes()
+        self.issn_pairs = issn.PairTable(stack.enter_context(self.file_manager.temp_dir()))
+
+    def write(self, row):
+        # Only valid ISSNs are kept, normalised to upper case, and something which is not an ISSN
+        # is treated as missing
+        eissn = self.codes[row[0]]
+        pissn = self.codes[row[1]]
+        if eissn != issn.EMPTY and pissn != issn.EMPTY:
+            self.issn_pairs.append(eissn, pissn)
+            self.issn_pairs.append(pissn, eissn)
+        elif eissn != issn.EMPTY:
+            self.issn_pairs.append(eissn)
+        elif pissn != issn.EMPTY:
+            self.issn_pairs.append(pissn)
+
+    def finish(self):
+        # written sorted, without the duplicates that a journal with several licences gives
+        self.writer.writerows(self.issn_pairs.rows())
+
+
+class TitleMapWriter(fanout.TabularAnalysisWriter):
+    FILENAME = "titles.csv"
+    COLUMNS = [("issn", "str"), ("title", "str"), ("type", "str")]
+
+    def write(self, row):
+        if row[0]:
+            if row[2]:
+                self.writer.writerow([row[0], row[2], "main"])
+            if row[3]:
+                self.writer.writerow([row[0], row[3], "alt"])
+        if row[1]:
+            if row[2]:
+                self.writer.writerow([row[1], row[2], "main"])
+            if row[3]:
+                self.writer.writerow([row[1], row[3], "alt"])
+
+
+class PublisherMapWriter(fanout.TabularAnalysisWriter):
+    FILENAME = "publishers.csv"
+    COLUMNS = [("issn", "str"), ("publisher", "str")]
+
+    def write(self, row):
+        if row[0]:
+            if row[4]:
+                self.writer.writerow([row[0], row[4]])
+        if row[1]:
+            if row[4]:
+                self.writer.writerow([row[1], row[4]])
+
+
+class LicenceMapWriter(fanout.TabularAnalysisWriter):
+    FILENAME = "licences.csv"
+    COLUMNS = [("issn", "str"), ("licences", "json")]
+
+    def start(self, stack):
+        super(LicenceMapWriter, self).start(stack)
+        # origin.csv holds the licences as JSON text, which a typed column can store as it really is
+        self._licences = json.loads if self.format == "columnar" else str
+
+    def write(self, row):
+        if row[0]:
+            if row[5]:
+                self.writer.writerow([row[0], self._licences(row[5])])
+        if row[1]:
+            if row[5]:
+                self.writer.writerow([row[1], self._licences(row[5])])
 
 
 class DOAJ(Datasource):
 
     ANALYSES = [CoincidentISSNs, Titles, Publishers]
 
+    FETCHED_FILES = ["origin.tar.gz"]
+
+    # each of these is fed every row of origin.csv in a single pass; add to this list
+    # to derive further analyses from the DOAJ data
+    ANALYSIS_WRITERS = [CoincidentISSNsWriter, TitleMapWriter, PublisherMapWriter, LicenceMapWriter]
+
     def fetch(self):
+        # only fetching needs an HTTP client, so it is not imported until now
+        from dataimport.lib import download, httpclient
+
         self.log("downloading latest data dump")
 
         url = self.config.DOAJ_PUBLIC_DATA_DUMP
         url += "?api_key=" + get_secret(self.config.DOAJ_PUBLIC_DATA_DUMP_KEYFILE)
 
-        resp = requests.get(url)
+        path = self.file_manager.file_path("origin.tar.gz")
+        previous = self.file_manager.previous_file_path("origin.tar.gz")
+
+        interrupted = self.file_manager.previous_file_path(download.partial_path("origin.tar.gz"))
+        if interrupted is not None:
+            self.log("resuming interrupted download from {x}".format(x=interrupted))
+            download.adopt_partial(interrupted, path)
+
+        result = download.download(url, path,
+                                   previous=previous,
+                                   chunk_size=self.config.DOAJ_DOWNLOAD_CHUNK_SIZE,
+                                   connections=self.config.DOAJ_DOWNLOAD_CONNECTIONS,
+                                   retries=self.config.DOAJ_DOWNLOAD_RETRIES,
+                                   timeout=self.config.DOAJ_DOWNLOAD_TIMEOUT,
+                                   session=httpclient.session(self.config))
 
-        with self.file_manager.output_file("origin.tar.gz", mode="wb") as tarball:
-            tarball.write(resp.content)
+        if result == download.NOT_MODIFIED:
+            self.log("data dump unchanged since {x}, re-using previous download".format(x=previous))
 
     def analyse(self):
         self._extract_doaj_data()
-        self._coincident_issns()
-        self._title_map()
-        self._publisher_map()
-        self._licence_map()
+
+        engine = fanout.FanOut()
+        for writer_class in self.ANALYSIS_WRITERS:
+            engine.register(writer_class(self.file_manager, self.config.INTERMEDIATE_FORMAT, self.config.COLUMNAR_COMPRESSION))
+
+        self.log("running {x} analyses over origin.csv".format(x=len(engine.writers)))
+        with self.file_manager.input_file("origin.csv") as doaj_file:
+            engine.run(csv.reader(doaj_file))
 
     def analysis(self, analysis_class):
         if analysis_class == CoincidentISSNs:
@@ -44,6 +182,12 @@ class DOAJ(Datasource):
         tarball = self.file_manager.file_path("origin.tar.gz")
         outfile = self.file_manager.file_path("origin.csv")
 
+        workers = self.config.DOAJ_EXTRACT_WORKERS
+        if workers > 1:
+            self.log("extracting data dump {x} to {y} with {z} workers".format(x=tarball, y=outfile, z=workers))
+            self._extract_doaj_data_parallel(tarball, workers)
+            return
+
         self.log("extracting data dump {x} to {y}".format(x=tarball, y=outfile))
 
         tf = tarfile.open(tarball, "r:gz")
@@ -55,106 +199,79 @@ class DOAJ(Datasource):
                 if entry is None:
                     break
                 f = tf.extractfile(entry)
-                j = json.loads(f.read())
-
-                for journal in j:
-                    eissn = journal.get("bibjson", {}).get("eissn", "")
-                    pissn = journal.get("bibjson", {}).get("pissn", "")
-                    title = journal.get("bibjson", {}).get("title", "")
-                    alt = journal.get("bibjson", {}).get("alternative_title", "")
-                    publisher = journal.get("bibjson", {}).get("publisher", {}).get("name", "")
-                    licences = json.dumps(journal.get("bibjson", {}).get("license", []))
-                    row = [eissn, pissn, title, alt, publisher, licences]
-
-                    licences = journal.get("bibjson", {}).get("license", [])
-                    if len(licences) == 0:
-                        writer.writerow(row)
-
-                    for i, l in enumerate(licences):
-                        lrow = deepcopy(row)
-                        lrow += [
-                            str(i + 1) + "/" + str(len(licences)),
-                            l.get("type")
-                        ]
-                        writer.writerow(lrow)
-
-    def _coincident_issns(self):
-        issn_pairs = []
-
-        with self.file_manager.input_file("origin.csv") as doaj_file:
-            reader = csv.reader(doaj_file)
-
-            for row in reader:
-                if row[0] and row[1]:
-                    issn_pairs.append([row[0], row[1]])
-                    issn_pairs.append([row[1], row[0]])
-                elif row[0] and not row[1]:
-                    issn_pairs.append([row[0], ""])
-                elif not row[0] and row[1]:
-                    issn_pairs.append([row[1], ""])
-
-        issn_pairs.sort(key=lambda x: x[0])
-
-        with self.file_manager.output_file("coincident_issns.csv") as outfile:
-            writer = csv.writer(outfile)
-            writer.writerows(issn_pairs)
+                if f is None:
+                    continue
+
+                extract_member(f, writer, self.config.DOAJ_JSON_CHUNK_SIZE)
+
+    def _extract_doaj_data_parallel(self, tarball, workers):
+        # Decompressing the tarball is inherently serial, so this process streams each member out
+        # to disk, and the workers do the JSON decoding and row building, each writing a CSV shard.
+        # Each shard is appended to origin.csv as soon as it and those before it are done, in member
+        # order, so origin.csv is identical to the one produced by the single process extraction.
+        # No more than workers * 2 members are written out ahead of the shards being appended, so
+        # only that many members and shards are ever on disk at once
+        shard_dir = self.file_manager.file_path("origin_shards")
+        os.makedirs(shard_dir, exist_ok=True)
+
+        pending = deque()
+        tf = tarfile.open(tarball, "r:gz")
+        try:
+            with self.file_manager.output_file("origin.csv", mode="wb") as o, \
+                    ProcessPoolExecutor(max_workers=workers) as executor:
+                try:
+                    idx = 0
+                    while True:
+                        entry = tf.next()
+                        if entry is None:
+                            break
+                        f = tf.extractfile(entry)
+                        if f is None:
+                            continue
+
+                        if len(pending) >= workers * 2:
+                            self._append_shard(o, pending.popleft())
+
+                        member_path = os.path.join(shard_dir, "{x:06d}.json".format(x=idx))
+                        shard_path = os.path.join(shard_dir, "{x:06d}.csv".format(x=idx))
+                        idx += 1
+                        with open(member_path, "wb") as m:
+                            shutil.copyfileobj(f, m, self.config.DOAJ_JSON_CHUNK_SIZE)
+
+                        pending.append(executor.submit(extract_member_file, member_path, shard_path, self.config.DOAJ_JSON_CHUNK_SIZE))
+
+                    while len(pending) > 0:
+                        self._append_shard(o, pending.popleft())
+                except BaseException:
+                    # don't go on to extract members which are no longer wanted
+                    for future in pending:
+                        future.cancel()
+                    raise
+        finally:
+            tf.close()
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+    def _append_shard(self, o, future):
+        shard = future.result()
+        with open(shard, "rb") as f:
+            shutil.copyfileobj(f, o)
+        os.remove(shard)
+
+    def _analysis_file(self, writer_class, csv_class, columnar_class):
+        # use the analysis in the configured format, but fall back to the other one if that is all there is
+        classes = {"csv": csv_class, "columnar": columnar_class}
+        formats = [self.config.INTERMEDIATE_FORMAT] + [f for f in ["csv", "columnar"] if f != self.config.INTERMEDIATE_FORMAT]
+        for format in formats:
+            path = self.file_manager.stored_path(writer_class.filename(format))
+            if path is not None:
+                return classes[format](self.id, filepath=path)
+        return classes[self.config.INTERMEDIATE_FORMAT](self.id, filepath=self.file_manager.file_path(writer_class.filename(self.config.INTERMEDIATE_FORMAT)))
 
     def _coincident_issns_analysis(self):
-        path = self.file_manager.file_path("coincident_issns.csv")
-        return CoincidentISSNsFromCSV(self.id, filepath=path)
-
-    def _title_map(self):
-        with self.file_manager.output_file("titles.csv") as outfile, \
-                self.file_manager.input_file("origin.csv") as doaj_file:
-            writer = csv.writer(outfile)
-            reader = csv.reader(doaj_file)
-
-            for row in reader:
-                if row[0]:
-                    if row[2]:
-                        writer.writerow([row[0], row[2], "main"])
-                    if row[3]:
-                        writer.writerow([row[0], row[3], "alt"])
-                if row[1]:
-                    if row[2]:
-                        writer.writerow([row[1], row[2], "main"])
-                    if row[3]:
-                        writer.writerow([row[1], row[3], "alt"])
+        return self._analysis_file(CoincidentISSNsWriter, CoincidentISSNsFromCSV, CoincidentISSNsFromColumnar)
 
     def _titles_analysis(self):
-        path = self.file_manager.file_path("titles.csv")
-        return TitlesFromCSV(self.id, filepath=path)
-
-    def _publisher_map(self):
-        with self.file_manager.output_file("publishers.csv") as outfile, \
-                self.file_manager.input_file("origin.csv") as doaj_file:
-
-            writer = csv.writer(outfile)
-            reader = csv.reader(doaj_file)
-
-            for row in reader:
-                if row[0]:
-                    if row[4]:
-                        writer.writerow([row[0], row[4]])
-                if row[1]:
-                    if row[4]:
-                        writer.writerow([row[1], row[4]])
+        return self._analysis_file(TitleMapWriter, TitlesFromCSV, TitlesFromColumnar)
 
     def _publisher_analysis(self):
-        path = self.file_manager.file_path("publishers.csv")
-        return PublishersFromCSV(self.id, filepath=path)
-
-    def _licence_map(self):
-        with self.file_manager.output_file("licences.csv") as outfile, \
-                self.file_manager.input_file("origin.csv") as doaj_file:
-
-            writer = csv.writer(outfile)
-            reader = csv.reader(doaj_file)
-
-            for row in reader:
-                if row[0]:
-                    if row[5]:
-                        writer.writerow([row[0], row[5]])
-                if row[1]:
-                    if row[5]:
-                        writer.writerow([row[1], row[5]])
\ No newline at end of file
+        return self._analysis_file(PublisherMapWriter, PublishersFromCSV, PublishersFromColumnar)
@@ -1,7 +1,18 @@
 from datetime import datetime
-import os, shutil
+import fcntl, json, os, shutil, tempfile, threading
 from contextlib import contextmanager
 
+from dataimport.lib import compression
+
+# each store keeps a manifest of its committed instances, and a pointer to the latest of them
+INSTANCES_FILE = "instances.json"
+LATEST_FILE = "latest"
+
+# locked by anything changing the manifest, in any process sharing the store
+LOCK_FILE = ".lock"
+
+_COMMIT_LOCK = threading.Lock()
+
 
 class FileManagerException(Exception):
     pass
@@ -31,27 +42,30 @@ class FileManager(object):
         # os.makedirs(self._instance, exist_ok=True)
 
     def current(self, make_fresh=False):
-        dirs = []
-        if not os.path.exists(self._dir):
+        # the current instance is the most recently committed one, so an instance which is still
+        # being written (or which was abandoned part way through) is never picked up
+        latest = self._latest()
+        if latest is None:
             if make_fresh:
                 self.fresh()
                 return
             else:
                 raise FileManagerException("Current directory does not exist, and make_fresh is False")
 
-        for entry in os.listdir(self._dir):
-            if os.path.isdir(os.path.join(self._dir, entry)):
-                dirs.append(entry)
+        self._instance = os.path.join(self._dir, latest)
 
-        if len(dirs) == 0:
-            if make_fresh:
-                self.fresh()
-                return
-            else:
-                raise FileManagerException("Current directory does not exist, and make_fresh is False")
-
-        dirs.sort(reverse=True)
-        self._instance = os.path.join(self._dir, dirs[0])
+    def commit(self):
+        # Mark this instance as complete, which makes it the current instance for this store.  The
+        # store's manifest of committed instances and its latest pointer are each replaced with a
+        # rename, so readers see either the old or the new state, never a partial one
+        self.activate()
+        name = os.path.basename(self._instance)
+        with self._store_lock():
+            committed = [n for n in self._committed() if n != name]
+            committed.append(name)
+            committed.sort(reverse=True)
+            self._write_store_file(INSTANCES_FILE, json.dumps({"instances": committed}, indent=2))
+            self._write_store_file(LATEST_FILE, committed[0])
 
     def activate(self):
         os.makedirs(self._instance, exist_ok=True)
@@ -61,49 +75,175 @@ class FileManager(object):
         return os.path.join(self._instance, filename)
 
     @contextmanager
-    def output_file(self, filename, mode="w"):
+    def output_file(self, filename, mode="w", raw=False):
+        # The file is compressed if the store's policy (config.STORE_COMPRESSION) says so, unless
+        # raw is set because it is going to be read by path, e.g. memory mapped
         self.activate()
-        path = self.file_path(filename)
-        with open(path, mode) as f:
+        codec, level = (None, None) if raw else compression.parse(self._compression_for(filename))
+        stored = filename + codec.extension if codec is not None else filename
+        compression.remove_variants(self._instance, filename, stored)
+        with compression.open_file(self.file_path(stored), mode, codec=codec, level=level) as f:
             yield f
 
     @contextmanager
     def input_file(self, filename, mode="r"):
         self.activate()
         path = self.file_path(filename)
-        with open(path, mode) as f:
+        codec = None
+        stored = self.stored_path(filename)
+        if stored is not None and stored != path:
+            path, codec = stored, compression.codec_for_path(stored)
+        with compression.open_file(path, mode, codec=codec) as f:
             yield f
 
-    def current_dir_created(self):
-        dirs = []
-        if not os.path.exists(self._dir):
-            return False
+    def stored_path(self, filename):
+        # the path of the file as it is actually stored (which may be compressed), or None
+        return self._stored_path(self._instance, filename)
 
-        for entry in os.listdir(self._dir):
-            if os.path.isdir(os.path.join(self._dir, entry)):
-                dirs.append(entry)
+    def exists(self, filename):
+        return self.stored_path(filename) is not None
 
-        if len(dirs) == 0:
-            return False
+    def _stored_path(self, instance, filename):
+        if instance is None:
+            return None
+        for name in compression.stored_names(filename):
+            path = os.path.join(instance, name)
+            if os.path.exists(path):
+                return path
+        return None
 
-        dirs.sort(reverse=True)
-        return datetime.strptime(dirs[0], self.config.DIR_DATE_FORMAT)
+    def _compression_for(self, filename):
+        return compression.policy(self.config.STORE_COMPRESSION.get(self._storage_id), filename)
+
+    @contextmanager
+    def temp_dir(self):
+        self.activate()
+        path = tempfile.mkdtemp(prefix="tmp_", dir=self._instance)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def instances(self):
+        # every instance in the store, committed or not, most recent first; for searching the
+        # store's history, e.g. for an interrupted download to resume
+        return [os.path.join(self._dir, d) for d in self._scan()]
+
+    def previous_file_path(self, filename):
+        # find the most recent copy of the file in an instance other than the one we are
+        # currently working in
+        for instance in self.instances():
+            if instance == self._instance:
+                continue
+            path = self._stored_path(instance, filename)
+            if path is not None:
+                return path
+        return None
+
+    def list_files(self):
+        if self._instance is None or not os.path.exists(self._instance):
+            return []
+        return sorted(f for f in os.listdir(self._instance) if os.path.isfile(os.path.join(self._instance, f)))
+
+    def link_in(self, source, filename):
+        # bring a file from elsewhere (usually another instance) into this instance, without copying
+        # it if the filesystem will let us
+        dest = self.file_path(filename)
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copyfile(source, dest)
+
+    def current_dir_created(self):
+        latest = self._latest()
+        if latest is None:
+            return False
+        return datetime.strptime(latest, self.config.DIR_DATE_FORMAT)
 
     def cleanup(self):
         if not os.path.exists(self._dir):
             return
 
+        keep_historic = self.config.STORE_KEEP_HISORIC[self._storage_id]
+
+        with self._store_lock():
+            committed = self._committed()
+            if len(committed) <= keep_historic:
+                return
+
+            kept = committed[:keep_historic]
+            self._write_store_file(INSTANCES_FILE, json.dumps({"instances": kept}, indent=2))
+
+        for remove in committed[keep_historic:]:
+            shutil.rmtree(os.path.join(self._dir, remove), ignore_errors=True)
+
+        # instances older than the oldest one we are keeping which were never committed were
+        # abandoned part way through, so they go too.  If none are kept there is no telling those
+        # from instances which are still being written, so they are left alone.
+        if len(kept) == 0:
+            return
+        for remove in self._scan():
+            if remove < kept[-1] and remove not in kept:
+                shutil.rmtree(os.path.join(self._dir, remove), ignore_errors=True)
+
+    def _latest(self):
+        path = os.path.join(self._dir, LATEST_FILE)
+        try:
+            with open(path, "r") as f:
+                latest = f.read().strip()
+        except FileNotFoundError:
+            latest = None
+
+        if latest and os.path.isdir(os.path.join(self._dir, latest)):
+            return latest
+
+        # a store written before instances were committed, or whose latest instance has been
+        # removed by hand
+        committed = self._committed()
+        return committed[0] if len(committed) > 0 else None
+
+    def _committed(self):
+        path = os.path.join(self._dir, INSTANCES_FILE)
+        try:
+            with open(path, "r") as f:
+                committed = json.load(f).get("instances", [])
+            return [c for c in committed if os.path.isdir(os.path.join(self._dir, c))]
+        except FileNotFoundError:
+            # until the first commit, every instance in the store counts as committed
+            return self._scan()
+
+    def _scan(self):
+        if not os.path.exists(self._dir):
+            return []
+
         dirs = []
         for entry in os.listdir(self._dir):
             if os.path.isdir(os.path.join(self._dir, entry)):
                 dirs.append(entry)
 
-        keep_historic = self.config.STORE_KEEP_HISORIC[self._storage_id]
-
-        if len(dirs) <= keep_historic:
-            return
-
         dirs.sort(reverse=True)
-        for remove in dirs[keep_historic:]:
-            removing = os.path.join(self._dir, remove)
-            shutil.rmtree(removing)
\ No newline at end of file
+        return dirs
+
+    @contextmanager
+    def _store_lock(self):
+        # _COMMIT_LOCK keeps out the other threads of this process, and the lock file other
+        # processes (flock locks are per open file, so it would not keep out other threads)
+        os.makedirs(self._dir, exist_ok=True)
+        with _COMMIT_LOCK, open(os.path.join(self._dir, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_store_file(self, filename, content):
+        os.makedirs(self._dir, exist_ok=True)
+        path = os.path.join(self._dir, filename)
+        tmp = "{x}.{y}.{z}.tmp".format(x=path, y=os.getpid(), z=threading.get_ident())
+        with open(tmp, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
@@ -0,0 +1,17 @@
+from dataimport.format import Format
+from dataimport.lib import columnar
+
+
+class ColumnarFeed(Format):
+    def entries(self):
+        raise NotImplementedError()
+
+
+class ColumnarFile(ColumnarFeed):
+    def __init__(self, path):
+        super(ColumnarFile, self).__init__()
+        self._path = path
+
+    def entries(self):
+        for row in columnar.read_rows(self._path):
+            yield row
@@ -1,4 +1,5 @@
 from dataimport.format import Format
+from dataimport.lib import compression
 import json
 
 
@@ -13,6 +14,6 @@ class LineByLineJSON(JSONFeed):
         self._path = path
 
     def entries(self):
-        with open(self._path) as f:
+        with compression.open_stored(self._path) as f:
             for line in f:
                 yield json.loads(line)
\ No newline at end of file
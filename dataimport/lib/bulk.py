@@ -0,0 +1,200 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from dataimport import logger
+
+# actions which are followed by a source line in a bulk stream
+SOURCE_ACTIONS = ["index", "create", "update"]
+
+# item and request statuses which mean the cluster is overloaded, and the operation should be tried again
+REJECTED = [429, 503]
+
+
+class BulkException(Exception):
+    pass
+
+
+def operations(lines):
+    # group the lines of a bulk stream into operations, each of which is an action line followed,
+    # for those actions which need one, by a source line
+    lines = iter(lines)
+    for action_line in lines:
+        if not action_line.strip():
+            continue
+        if not action_line.endswith("\n"):
+            action_line += "\n"
+        action = json.loads(action_line)
+        source_line = None
+        if any(a in action for a in SOURCE_ACTIONS):
+            source_line = next(lines, None)
+            if source_line is None:
+                raise BulkException("Bulk stream ended before the source for {x}".format(x=action_line.strip()))
+            if not source_line.endswith("\n"):
+                source_line += "\n"
+        yield action_line, source_line
+
+
+def batches(ops, max_docs, max_bytes):
+    # sizes are of the encoded request body, not the number of characters
+    batch = []
+    size = 0
+    for op in ops:
+        op_size = len(op[0].encode("utf-8")) + (len(op[1].encode("utf-8")) if op[1] is not None else 0)
+        if len(batch) > 0 and (len(batch) >= max_docs or size + op_size > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(op)
+        size += op_size
+    if len(batch) > 0:
+        yield batch
+
+
+class _Backpressure(object):
+    # shared between the workers, so that when the cluster rejects one of them, they all hold off
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = 0
+
+    def wait(self):
+        delay = self._until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._until = max(self._until, time.time() + seconds)
+
+
+class BulkLoader(object):
+    def __init__(self, url, workers=4, max_docs=5000, max_bytes=10 * 1024 * 1024,
+                 retries=5, backoff=1, timeout=120, log=None):
+        self.url = url
+        self.workers = workers
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._log = log
+        self._backpressure = _Backpressure()
+        self._local = threading.local()
+
+    def log(self, msg):
+        if self._log is not None:
+            self._log(msg)
+        else:
+            logger.log(msg, "BULK")
+
+    def load(self, lines):
+        # Send the bulk stream in lines to the cluster as size and document capped batches,
+        # from a pool of concurrent workers.  Only a bounded number of batches are held in
+        # memory at once.  Returns a report of the load; raises a BulkException if any of
+        # the operations could not be completed.
+        report = {"batches": 0, "docs": 0, "bytes": 0, "failed": 0, "errors": []}
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        start = time.time()
+
+        def send(number, batch):
+            try:
+                result = self._send_batch(number, batch)
+                with lock:
+                    report["batches"] += 1
+                    report["docs"] += result["docs"]
+                    report["bytes"] += result["bytes"]
+                    report["failed"] += len(result["errors"])
+                    report["errors"] += result["errors"][:10]
+            finally:
+                slots.release()
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for number, batch in enumerate(batches(operations(lines), self.max_docs, self.max_bytes)):
+                slots.acquire()
+                futures.append(executor.submit(send, number, batch))
+
+                # stop feeding the workers as soon as one of them has hit an unrecoverable error
+                for f in futures:
+                    if f.done():
+                        f.result()
+                futures = [f for f in futures if not f.done()]
+
+        for f in futures:
+            f.result()
+
+        report["seconds"] = time.time() - start
+        self.log("bulk load complete: {x} docs in {y} batches in {z:.1f}s ({r:.0f} docs/s), {f} failed".format(
+            x=report["docs"], y=report["batches"], z=report["seconds"],
+            r=report["docs"] / report["seconds"] if report["seconds"] > 0 else 0, f=report["failed"]))
+
+        if report["failed"] > 0:
+            raise BulkException("{x} bulk operations failed, e.g. {y}".format(x=report["failed"], y=report["errors"][:3]))
+        return report
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _send_batch(self, number, batch):
+        start = time.time()
+        docs = len(batch)
+        size = 0
+        errors = []
+        attempt = 0
+
+        while len(batch) > 0:
+            self._backpressure.wait()
+
+            body = "".join(a + (s if s is not None else "") for a, s in batch).encode("utf-8")
+            size += len(body)
+
+            retry = []
+            try:
+                resp = self._session().post(self.url, data=body, timeout=self.timeout,
+                                            headers={"Content-Type": "application/x-ndjson"})
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retry = batch
+                reason = str(e)
+            else:
+                if resp.status_code in REJECTED:
+                    retry = batch
+                    reason = "request rejected with status {x}".format(x=resp.status_code)
+                elif resp.status_code >= 400:
+                    raise BulkException("Bulk request failed with status {x}: {y}".format(x=resp.status_code, y=resp.text[:500]))
+                else:
+                    items = resp.json().get("items", [])
+                    for op, item in zip(batch, items):
+                        result = list(item.values())[0]
+                        status = result.get("status", 200)
+                        if status in REJECTED:
+                            retry.append(op)
+                        elif status >= 300 and not (status == 404 and "delete" in item):
+                            errors.append(result.get("error", status))
+                    reason = "{x} items rejected".format(x=len(retry))
+
+            if len(retry) == 0:
+                break
+
+            attempt += 1
+            if attempt > self.retries:
+                errors += ["gave up after {x} retries: {y}".format(x=self.retries, y=reason)] * len(retry)
+                break
+
+            delay = self.backoff * 2 ** (attempt - 1)
+            self.log("batch {n}: {r}, retrying {x} operations in {d}s".format(n=number, r=reason, x=len(retry), d=delay))
+            self._backpressure.pause(delay)
+            batch = retry
+
+        seconds = time.time() - start
+        self.log("batch {n}: {x} docs, {y} bytes in {z:.2f}s ({r:.0f} docs/s)".format(
+            n=number, x=docs, y=size, z=seconds, r=docs / seconds if seconds > 0 else 0))
+
+        return {"docs": docs, "bytes": size, "errors": errors}
@@ -0,0 +1,203 @@
+import json
+import struct
+from array import array
+
+from dataimport.lib import compression
+
+# A compact binary file of typed columns, written in blocks of rows.  Within a block each column
+# is stored contiguously (and optionally compressed), so that it can be decoded in one go rather
+# than value by value.
+#
+# File:   MAGIC, header length (uint32), header (JSON: columns and compression), blocks...
+# Block:  row count (uint32), then for each column: byte length (uint32), column bytes
+#
+# Column types:
+#   str      - utf-8 values joined with a NUL separator
+#   strlist  - each value a list of strings, joined with a unit separator, then stored as str
+#   int      - signed 64 bit integers
+#   json     - values serialised as JSON, then stored as str
+
+MAGIC = b"DICOL\x01"
+BLOCK_ROWS = 65536
+
+STR_SEP = "\0"
+LIST_SEP = "\x1f"
+
+UINT32 = struct.Struct("<I")
+
+def _none():
+    return (lambda b: b, lambda b: b)
+
+
+# each returns the codec's (compress, decompress) functions, importing its library only when needed
+def _zlib():
+    import zlib
+    return (lambda b: zlib.compress(b, 1), zlib.decompress)
+
+
+def _bz2():
+    import bz2
+    return (bz2.compress, bz2.decompress)
+
+
+def _lzma():
+    import lzma
+    return (lzma.compress, lzma.decompress)
+
+
+CODECS = {
+    None: _none,
+    "zlib": _zlib,
+    "bz2": _bz2,
+    "lzma": _lzma
+}
+
+
+class ColumnarException(Exception):
+    pass
+
+
+def _encode_strs(values):
+    joined = STR_SEP.join(values)
+    if joined.count(STR_SEP) != max(len(values) - 1, 0):
+        raise ColumnarException("str values may not contain NUL characters")
+    return joined.encode("utf-8")
+
+
+def _decode_strs(data, count):
+    if count == 0:
+        return []
+    return data.decode("utf-8").split(STR_SEP)
+
+
+def _encode_strlists(values):
+    return _encode_strs([LIST_SEP.join(v) for v in values])
+
+
+def _decode_strlists(data, count):
+    return [v.split(LIST_SEP) if v else [] for v in _decode_strs(data, count)]
+
+
+def _encode_ints(values):
+    return array("q", values).tobytes()
+
+
+def _decode_ints(data, count):
+    a = array("q")
+    a.frombytes(data)
+    return a.tolist()
+
+
+def _encode_json(values):
+    return _encode_strs([json.dumps(v) for v in values])
+
+
+def _decode_json(data, count):
+    return [json.loads(v) for v in _decode_strs(data, count)]
+
+
+TYPES = {
+    "str": (_encode_strs, _decode_strs),
+    "strlist": (_encode_strlists, _decode_strlists),
+    "int": (_encode_ints, _decode_ints),
+    "json": (_encode_json, _decode_json)
+}
+
+
+class ColumnarWriter(object):
+    def __init__(self, handle, columns, compression="zlib", block_rows=BLOCK_ROWS):
+        # columns is a list of (name, type) pairs, and handle must be binary
+        for name, type_ in columns:
+            if type_ not in TYPES:
+                raise ColumnarException("Unknown column type {x} for {y}".format(x=type_, y=name))
+        if compression not in CODECS:
+            raise ColumnarException("Unknown compression {x}".format(x=compression))
+
+        self._handle = handle
+        self._columns = columns
+        self._compress = CODECS[compression]()[0]
+        self._block_rows = block_rows
+        self._rows = []
+
+        header = json.dumps({"columns": [[n, t] for n, t in columns], "compression": compression}).encode("utf-8")
+        handle.write(MAGIC)
+        handle.write(UINT32.pack(len(header)))
+        handle.write(header)
+
+    def writerow(self, row):
+        if len(row) != len(self._columns):
+            raise ColumnarException("Row has {x} values, expected {y}".format(x=len(row), y=len(self._columns)))
+        self._rows.append(row)
+        if len(self._rows) >= self._block_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if len(self._rows) == 0:
+            return
+        columns = list(zip(*self._rows))
+        self._handle.write(UINT32.pack(len(self._rows)))
+        for (name, type_), values in zip(self._columns, columns):
+            data = self._compress(TYPES[type_][0](list(values)))
+            self._handle.write(UINT32.pack(len(data)))
+            self._handle.write(data)
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ColumnarReader(object):
+    def __init__(self, handle):
+        self._handle = handle
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise ColumnarException("Not a columnar file")
+        header_length = UINT32.unpack(handle.read(UINT32.size))[0]
+        header = json.loads(handle.read(header_length).decode("utf-8"))
+        self.columns = [tuple(c) for c in header["columns"]]
+        self._decompress = CODECS[header["compression"]]()[1]
+
+    def blocks(self, shard=0, shards=1):
+        # each block as a list of columns; if shards > 1, only every shards-th block, starting at
+        # shard, is decoded, and the others are skipped over
+        i = 0
+        while True:
+            raw = self._handle.read(UINT32.size)
+            if not raw:
+                return
+            count = UINT32.unpack(raw)[0]
+            mine = i % shards == shard
+            i += 1
+            columns = []
+            for name, type_ in self.columns:
+                length = UINT32.unpack(self._handle.read(UINT32.size))[0]
+                if not mine:
+                    self._handle.seek(length, 1)
+                    continue
+                data = self._decompress(self._handle.read(length))
+                columns.append(TYPES[type_][1](data, count))
+            if mine:
+                yield columns
+
+    def rows(self, shard=0, shards=1):
+        for columns in self.blocks(shard, shards):
+            for row in zip(*columns):
+                yield list(row)
+
+    def __iter__(self):
+        return self.rows()
+
+
+def read_rows(path, shard=0, shards=1):
+    with compression.open_stored(path, "rb") as f:
+        for row in ColumnarReader(f).rows(shard, shards):
+            yield row
@@ -0,0 +1,109 @@
+import io
+import os
+from fnmatch import fnmatch
+
+# Codecs for files in the store.  A compressed file is stored under its logical name plus the
+# codec's extension (origin.csv -> origin.csv.gz), so that it can always be read back, whatever the
+# storage policy is by then.  Further codecs (e.g. zstd, where it is installed) can be added with
+# register().
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class CompressionException(Exception):
+    pass
+
+
+class Codec(object):
+    def __init__(self, name, extension, opener):
+        # opener(path, mode, level) must return a binary file object, for mode "rb", "wb" or "ab"
+        self.name = name
+        self.extension = extension
+        self.opener = opener
+
+
+# the codec libraries are only imported when a file actually uses them
+def _gzip(path, mode, level):
+    import gzip
+    return gzip.GzipFile(path, mode, compresslevel=level if level is not None else 6)
+
+
+def _bz2(path, mode, level):
+    import bz2
+    return bz2.BZ2File(path, mode, compresslevel=level if level is not None else 9)
+
+
+def _lzma(path, mode, level):
+    import lzma
+    return lzma.LZMAFile(path, mode, preset=level)
+
+
+CODECS = {}
+
+
+def register(name, extension, opener):
+    CODECS[name] = Codec(name, extension, opener)
+
+
+register("gzip", ".gz", _gzip)
+register("bz2", ".bz2", _bz2)
+register("lzma", ".xz", _lzma)
+
+
+def parse(spec):
+    # a codec is given as its name, optionally with a level, e.g. "gzip" or "gzip:1"
+    if spec is None:
+        return None, None
+    name, _, level = spec.partition(":")
+    if name not in CODECS:
+        raise CompressionException("Unknown compression codec {x}".format(x=name))
+    return CODECS[name], int(level) if level else None
+
+
+def policy(rules, filename):
+    # rules are {glob: codec spec}, and the first glob to match the filename wins
+    for pattern, spec in (rules or {}).items():
+        if fnmatch(filename, pattern):
+            return spec
+    return None
+
+
+def codec_for_path(path):
+    for codec in CODECS.values():
+        if path.endswith(codec.extension):
+            return codec
+    return None
+
+
+def stored_names(filename):
+    # the names under which a file could be stored, plain first
+    return [filename] + [filename + c.extension for c in CODECS.values()]
+
+
+def open_file(path, mode="r", codec=None, level=None, buffer_size=BUFFER_SIZE):
+    # Open path, through the codec if there is one, with large buffers either way.  Text modes
+    # behave as the builtin open() does.
+    if codec is None:
+        return open(path, mode, buffering=buffer_size)
+
+    binary_mode = mode.replace("t", "").replace("b", "") + "b"
+    raw = codec.opener(path, binary_mode, level)
+    if "r" in binary_mode:
+        buffered = io.BufferedReader(raw, buffer_size=buffer_size)
+    else:
+        buffered = io.BufferedWriter(raw, buffer_size=buffer_size)
+
+    if "b" in mode:
+        return buffered
+    return io.TextIOWrapper(buffered)
+
+
+def open_stored(path, mode="r", buffer_size=BUFFER_SIZE):
+    # open a file found in the store, decompressing it if its name says it is compressed
+    return open_file(path, mode, codec=codec_for_path(path), buffer_size=buffer_size)
+
+
+def remove_variants(directory, filename, keep):
+    for name in stored_names(filename):
+        if name != keep and os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,56 @@
+class DisjointSet(object):
+    # Union-find over hashable items, with union by size and path compression, so that
+    # clustering n items from m pairs is effectively linear in m
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def __len__(self):
+        return len(self._parent)
+
+    def __contains__(self, item):
+        return item in self._parent
+
+    def add(self, item):
+        if item not in self._parent:
+            self._parent[item] = item
+            self._size[item] = 1
+
+    def find(self, item):
+        parent = self._parent
+        root = item
+        while parent[root] != root:
+            root = parent[root]
+
+        # compress the path, so every item we passed through points directly at the root
+        while parent[item] != root:
+            parent[item], item = root, parent[item]
+
+        return root
+
+    def union(self, a, b):
+        self.add(a)
+        self.add(b)
+        ra = self.find(a)
+        rb = self.find(b)
+        if ra == rb:
+            return ra
+
+        if self._size[ra] < self._size[rb]:
+            ra, rb = rb, ra
+        self._parent[rb] = ra
+        self._size[ra] += self._size.pop(rb)
+        return ra
+
+    def groups(self):
+        # each group as a sorted list, with the groups ordered by their first member
+        members = {}
+        for item in self._parent:
+            root = self.find(item)
+            if root not in members:
+                members[root] = []
+            members[root].append(item)
+
+        groups = [sorted(m) for m in members.values()]
+        groups.sort()
+        return groups
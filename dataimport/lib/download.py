@@ -0,0 +1,311 @@
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not_modified"
+
+CONTENT_RANGE_RX = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+RETRYABLE = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class DownloadException(Exception):
+    pass
+
+
+class IncompleteDownload(DownloadException):
+    pass
+
+
+def partial_path(path):
+    return path + ".part"
+
+
+def validators_path(path):
+    return path + ".http.json"
+
+
+def read_validators(path):
+    if path is None:
+        return {}
+    vpath = validators_path(path)
+    if not os.path.exists(vpath):
+        return {}
+    with open(vpath, "r") as f:
+        return json.load(f)
+
+
+def write_validators(path, validators):
+    with open(validators_path(path), "w") as f:
+        json.dump(validators, f)
+
+
+def download(url, path, previous=None, chunk_size=1024 * 1024, connections=1, retries=5, backoff=2, timeout=60, session=None):
+    # Stream the resource at url to path, via a partial file which can be resumed with HTTP Range
+    # requests if the connection drops.  If previous is the path to an earlier download of the
+    # same resource, its recorded ETag/Last-Modified are used to determine whether the resource
+    # has changed; if it has not, the previous file is linked into path and nothing is downloaded.
+    #
+    # If connections is greater than 1 and the server supports byte ranges, the download is split
+    # into that many byte ranges which are fetched concurrently and then joined.
+    if session is None:
+        session = requests.Session()
+
+    previous_validators = read_validators(previous)
+    info = _probe(session, url, timeout)
+
+    if previous is not None and _unchanged(previous_validators, info):
+        _link(previous, path)
+        write_validators(path, previous_validators)
+        return NOT_MODIFIED
+
+    part = partial_path(path)
+    validators = _check_partial(part, _validators(info))
+
+    if connections > 1 and info.get("ranges") and info.get("length"):
+        _download_ranges(session, info.get("url", url), part, info["length"], validators, chunk_size, connections, retries, backoff, timeout)
+    else:
+        conditional = {}
+        if previous is not None:
+            conditional = _conditional_headers(previous_validators)
+        result = _download_stream(session, url, part, validators, conditional, chunk_size, retries, backoff, timeout)
+        if result is None:
+            _link(previous, path)
+            write_validators(path, previous_validators)
+            return NOT_MODIFIED
+        validators = result
+
+    os.replace(part, path)
+    if os.path.exists(validators_path(part)):
+        os.remove(validators_path(part))
+    write_validators(path, validators)
+    return DOWNLOADED
+
+
+def adopt_partial(part, path):
+    # move a partial download (and any range segments) left by an earlier, failed, attempt so
+    # that a download to path can pick up where it left off
+    target = partial_path(path)
+    for segment in _segments(part):
+        os.replace(segment, target + segment[len(part):])
+
+
+def _probe(session, url, timeout):
+    try:
+        resp = session.head(url, allow_redirects=True, timeout=timeout)
+    except RETRYABLE:
+        return {}
+
+    # some servers (e.g. pre-signed object store urls) will not answer a HEAD request, in which
+    # case we will learn what we need from the GET
+    if resp.status_code >= 400:
+        return {}
+
+    length = resp.headers.get("Content-Length")
+    return {
+        "url": resp.url,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "length": int(length) if length is not None and length.isdigit() else None,
+        "ranges": resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+    }
+
+
+def _validators(headers):
+    return {
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last_modified"),
+        "length": headers.get("length")
+    }
+
+
+def _unchanged(previous, info):
+    if not previous or not info:
+        return False
+    if info.get("etag") is not None:
+        return info.get("etag") == previous.get("etag")
+    if info.get("last_modified") is not None:
+        return info.get("last_modified") == previous.get("last_modified") and \
+               info.get("length") == previous.get("length")
+    return False
+
+
+def _conditional_headers(validators):
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def _check_partial(part, validators):
+    # a partial file left over from an earlier attempt can only be resumed if it is a partial
+    # copy of the same version of the resource.  If we don't know the current version, we keep
+    # the partial and rely on If-Range to give us the whole resource if it has changed
+    recorded = read_validators(part)
+    if recorded:
+        if validators.get("etag") is None and validators.get("last_modified") is None:
+            return recorded
+        if validators.get("etag") is not None and recorded.get("etag") == validators.get("etag"):
+            return validators
+        if validators.get("etag") is None and recorded.get("last_modified") == validators.get("last_modified"):
+            return validators
+
+    for segment in _segments(part):
+        os.remove(segment)
+    return validators
+
+
+def _segments(part):
+    directory, name = os.path.split(part)
+    directory = directory or "."
+    segment_rx = re.compile("^" + re.escape(name) + r"(\.\d+|\.http\.json)?$")
+    return [os.path.join(directory, f) for f in os.listdir(directory) if segment_rx.match(f)]
+
+
+def _if_range(validators):
+    # If-Range only accepts a strong ETag or a date
+    etag = validators.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return validators.get("last_modified")
+
+
+def _download_stream(session, url, part, validators, conditional, chunk_size, retries, backoff, timeout):
+    attempt = 0
+    while True:
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {}
+        if offset > 0:
+            headers["Range"] = "bytes={x}-".format(x=offset)
+            if_range = _if_range(validators)
+            if if_range:
+                headers["If-Range"] = if_range
+        else:
+            headers.update(conditional)
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+                if resp.status_code == 304:
+                    return None
+
+                if resp.status_code == 416 and validators.get("length") == offset:
+                    return validators
+
+                resp.raise_for_status()
+
+                validators = {
+                    "etag": resp.headers.get("ETag", validators.get("etag")),
+                    "last_modified": resp.headers.get("Last-Modified", validators.get("last_modified")),
+                    "length": validators.get("length")
+                }
+
+                if resp.status_code == 206:
+                    start, total = _content_range(resp)
+                    if start != offset:
+                        raise DownloadException("Server returned range starting at {x}, expected {y}".format(x=start, y=offset))
+                    mode = "ab"
+                else:
+                    total = resp.headers.get("Content-Length")
+                    total = int(total) if total is not None and total.isdigit() else None
+                    mode = "wb"
+                if total is not None:
+                    validators["length"] = total
+                write_validators(part, validators)
+
+                with open(part, mode) as f:
+                    for chunk in resp.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+
+            size = os.path.getsize(part)
+            if validators.get("length") is not None and size < validators["length"]:
+                raise IncompleteDownload("Received {x} of {y} bytes".format(x=size, y=validators["length"]))
+
+            return validators
+
+        except RETRYABLE + (IncompleteDownload,):
+            attempt += 1
+            if attempt > retries:
+                raise
+            time.sleep(backoff * attempt)
+
+
+def _content_range(resp):
+    match = CONTENT_RANGE_RX.match(resp.headers.get("Content-Range", ""))
+    if match is None:
+        raise DownloadException("Unable to interpret Content-Range header")
+    total = match.group(3)
+    return int(match.group(1)), int(total) if total != "*" else None
+
+
+def _download_ranges(session, url, part, length, validators, chunk_size, connections, retries, backoff, timeout):
+    size = -(-length // connections)
+    ranges = [(i, i * size, min((i + 1) * size, length) - 1) for i in range(connections) if i * size < length]
+    write_validators(part, validators)
+
+    def fetch(r):
+        idx, start, end = r
+        segment = part + "." + str(idx)
+        _download_range(session, url, segment, start, end, validators, chunk_size, retries, backoff, timeout)
+        return segment
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        segments = list(executor.map(fetch, ranges))
+
+    with open(part, "wb") as o:
+        for segment in segments:
+            with open(segment, "rb") as f:
+                shutil.copyfileobj(f, o, chunk_size)
+
+    for segment in segments:
+        os.remove(segment)
+
+    if os.path.getsize(part) != length:
+        raise DownloadException("Joined {x} bytes, expected {y}".format(x=os.path.getsize(part), y=length))
+
+
+def _download_range(session, url, segment, start, end, validators, chunk_size, retries, backoff, timeout):
+    expected = end - start + 1
+    attempt = 0
+    while True:
+        offset = os.path.getsize(segment) if os.path.exists(segment) else 0
+        if offset >= expected:
+            return
+
+        headers = {"Range": "bytes={x}-{y}".format(x=start + offset, y=end)}
+        if_range = _if_range(validators)
+        if if_range:
+            headers["If-Range"] = if_range
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+                if resp.status_code != 206:
+                    # the server has either ignored the range or the resource changed under us
+                    raise DownloadException("Expected partial content, got status {x}".format(x=resp.status_code))
+                with open(segment, "ab") as f:
+                    for chunk in resp.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+
+            if os.path.getsize(segment) < expected:
+                raise IncompleteDownload("Received {x} of {y} bytes for range {a}-{b}".format(
+                    x=os.path.getsize(segment), y=expected, a=start, b=end))
+        except RETRYABLE + (IncompleteDownload,):
+            attempt += 1
+            if attempt > retries:
+                raise
+            time.sleep(backoff * attempt)
+
+
+def _link(source, dest):
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
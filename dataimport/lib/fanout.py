@@ -0,0 +1,78 @@
+import csv
+import os
+from contextlib import ExitStack
+
+from dataimport.lib import columnar, metrics
+
+COLUMNAR_EXTENSION = ".col"
+
+
+class AnalysisWriter(object):
+    def __init__(self, file_manager):
+        self.file_manager = file_manager
+
+    def start(self, stack):
+        pass
+
+    def write(self, row):
+        raise NotImplementedError()
+
+    def finish(self):
+        pass
+
+
+class TabularAnalysisWriter(AnalysisWriter):
+    # Writes rows to FILENAME as CSV, or, if the format is "columnar", to a columnar file of the
+    # same name with a .col extension, using the column types in COLUMNS
+    FILENAME = None
+    COLUMNS = None
+
+    def __init__(self, file_manager, format="csv", compression=None):
+        super(TabularAnalysisWriter, self).__init__(file_manager)
+        self.format = format
+        self.compression = compression
+        self.writer = None
+
+    @classmethod
+    def filename(cls, format="csv"):
+        if format == "columnar":
+            return os.path.splitext(cls.FILENAME)[0] + COLUMNAR_EXTENSION
+        return cls.FILENAME
+
+    def start(self, stack):
+        if self.format == "columnar":
+            handle = stack.enter_context(self.file_manager.output_file(self.filename(self.format), mode="wb"))
+            self.writer = columnar.ColumnarWriter(handle, self.COLUMNS, compression=self.compression)
+            stack.callback(self.writer.close)
+        else:
+            handle = stack.enter_context(self.file_manager.output_file(self.filename(self.format)))
+            self.writer = csv.writer(handle)
+
+
+class FanOut(object):
+    # Feeds every row of a single pass over some input to all the registered analysis
+    # writers, so that an input file only has to be read and parsed once, however many
+    # analyses are derived from it.
+    def __init__(self):
+        self._writers = []
+
+    def register(self, writer):
+        self._writers.append(writer)
+        return writer
+
+    @property
+    def writers(self):
+        return self._writers
+
+    def run(self, rows):
+        with ExitStack() as stack:
+            for writer in self._writers:
+                writer.start(stack)
+
+            writes = [writer.write for writer in self._writers]
+            for row in metrics.counted(rows, "rows_in"):
+                for write in writes:
+                    write(row)
+
+            for writer in self._writers:
+                writer.finish()
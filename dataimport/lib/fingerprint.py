@@ -0,0 +1,14 @@
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path, algorithm="sha256", chunk_size=CHUNK_SIZE):
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return algorithm + ":" + h.hexdigest()
@@ -0,0 +1,35 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_sessions = {}
+
+
+class PooledSession(requests.Session):
+    # A session which keeps a pool of connections open to each host it talks to, blocks once there
+    # are max_per_host connections in use to a host (so concurrent callers queue rather than open
+    # ever more connections), and applies a default timeout to every request
+    def __init__(self, timeout=60, max_hosts=10, max_per_host=4):
+        super(PooledSession, self).__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_per_host, pool_block=True)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super(PooledSession, self).request(method, url, **kwargs)
+
+
+def session(config):
+    # one shared session per configuration, so that every component fetching over HTTP re-uses
+    # the same connection pools
+    key = id(config)
+    with _lock:
+        if key not in _sessions:
+            _sessions[key] = PooledSession(timeout=config.HTTP_TIMEOUT,
+                                           max_hosts=config.HTTP_MAX_HOSTS,
+                                           max_per_host=config.HTTP_MAX_PER_HOST)
+        return _sessions[key]
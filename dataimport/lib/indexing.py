@@ -1,25 +1,36 @@
 import string
-from unidecode import unidecode
+from functools import lru_cache
+
+VARIANT_CACHE_SIZE = 65536
+
+THROW_TABLE = str.maketrans("", "", string.punctuation + '\n\t')
 
 
 def title_variants(title):
-    title = title.strip().lower()
+    # the variants are memoised, so hand out a fresh list which the caller is free to modify
+    return list(_variants(title.strip().lower()))
+
+
+@lru_cache(maxsize=VARIANT_CACHE_SIZE)
+def _variants(title):
     variants = [title]
     variants += _asciifold(title)
     variants += [x[4:] for x in variants if x.startswith("the ")]
     variants += [x for x in [_ampersander(t) for t in variants] if x is not None]
-    return list(set(variants))
+    return tuple(set(variants))
 
 
 def _asciifold(val):
+    # unidecode is slow to import, and only needed once we are indexing (and then, as the variants
+    # are memoised, once per distinct title), so it is imported here
+    from unidecode import unidecode
     try:
         asciititle = unidecode(val)
     except:
         asciititle = val
 
-    throwlist = string.punctuation + '\n\t'
-    unpunctitle = "".join(c for c in val if c not in throwlist).strip()
-    asciiunpunctitle = "".join(c for c in asciititle if c not in throwlist).strip()
+    unpunctitle = val.translate(THROW_TABLE).strip()
+    asciiunpunctitle = asciititle.translate(THROW_TABLE).strip()
 
     return [unpunctitle, asciititle, asciiunpunctitle]
 
@@ -29,4 +40,4 @@ def _ampersander(val):
         return val.replace(" & ", " and ")
     if " and " in val:
         return val.replace(" and ", " & ")
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,170 @@
+import heapq
+import os
+import tempfile
+from array import array
+from itertools import repeat
+from operator import lshift, or_
+
+# ISSNs as integers.  An ISSN is seven digits and a check character (a digit or X), so it is
+# encoded as the seven digits times eleven plus the value of the check character (X is 10), plus
+# one, which keeps 0 free to stand for "no ISSN".  Codes sort in the same order as the (upper case)
+# ISSN strings do, with "no ISSN" first, as the empty string sorts.
+#
+# A pair of codes is packed into a single 64 bit integer, so that a table of pairs can be stored
+# in an array, eight bytes a pair, and sorted and de-duplicated as plain integers.  ISSNs are only
+# turned back into strings at output.
+#
+# As with the ISSN_RX check this replaces, the check digit itself is not verified.
+
+EMPTY = 0
+
+# pairs in each sorted run of a PairTable, and read at a time from a spilled run
+RUN_SIZE = 1000000
+BLOCK_SIZE = 64 * 1024
+
+_ITEM_SIZE = array("Q").itemsize
+_DIGITS = "0123456789"
+_SHIFT = 32
+_MASK = (1 << _SHIFT) - 1
+
+
+def encode(issn):
+    # the code for an ISSN string, in either case, or None if it is not one
+    if len(issn) != 9 or issn[4] != "-":
+        return None
+    digits = issn[:4] + issn[5:8]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    check = issn[8]
+    if check in _DIGITS:
+        value = ord(check) - 48
+    elif check == "X" or check == "x":
+        value = 10
+    else:
+        return None
+    return int(digits) * 11 + value + 1
+
+
+def decode(code):
+    if code == EMPTY:
+        return ""
+    digits, check = divmod(code - 1, 11)
+    return "%04d-%03d%s" % (digits // 1000, digits % 1000, "X" if check == 10 else check)
+
+
+def unpack(key):
+    return key >> _SHIFT, key & _MASK
+
+
+class Codes(dict):
+    # A cache of codes by string, for encoding many values which repeat (as every ISSN does,
+    # across the rows it appears in).  Anything which is not an ISSN is EMPTY.
+    def __missing__(self, value):
+        code = encode(value)
+        if code is None:
+            code = EMPTY
+        self[value] = code
+        return code
+
+    def column(self, values):
+        return map(self.__getitem__, values)
+
+
+class PairTable(object):
+    # Pairs of ISSN codes, packed into an array of 64 bit integers.  Pairs are gathered into runs
+    # of (about) run_size, and each run is sorted and de-duplicated as it fills, so no more than a
+    # run's worth of pairs is ever turned into Python ints at once.  Given a directory, finished
+    # runs are spilled to it as raw arrays, so only the run being filled is held in memory; the
+    # runs are merged, again without boxing more than one pair per run, by unique().
+    def __init__(self, directory=None, run_size=RUN_SIZE):
+        self._directory = directory
+        self._run_size = run_size
+        self._pairs = array("Q")
+        self._runs = []
+
+    def append(self, a, b=EMPTY):
+        self._pairs.append((a << _SHIFT) | b)
+        if len(self._pairs) >= self._run_size:
+            self._finish_run()
+
+    def add_undirected(self, firsts, seconds):
+        # Add the pairs of two columns of codes, with the higher code of each pair first, so that
+        # a pair is the same whichever way round it was given, and a code paired with EMPTY is
+        # that code alone.  Pairs of EMPTY are left out.  This is done a column at a time, by
+        # mapping builtins over the columns, rather than a pair at a time.
+        firsts = list(firsts)
+        seconds = list(seconds)
+        highs = map(lshift, map(max, firsts, seconds), repeat(_SHIFT))
+        self._pairs.extend(filter(None, map(or_, highs, map(min, firsts, seconds))))
+        if len(self._pairs) >= self._run_size:
+            self._finish_run()
+
+    def runs(self):
+        # the finished runs (arrays, or the paths they were spilled to), e.g. to hand the work of
+        # a worker process over to add_runs() of another table
+        self._finish_run()
+        return list(self._runs)
+
+    def add_runs(self, runs):
+        self._runs.extend(runs)
+
+    def _finish_run(self):
+        if len(self._pairs) == 0:
+            return
+        run = array("Q", sorted(set(self._pairs)))
+        self._pairs = array("Q")
+        if self._directory is None:
+            self._runs.append(run)
+            return
+        fd, path = tempfile.mkstemp(prefix="pairs_", suffix=".run", dir=self._directory)
+        with os.fdopen(fd, "wb") as f:
+            run.tofile(f)
+        self._runs.append(path)
+
+    def unique(self):
+        # the distinct pairs, in order
+        runs = self.runs()
+        if len(runs) == 1:
+            return _read_run(runs[0])
+
+        merged = array("Q")
+        last = None
+        for key in heapq.merge(*[_iterate_run(run) for run in runs]):
+            if key != last:
+                merged.append(key)
+                last = key
+        return merged
+
+    def rows(self):
+        # the distinct pairs, in order, as rows of ISSN strings
+        decoded = {EMPTY: ""}
+        for key in self.unique():
+            a, b = key >> _SHIFT, key & _MASK
+            if a not in decoded:
+                decoded[a] = decode(a)
+            if b not in decoded:
+                decoded[b] = decode(b)
+            yield [decoded[a], decoded[b]]
+
+
+def _read_run(run):
+    if isinstance(run, array):
+        return run
+    pairs = array("Q")
+    with open(run, "rb") as f:
+        pairs.fromfile(f, os.path.getsize(run) // pairs.itemsize)
+    return pairs
+
+
+def _iterate_run(run):
+    # the pairs of a run, read from disk a block at a time if it was spilled
+    if isinstance(run, array):
+        yield from run
+        return
+    remaining = os.path.getsize(run) // _ITEM_SIZE
+    with open(run, "rb") as f:
+        while remaining > 0:
+            block = array("Q")
+            block.fromfile(f, min(remaining, BLOCK_SIZE))
+            remaining -= len(block)
+            yield from block
@@ -0,0 +1,108 @@
+import json
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+class JSONStreamException(Exception):
+    pass
+
+
+def array_items(handle, chunk_size=64 * 1024):
+    # Incrementally decode a JSON document whose top level is an array, yielding each element
+    # of the array as soon as it has been read.  Only the text of the element currently being
+    # decoded is held in memory, so memory use is bounded by the size of the largest element
+    # rather than the size of the document.
+    #
+    # handle must be a text-mode file-like object
+    decoder = json.JSONDecoder()
+    reader = _Buffer(handle, chunk_size)
+
+    if reader.next_token() != "[":
+        raise JSONStreamException("Expected a JSON array")
+    reader.advance(1)
+
+    if reader.next_token() == "]":
+        reader.advance(1)
+        reader.expect_end()
+        return
+
+    while True:
+        yield reader.decode(decoder)
+
+        token = reader.next_token()
+        if token == ",":
+            reader.advance(1)
+        elif token == "]":
+            reader.advance(1)
+            reader.expect_end()
+            return
+        else:
+            raise JSONStreamException("Expected ',' or ']' at offset {x}, found {y}".format(x=reader.offset, y=repr(token)))
+
+
+class _Buffer(object):
+    def __init__(self, handle, chunk_size):
+        self._handle = handle
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._consumed = 0
+        self._eof = False
+
+    @property
+    def offset(self):
+        return self._consumed + self._pos
+
+    def _fill(self, size=None):
+        if self._eof:
+            return False
+        chunk = self._handle.read(size or self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        if self._pos > 0:
+            self._consumed += self._pos
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += chunk
+        return True
+
+    def next_token(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return None
+
+    def advance(self, n):
+        self._pos += n
+
+    def expect_end(self):
+        token = self.next_token()
+        if token is not None:
+            raise JSONStreamException("Unexpected data after end of array at offset {x}".format(x=self.offset))
+
+    def decode(self, decoder):
+        if self.next_token() is None:
+            raise JSONStreamException("Unexpected end of document")
+
+        while True:
+            try:
+                obj, end = decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # most likely the element runs past the end of the buffer, so read some more
+                # and try again; if there is no more to read the document is malformed.  Growing
+                # the read with the size of the pending element keeps large elements linear
+                if not self._fill(max(self._chunk_size, len(self._buf) - self._pos)):
+                    raise
+                continue
+
+            # a number which runs up to the end of the buffer may continue in the next chunk
+            if self._buf[end:].strip(NUMBER_CHARS) == "" and self._fill():
+                continue
+
+            self._pos = end
+            return obj
@@ -0,0 +1,124 @@
+import csv
+import io
+import mmap
+import os
+import struct
+
+# Index records are a fixed width key (ISSNs are 9 bytes, so this leaves room to spare), followed
+# by the byte offset and length of the block of rows for that key in the data file
+KEY_WIDTH = 16
+RECORD = struct.Struct("<{x}sQI".format(x=KEY_WIDTH))
+
+
+class LookupException(Exception):
+    pass
+
+
+def write_indexed_csv(rows, data_handle, index_handle, encoding="utf-8"):
+    # Write rows, which must be sorted by their first column, as CSV to data_handle, and an index
+    # of the first column to index_handle.  Both handles must be binary.  Keys which are too long
+    # for the index are written to the data file but are not indexed.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    offset = 0
+    current_key = None
+    current_start = 0
+
+    for row in rows:
+        key = row[0].encode(encoding)
+        if key != current_key:
+            if current_key is not None:
+                if key < current_key:
+                    raise LookupException("Rows must be sorted by key; {x} came after {y}".format(x=row[0], y=current_key.decode(encoding)))
+                _write_record(index_handle, current_key, current_start, offset - current_start)
+            current_key = key
+            current_start = offset
+
+        writer.writerow(row)
+        data = buffer.getvalue().encode(encoding)
+        buffer.seek(0)
+        buffer.truncate()
+
+        data_handle.write(data)
+        offset += len(data)
+
+    if current_key is not None:
+        _write_record(index_handle, current_key, current_start, offset - current_start)
+
+
+def _write_record(index_handle, key, offset, length):
+    if len(key) > KEY_WIDTH:
+        return
+    index_handle.write(RECORD.pack(key, offset, length))
+
+
+class IndexedCSV(object):
+    # Read-only, dict-like access to a CSV written by write_indexed_csv, where get(key) returns the
+    # rows for that key without their key column.  Both files are memory mapped, so only the pages
+    # actually looked at are read into memory.
+    def __init__(self, data_path, index_path, encoding="utf-8"):
+        self._encoding = encoding
+        self._data_file = open(data_path, "rb")
+        self._index_file = open(index_path, "rb")
+        self._data = _map(self._data_file)
+        self._index = _map(self._index_file)
+        self._count = len(self._index) // RECORD.size if self._index is not None else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def close(self):
+        for m in (self._data, self._index):
+            if m is not None:
+                m.close()
+        self._data_file.close()
+        self._index_file.close()
+
+    def get(self, key, default=None):
+        record = self._find(key)
+        if record is None:
+            return default
+
+        offset, length = record
+        text = self._data[offset:offset + length].decode(self._encoding)
+        return [row[1:] for row in csv.reader(io.StringIO(text, newline=""))]
+
+    def keys(self):
+        for i in range(self._count):
+            key, _, _ = RECORD.unpack_from(self._index, i * RECORD.size)
+            yield key.rstrip(b"\0").decode(self._encoding)
+
+    def _find(self, key):
+        target = key.encode(self._encoding)
+        if len(target) > KEY_WIDTH:
+            return None
+        target = target.ljust(KEY_WIDTH, b"\0")
+
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, offset, length = RECORD.unpack_from(self._index, mid * RECORD.size)
+            if k < target:
+                lo = mid + 1
+            elif k > target:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+
+def _map(handle):
+    # mmap refuses to map an empty file
+    if os.fstat(handle.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
@@ -1,8 +1,16 @@
 import csv
+import heapq
 import itertools
-import re
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 
-ISSN_RX = "^\d{4}-\d{3}[\dxX]$"
+from dataimport.lib import issn as issn_codec
+from dataimport.lib.disjoint_set import DisjointSet
+from dataimport.lib.preference import PreferenceRanking
+
+SORT_RUN_SIZE = 1000000
+ENCODE_CHUNK_SIZE = 100000
 
 
 def cluster_to_dict(rows, n):
@@ -14,78 +22,139 @@ def cluster_to_dict(rows, n):
     return d
 
 
-def cat_and_dedupe(analyses):
-    inputs = []
-    for analysis in analyses:
-        reader = analysis.entries()
-        inputs += [row + [analysis.source] for row in reader]
+def cat_and_dedupe(analyses, file_manager=None, run_size=SORT_RUN_SIZE, workers=1):
+    # Concatenate the rows of all the analyses (tagged with their source), and return a lazy
+    # iterator over them in sorted order with duplicates removed.  If a file manager is given,
+    # the sort is done externally: sorted runs of run_size rows are spilled to a temporary
+    # directory in the current instance and then merged, so memory use does not grow with
+    # the size of the inputs.  With more than one worker, the runs are made in parallel, from
+    # shards of the analyses
+    if file_manager is None:
+        inputs = (row + [analysis.source] for analysis in analyses for row in analysis.entries())
+        return _dedupe(sorted(inputs))
 
-    inputs.sort()
-    inputs = list(k for k, _ in itertools.groupby(inputs))
-    return inputs
+    if workers > 1:
+        return _dedupe(parallel_sort(analyses, file_manager, workers, run_size))
 
+    inputs = (row + [analysis.source] for analysis in analyses for row in analysis.entries())
+    return _dedupe(external_sort(inputs, file_manager, run_size))
 
-def issn_clusters(coincident_issn_analyses, clusters_file_handle):
-    issn_clusters = []
 
-    inputs = cat_and_dedupe(coincident_issn_analyses)
-    inputs = remove_invalid_issns(inputs)
-    inputs.sort(key=lambda x: x[0])
+def external_sort(rows, file_manager, run_size=SORT_RUN_SIZE):
+    with file_manager.temp_dir() as tmp:
+        yield from _merge_runs(_write_runs(rows, tmp, "run", run_size))
 
-    current_issn_root = None
-    current_cluster = []
-    for row in inputs:
-        if not current_issn_root:
-            current_issn_root = row[0]
-            current_cluster.append(row[0])
-        if current_issn_root != row[0]:
-            # the issn has changed, so we can write the current cluster
-            current_cluster = list(set(current_cluster))
-            current_cluster.sort()
-            issn_clusters.append(current_cluster)
 
-            current_cluster = [row[0]]
-            current_issn_root = row[0]
+def parallel_sort(analyses, file_manager, workers, run_size=SORT_RUN_SIZE):
+    # Each analysis is split into as many shards as there are workers, and each worker process
+    # reads its shard (from the memory mapped analysis, where it can be, so the file is shared
+    # through the page cache rather than copied to the workers) and writes it out as sorted runs,
+    # which are then merged here
+    with file_manager.temp_dir() as tmp:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_sort_shard, analysis, shard, workers, tmp, "run_{x}_{y}".format(x=i, y=shard), run_size)
+                       for i, analysis in enumerate(analyses) for shard in range(workers)]
+            runs = [path for future in futures for path in future.result()]
 
-        if len(row) > 1 and row[1]:
-            current_cluster.append(row[1])
+        yield from _merge_runs(runs)
 
-    issn_clusters.sort()
-    issn_clusters = list(k for k,_ in itertools.groupby(issn_clusters))
 
-    d = {}
-    for row in issn_clusters:
-        if row[0] not in d:
-            d[row[0]] = []
-        d[row[0]] += [row[x + 1] for x in range(len(row) - 1)]
-
-    # go through every key, and for each value in the array associated with it, look
-    # for the key of that value.  This will lead to another set of values.  For each
-    # of those transitive values that are not the original key and are not in the
-    # original list of values, add it to a list of additional values to add.  Then remove
-    # the key of the value, so we don't count it again.
-    #
-    # In this way, we "consume" all the values into their unique super-clusters by
-    # expanding the first list of values with values from all transitive lists.
-    # In theory we end up with a unique list of coincident identifiers, with all
-    # smaller subsets of the larger cluster subsumed into one.
-    keys = list(d.keys())
-    for k in keys:
-        if k not in d:
-            continue
-        additions = []
-        for e in d[k]:
-            if e in d:
-                additions += [x for x in d[e] if x != k and x not in d[k]]
-                del d[e]
-        d[k] = list(set(d[k] + additions))
-
-    rows = []
-    for k, v in d.items():
-        rows.append([k] + v)
+def _sort_shard(analysis, shard, shards, directory, prefix, run_size):
+    rows = (row + [analysis.source] for row in analysis.entries(shard, shards))
+    return _write_runs(rows, directory, prefix, run_size)
+
+
+def _write_runs(rows, directory, prefix, run_size):
+    runs = []
+    for chunk in chunks(rows, run_size):
+        chunk.sort()
+        path = os.path.join(directory, "{x}_{y}.csv".format(x=prefix, y=len(runs)))
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerows(_dedupe(chunk))
+        runs.append(path)
+    return runs
+
+
+def _merge_runs(runs):
+    with ExitStack() as stack:
+        readers = [csv.reader(stack.enter_context(open(path, "r", newline=""))) for path in runs]
+        yield from heapq.merge(*readers)
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _dedupe(rows):
+    return (k for k, _ in itertools.groupby(rows))
 
+
+def issn_clusters(coincident_issn_analyses, clusters_file_handle, file_manager=None, workers=1):
     writer = csv.writer(clusters_file_handle)
-    writer.writerows(rows)
+    writer.writerows(issn_cluster_rows(coincident_issn_analyses, file_manager, workers))
+
+
+def issn_cluster_rows(coincident_issn_analyses, file_manager=None, workers=1, run_size=SORT_RUN_SIZE):
+    # every pair of coincident ISSNs joins two clusters, and anything reachable through a chain
+    # of pairs ends up in the same cluster.  Each cluster is a row of its ISSNs, with the lowest
+    # ISSN first.  The ISSNs are clustered as integer codes (see dataimport.lib.issn), which sort
+    # as the strings do, and are only turned back into strings for output.  If a file manager is
+    # given, the sorted runs of pairs are spilled to a temporary directory in the current instance
+    # while they are merged, as cat_and_dedupe's are
+    if file_manager is None:
+        pairs = issn_pairs(coincident_issn_analyses, None, workers, run_size).unique()
+    else:
+        with file_manager.temp_dir() as tmp:
+            pairs = issn_pairs(coincident_issn_analyses, tmp, workers, run_size).unique()
+
+    clusters = DisjointSet()
+    for key in pairs:
+        a, b = issn_codec.unpack(key)
+        if b == issn_codec.EMPTY:
+            clusters.add(a)
+        else:
+            clusters.union(a, b)
+
+    return [[issn_codec.decode(code) for code in group] for group in clusters.groups()]
+
+
+def issn_pairs(coincident_issn_analyses, directory=None, workers=1, run_size=SORT_RUN_SIZE):
+    # The valid ISSNs of the [issn, coincident] rows of the analyses, as a table of pairs of codes,
+    # in sorted runs which are spilled to directory if one is given.  With more than one worker,
+    # each analysis is encoded in shards, in parallel, and the workers hand back their runs
+    pairs = issn_codec.PairTable(directory, run_size)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_encode_shard, analysis, shard, workers, directory, run_size)
+                       for analysis in coincident_issn_analyses for shard in range(workers)]
+            for future in futures:
+                pairs.add_runs(future.result())
+        return pairs
+
+    for analysis in coincident_issn_analyses:
+        _encode_pairs(analysis.entries(), pairs)
+    return pairs
+
+
+def _encode_shard(analysis, shard, shards, directory, run_size):
+    pairs = issn_codec.PairTable(directory, run_size)
+    _encode_pairs(analysis.entries(shard, shards), pairs)
+    return pairs.runs()
+
+
+def _encode_pairs(rows, pairs, chunk_size=ENCODE_CHUNK_SIZE):
+    codes = issn_codec.Codes()
+    for chunk in chunks(rows, chunk_size):
+        pairs.add_undirected(codes.column([row[0] for row in chunk]), codes.column([row[1] for row in chunk]))
 
 
 def remove_invalid_issns(input):
@@ -98,42 +167,12 @@ def remove_invalid_issns(input):
 
 
 def valid_issns(issns):
-    return [issn.upper() for issn in issns if re.match(ISSN_RX, issn)]
+    codes = [issn_codec.encode(issn) for issn in issns]
+    return [issn_codec.decode(code) for code in codes if code is not None]
 
 
 def extract_preferred(source_pairs, preference_order):
-    selected = None
-    idx = -1
-    for pref in preference_order:
-        opts = []
-        for i, tup in enumerate(source_pairs):
-            title, source = tup
-            if pref == source:
-                opts.append((i, title))
-
-        if len(opts) == 0:
-            continue
-
-        countopts = {}
-        for opt in opts:
-            if opt[1] not in countopts:
-                countopts[opt[1]] = {"count": 1, "idx": [opt[0]]}
-            else:
-                countopts[opt[1]]["count"] += 1
-                countopts[opt[1]]["idx"].append(opt[0])
-
-        selected_count = 0
-        for k, v in countopts.items():
-            if v["count"] > selected_count:
-                selected = k
-                selected_count = v["count"]
-                idx = v["idx"][0]
-
-        break
-
-    if selected is None:
-        selected = source_pairs[0][0]
-        idx = 0
-
-    del source_pairs[idx]
-    return selected
\ No newline at end of file
+    # remove the preferred value from the (value, source) pairs and return it
+    ranking = PreferenceRanking(preference_order)
+    idx = ranking.select([p[0] for p in source_pairs], [ranking.rank(p[1]) for p in source_pairs])
+    return source_pairs.pop(idx)[0]
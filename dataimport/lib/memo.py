@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from dataimport.lib.paths import rel2abs
+from dataimport.lib import metrics
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def manifest_name(stage):
+    return stage + MANIFEST_SUFFIX
+
+
+def is_manifest(filename):
+    return filename.endswith(MANIFEST_SUFFIX)
+
+
+def is_bookkeeping(filename):
+    # manifests and metrics record how an instance was made, rather than being part of its output
+    return is_manifest(filename) or metrics.is_metrics(filename)
+
+
+def read_manifest(instance, stage):
+    if instance is None:
+        return None
+    path = os.path.join(instance, manifest_name(stage))
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def upstream_digest(instance, stage):
+    # the digest of a stage in an instance, for use as the input fingerprint of a downstream stage
+    manifest = read_manifest(instance, stage)
+    if manifest is None:
+        return None
+    return manifest.get("digest")
+
+
+@lru_cache(maxsize=1)
+def code_version():
+    # a change to any of the code could change what a stage produces, so we fingerprint all of it
+    package = rel2abs(__file__, "..")
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(package):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(root, name)
+            h.update(os.path.relpath(path, package).encode("utf-8"))
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def config_version(config, keys):
+    values = {k: getattr(config, k, None) for k in keys}
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class Memo(object):
+    # Make-style memoisation of a stage run in a FileManager instance.  The stage's inputs (usually
+    # the digests of its upstream stages), the code version and the relevant config are combined
+    # into a digest, which is recorded in a manifest in the instance along with the files the stage
+    # produced.  If an instance already holds a manifest with the same digest, the stage need not
+    # run again.
+    def __init__(self, file_manager, stage, inputs, config, config_keys):
+        self.file_manager = file_manager
+        self.stage = stage
+        self.inputs = inputs
+        self.code = code_version()
+        self.config = config_version(config, config_keys)
+        self.digest = self._digest()
+
+    def _digest(self):
+        if self.inputs is None or any(v is None for v in self.inputs.values()):
+            return None
+        key = {"stage": self.stage, "inputs": self.inputs, "code": self.code, "config": self.config}
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def matches(self, instance):
+        if self.digest is None:
+            return False
+        manifest = read_manifest(instance, self.stage)
+        if manifest is None or manifest.get("digest") != self.digest:
+            return False
+        return all(os.path.exists(os.path.join(instance, f)) for f in manifest.get("files", []))
+
+    def find(self):
+        # the most recent instance in which this stage has already been run with the same inputs
+        if self.digest is None:
+            return None
+        for instance in self.file_manager.instances():
+            if self.matches(instance):
+                return instance
+        return None
+
+    def latest(self):
+        # the most recent instance in which this stage has been run at all
+        for instance in self.file_manager.instances():
+            if read_manifest(instance, self.stage) is not None:
+                return instance
+        return None
+
+    def adopt(self, instance):
+        manifest = read_manifest(instance, self.stage)
+        for filename in manifest.get("files", []):
+            self.file_manager.link_in(os.path.join(instance, filename), filename)
+        self._write(manifest.get("files", []))
+
+    def record(self, files):
+        if self.digest is None:
+            return
+        self._write(files)
+
+    def _write(self, files):
+        manifest = {
+            "stage": self.stage,
+            "digest": self.digest,
+            "inputs": self.inputs,
+            "code": self.code,
+            "config": self.config,
+            "files": files
+        }
+        # manifests are read by path, from other instances, so are never compressed
+        with self.file_manager.output_file(manifest_name(self.stage), raw=True) as f:
+            json.dump(manifest, f, indent=2)
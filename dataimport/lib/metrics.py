@@ -0,0 +1,297 @@
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from dataimport import logger
+from dataimport.lib import plugin
+
+# Structured metrics for each run of a pipeline stage.  A stage is measured with
+#
+#   with metrics.stage(config, "resolver", datasource.id, "fetch", datasource.file_manager) as m:
+#       ...
+#
+# and anything running inside it can add to its row counts with count() or counted().  When the
+# stage ends its metrics are written to METRICS_FILE in the file manager's instance, and passed to
+# each of the sinks in config.METRICS_SINKS.
+#
+# CPU time, bytes read/written and peak RSS are process-wide, so when stages run concurrently
+# (e.g. under the scheduler) each stage's figures include the work of the others running with it.
+# The RSS high water mark is only reset when a stage starts with no other stage running, so it is
+# never cleared under a stage which is already being measured; the peak_rss_is_stage of a record
+# says whether its peak was that of the stage alone.
+
+METRICS_FILE = "metrics.json"
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# the stages being measured, across all threads
+_active = set()
+_active_lock = threading.Lock()
+
+
+def is_metrics(filename):
+    return filename == METRICS_FILE
+
+
+def count(name, n=1):
+    # add to a counter of the stage being measured in this thread, if there is one
+    stage = getattr(_local, "stage", None)
+    if stage is not None:
+        stage.count(name, n)
+
+
+def counted(iterable, name):
+    n = 0
+    try:
+        for item in iterable:
+            n += 1
+            yield item
+    finally:
+        count(name, n)
+
+
+def _io_counters():
+    # characters read and written by the process, including through sockets; Linux only
+    try:
+        with open("/proc/self/io", "r") as f:
+            values = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(values["rchar"]), int(values["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _reset_peak_rss():
+    # writing 5 to clear_refs resets the process's RSS high water mark (Linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak over the life of the process, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _cpu_time():
+    # this process and any worker processes it has waited for
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class StageMetrics(object):
+    def __init__(self, component, id, stage):
+        self.component = component
+        self.id = id
+        self.stage = stage
+        self.outcome = "ran"
+        self.instance = None
+        self.counters = {"rows_in": 0, "rows_out": 0}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def start(self):
+        self.started = datetime.utcnow()
+        self._wall = time.perf_counter()
+        self._cpu = _cpu_time()
+        self._read, self._written = _io_counters()
+        with _active_lock:
+            if len(_active) == 0:
+                self._peak_reset = _reset_peak_rss()
+            else:
+                # the high water mark now covers more than one stage, for this one and those
+                # already running alike
+                self._peak_reset = False
+                for other in _active:
+                    other._peak_reset = False
+            _active.add(self)
+            self.peak_rss_bytes = _peak_rss()
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = _cpu_time() - self._cpu
+        read, written = _io_counters()
+        self.bytes_read = read - self._read if read is not None and self._read is not None else None
+        self.bytes_written = written - self._written if written is not None and self._written is not None else None
+        with _active_lock:
+            _active.discard(self)
+            self.peak_rss_bytes = max(self.peak_rss_bytes, _peak_rss())
+
+    def record(self):
+        record = {
+            "component": self.component,
+            "id": self.id,
+            "stage": self.stage,
+            "outcome": self.outcome,
+            "instance": self.instance,
+            "started": self.started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "peak_rss_is_stage": self._peak_reset
+        }
+        record.update(self.counters)
+        return record
+
+
+@contextmanager
+def stage(config, component, id, name, file_manager=None):
+    measuring = StageMetrics(component, id, name)
+    outer = getattr(_local, "stage", None)
+    _local.stage = measuring
+    measuring.start()
+    try:
+        yield measuring
+    except Exception:
+        measuring.outcome = "failed"
+        raise
+    finally:
+        measuring.stop()
+        _local.stage = outer
+        if file_manager is not None:
+            measuring.instance = file_manager.current_instance_name
+        publish(config, measuring.record(), file_manager)
+
+
+def publish(config, record, file_manager=None):
+    # metrics are never allowed to break the import, so problems writing them are only logged
+    try:
+        if file_manager is not None:
+            _write_instance_metrics(file_manager, record)
+    except Exception as e:
+        logger.log("unable to write metrics to {x}: {y}".format(x=file_manager.current_instance_name, y=e), "METRICS")
+
+    for sink in sinks(config):
+        try:
+            sink.emit(record)
+        except Exception as e:
+            logger.log("metrics sink {x} failed: {y}".format(x=sink.__class__.__name__, y=e), "METRICS")
+
+
+def _write_instance_metrics(file_manager, record):
+    # only into an instance which the stage has actually created; making the directory here
+    # would turn it into the file manager's current instance
+    instance = file_manager.current_instance_name
+    if instance is None or not os.path.isdir(instance):
+        return
+
+    with _lock:
+        path = os.path.join(instance, METRICS_FILE)
+        stages = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                stages = json.load(f).get("stages", {})
+        stages[record["stage"]] = record
+        _write_atomically(path, json.dumps({"stages": stages}, indent=2, sort_keys=True))
+
+
+def _write_atomically(path, content):
+    # A temporary file of its own, so that concurrent writers (e.g. other processes writing the
+    # same sink) never write into each other's.  mkstemp makes it readable by its owner only, but
+    # e.g. the textfile collector needs to read it.
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def sinks(config):
+    return [plugin.load_class(classpath)(config) for classpath in config.METRICS_SINKS]
+
+
+class MetricsSink(object):
+    def __init__(self, config):
+        self.config = config
+
+    def emit(self, record):
+        raise NotImplementedError()
+
+
+class JSONLinesSink(MetricsSink):
+    # appends every stage's metrics to config.METRICS_JSONL_FILE, one JSON object per line
+    def emit(self, record):
+        path = self.config.METRICS_JSONL_FILE
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _lock, open(path, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class PrometheusTextfileSink(MetricsSink):
+    # Writes the metrics of the most recent run of every stage to config.METRICS_PROMETHEUS_FILE,
+    # for the node_exporter textfile collector.  The collector reads the whole file, so the latest
+    # records are kept alongside it, and the file is rewritten (atomically) on every emit.
+    PREFIX = "dataimport_stage_"
+
+    METRICS = [
+        ("wall_seconds", "Wall clock time of the last run of the stage"),
+        ("cpu_seconds", "CPU time of the last run of the stage, including worker processes"),
+        ("rows_in", "Rows read by the last run of the stage"),
+        ("rows_out", "Rows written by the last run of the stage"),
+        ("bytes_read", "Bytes read by the process during the last run of the stage"),
+        ("bytes_written", "Bytes written by the process during the last run of the stage"),
+        ("peak_rss_bytes", "Peak resident set size during the last run of the stage")
+    ]
+
+    def emit(self, record):
+        path = self.config.METRICS_PROMETHEUS_FILE
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        state_path = path + ".state.json"
+
+        with _lock:
+            latest = {}
+            if os.path.exists(state_path):
+                with open(state_path, "r") as f:
+                    latest = json.load(f)
+            latest[":".join([record["component"], record["id"], record["stage"]])] = record
+            _write_atomically(state_path, json.dumps(latest, sort_keys=True))
+            _write_atomically(path, self.render([latest[k] for k in sorted(latest.keys())]))
+
+    def render(self, records):
+        lines = []
+        for name, help in self.METRICS:
+            lines.append("# HELP {p}{n} {h}".format(p=self.PREFIX, n=name, h=help))
+            lines.append("# TYPE {p}{n} gauge".format(p=self.PREFIX, n=name))
+            for r in records:
+                if r.get(name) is not None:
+                    lines.append("{p}{n}{{{l}}} {v}".format(p=self.PREFIX, n=name, l=self._labels(r), v=r[name]))
+
+        lines.append("# HELP {p}success Whether the last run of the stage succeeded".format(p=self.PREFIX))
+        lines.append("# TYPE {p}success gauge".format(p=self.PREFIX))
+        for r in records:
+            lines.append("{p}success{{{l}}} {v}".format(p=self.PREFIX, l=self._labels(r), v=0 if r["outcome"] == "failed" else 1))
+
+        lines.append("# HELP {p}last_run_timestamp_seconds When the last run of the stage started".format(p=self.PREFIX))
+        lines.append("# TYPE {p}last_run_timestamp_seconds gauge".format(p=self.PREFIX))
+        for r in records:
+            started = datetime.strptime(r["started"], "%Y-%m-%dT%H:%M:%SZ")
+            timestamp = (started - datetime(1970, 1, 1)).total_seconds()
+            lines.append("{p}last_run_timestamp_seconds{{{l}}} {v}".format(p=self.PREFIX, l=self._labels(r), v=int(timestamp)))
+
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, record):
+        labels = [("component", record["component"]), ("id", record["id"]), ("stage", record["stage"])]
+        return ",".join('{k}="{v}"'.format(k=k, v=str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
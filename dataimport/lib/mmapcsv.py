@@ -0,0 +1,123 @@
+import csv
+import io
+import mmap
+import os
+from array import array
+
+# Memory mapped, read-only access to a CSV file by byte range and by record number.
+#
+# A newline only ends a record if it is not inside a quoted field, and as quotes inside fields are
+# escaped by doubling them, that is the case exactly when the number of quote characters since the
+# start of the record is even.  So record boundaries can be found by finding newlines and counting
+# quotes in the mapped bytes (both at C speed), without parsing anything.
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+NEWLINE = b"\n"
+QUOTE = b'"'
+
+
+class MappedCSV(object):
+    def __init__(self, path, encoding="utf-8"):
+        self._path = path
+        self._encoding = encoding
+        self._file = open(path, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        # mmap refuses to map an empty file
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size > 0 else b""
+        self._offsets = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    @property
+    def size(self):
+        return self._size
+
+    def next_boundary(self, boundary, target):
+        # the first record boundary at or after target, given a record boundary at or before it
+        if target <= boundary:
+            return boundary
+        if target >= self._size:
+            return self._size
+
+        end = self._map.find(NEWLINE, target - 1)
+        if end == -1:
+            return self._size
+        quotes = self._count_quotes(boundary, end)
+        while quotes % 2 == 1:
+            nxt = self._map.find(NEWLINE, end + 1)
+            if nxt == -1:
+                return self._size
+            quotes += self._count_quotes(end, nxt)
+            end = nxt
+        return end + 1
+
+    def _count_quotes(self, start, end):
+        # mmap has no count, so count a block at a time, to bound the memory the slices take
+        quotes = 0
+        for pos in range(start, end, BLOCK_SIZE):
+            quotes += self._map[pos:min(pos + BLOCK_SIZE, end)].count(QUOTE)
+        return quotes
+
+    def shard_range(self, shard, shards):
+        # Divide the file into shards byte ranges of (roughly) equal size, aligned to record
+        # boundaries, and return the range of the given shard.  Every record is in exactly one
+        # shard, and taken in order the shards cover the file in order.
+        if shard < 0 or shard >= shards:
+            raise ValueError("shard must be between 0 and {x}".format(x=shards - 1))
+        start = 0
+        for i in range(1, shard + 1):
+            start = self.next_boundary(start, self._size * i // shards)
+        end = self.next_boundary(start, self._size * (shard + 1) // shards)
+        return start, end
+
+    def rows(self, start=0, end=None):
+        # the rows in the byte range, which must be aligned to record boundaries, decoded a block
+        # at a time
+        if end is None:
+            end = self._size
+        pos = start
+        while pos < end:
+            stop = min(self.next_boundary(pos, pos + BLOCK_SIZE), end)
+            text = self._map[pos:stop].decode(self._encoding)
+            for row in csv.reader(io.StringIO(text, newline="")):
+                yield row
+            pos = stop
+
+    def shard(self, shard, shards):
+        start, end = self.shard_range(shard, shards)
+        return self.rows(start, end)
+
+    def offsets(self):
+        # The offset of the start of every record (and, last, the end of the file), built on first
+        # use.  This is what gives random access by record number.
+        if self._offsets is None:
+            offsets = array("Q")
+            pos = 0
+            while pos < self._size:
+                offsets.append(pos)
+                pos = self.next_boundary(pos, pos + 1)
+            offsets.append(self._size)
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets()) - 1
+
+    def record(self, i):
+        offsets = self.offsets()
+        if i < 0:
+            i += len(offsets) - 1
+        if i < 0 or i >= len(offsets) - 1:
+            raise IndexError("record {x} out of range".format(x=i))
+        text = self._map[offsets[i]:offsets[i + 1]].decode(self._encoding)
+        return next(csv.reader(io.StringIO(text, newline="")))
@@ -0,0 +1,101 @@
+# Choosing between the values (titles, publishers) which several sources offer for the same record.
+#
+# The preference order is encoded once as an integer rank for each source, so each candidate is
+# ranked with a single dict lookup, and choosing between a record's candidates is a pass to find
+# the best rank and a count of the values offered at it, rather than a pass over the candidates
+# for every source in the preference order.  The rules are those extract_preferred always had:
+#
+#   * only candidates from the most preferred source which offers any are considered
+#   * of those, the value offered most often wins, and of values offered equally often, the one
+#     offered first
+#   * if no candidate comes from a source in the preference order, the first candidate wins
+
+
+class _SourceRanks(dict):
+    # ranks by source as it appears in the candidates, i.e. before it is stripped, filled in as
+    # each source is first seen
+    def __init__(self, ranks, unranked):
+        super(_SourceRanks, self).__init__()
+        self._ranks = ranks
+        self._unranked = unranked
+
+    def __missing__(self, source):
+        rank = self[source] = self._ranks.get(source.strip(), self._unranked)
+        return rank
+
+
+class PreferenceRanking(object):
+    def __init__(self, preference_order):
+        self.ranks = {}
+        for rank, source in enumerate(preference_order):
+            # a source listed twice keeps its first (best) rank
+            self.ranks.setdefault(source, rank)
+        # sources which are not in the preference order rank below all of those which are
+        self.unranked = len(preference_order)
+        self._source_ranks = _SourceRanks(self.ranks, self.unranked)
+
+    def rank(self, source):
+        return self.ranks.get(source, self.unranked)
+
+    def select(self, values, ranks):
+        # the index of the preferred value, given the values and the ranks of their sources
+        best = min(ranks, default=self.unranked)
+        if best == self.unranked:
+            return 0
+
+        offered = ranks.count(best)
+        if offered == 1:
+            return ranks.index(best)
+
+        counts = {}
+        first = {}
+        for i, r in enumerate(ranks):
+            if r == best:
+                value = values[i]
+                if value in counts:
+                    counts[value] += 1
+                else:
+                    counts[value] = 1
+                    first[value] = i
+
+        # max returns the first of equal maxima, so ties go to the value offered first
+        return first[max(counts, key=counts.get)]
+
+    def _choose(self, values, sources):
+        # As select, but from the (unstripped) sources of the values.  Most often every candidate
+        # is the same value, once for each ISSN, and then it makes no difference which is chosen,
+        # so the sources need not be ranked at all.
+        if values.count(values[0]) == len(values):
+            return 0
+        ranks = self._source_ranks
+        return self.select(values, [ranks[s] for s in sources])
+
+    def titles(self, candidates):
+        # The main title and the alternative titles, from [title, type, source] candidates, where
+        # type is "main" or "alt".  The main title is preferred from the main candidates if there
+        # are any, and from the alternatives if not.  The alternatives are every other title
+        # offered, without duplicates, in the order the set of them iterates in.
+        mains = [c[0].strip() for c in candidates if c[1] == "main"]
+        alts = [c[0].strip() for c in candidates if c[1] == "alt"]
+
+        if len(mains) == 0:
+            if len(alts) == 0:
+                return None, []
+            i = self._choose(alts, [c[2] for c in candidates if c[1] == "alt"])
+            main = alts[i]
+            return main, [x for x in set(alts[:i] + alts[i + 1:]) if x != main]
+
+        if len(mains) == 1:
+            main = mains[0]
+            return main, [x for x in set(alts) if x != main]
+
+        i = self._choose(mains, [c[2] for c in candidates if c[1] == "main"])
+        main = mains[i]
+        return main, [x for x in set(mains[:i] + mains[i + 1:] + alts) if x != main]
+
+    def publisher(self, candidates):
+        # the preferred publisher from [name, source] candidates, or None if there are none
+        if len(candidates) == 0:
+            return None
+        values = [c[0].strip() for c in candidates]
+        return values[self._choose(values, [c[1] for c in candidates])]
@@ -1,9 +1,5 @@
-from dataimport.file_manager import FileManager
 from dataimport import logger
-
-from datetime import datetime, timedelta
-from dataimport.assembler import Assembler
-from dataimport.target_factory import TargetFactory
+from dataimport.lib import memo, metrics
 
 
 class Loader(object):
@@ -32,17 +28,57 @@ class Loader(object):
                     self.loads(target)
 
     def assemble(self, target, force_update=False):
-        self.log("Assembling products for '{x}'".format(x=target.id))
-        target.assemble(force_update=force_update)
+        with metrics.stage(self.config, "loader", target.id, "assemble", target.file_manager):
+            self.log("Assembling products for '{x}'".format(x=target.id))
+            target.assemble(force_update=force_update)
 
     def prepare(self, target):
-        target.file_manager.fresh()
-        self.log("Starting fresh preparation for '{x}' in {y}".format(x=target.id, y=target.file_manager.current_instance_name))
-        target.prepare()
-        target.cleanup()
+        with metrics.stage(self.config, "loader", target.id, "prepare", target.file_manager) as m:
+            fm = target.file_manager
+            inputs = None
+            if target.product is not None:
+                inputs = {"product": memo.upstream_digest(target.product.file_manager.current_instance_name, "assemble")}
+            stage = memo.Memo(fm, "prepare", inputs, self.config, target.CONFIG_KEYS)
+
+            previous = stage.find()
+            if previous is not None:
+                if previous == fm.current_instance_name:
+                    m.outcome = "skipped"
+                    self.log("Products for '{x}' are unchanged since preparation in {y}, skipping".format(x=target.id, y=previous))
+                    return
+                m.outcome = "adopted"
+                fm.fresh()
+                self.log("Products for '{x}' are unchanged since preparation in {y}, re-using it in {z}".format(x=target.id, y=previous, z=fm.current_instance_name))
+                stage.adopt(previous)
+                fm.commit()
+                target.cleanup()
+                return
+
+            target.file_manager.fresh()
+            self.log("Starting fresh preparation for '{x}' in {y}".format(x=target.id, y=target.file_manager.current_instance_name))
+            target.prepare()
+            stage.record([f for f in fm.list_files() if not memo.is_bookkeeping(f)])
+            fm.commit()
+            target.cleanup()
 
     def loads(self, target):
-        target.file_manager.current(make_fresh=True)
-        self.log("Loading target '{x}' from {y}".format(x=target.id, y=target.file_manager.current_instance_name))
-        target.load()
-        target.cleanup()
\ No newline at end of file
+        with metrics.stage(self.config, "loader", target.id, "load", target.file_manager) as m:
+            target.file_manager.current(make_fresh=True)
+            fm = target.file_manager
+            prepared = memo.read_manifest(fm.current_instance_name, "prepare")
+            inputs = {"prepare": prepared.get("digest") if prepared is not None else None}
+            stage = memo.Memo(fm, "load", inputs, self.config, target.CONFIG_KEYS)
+
+            # loading changes the state of the target, so we only skip it if the last thing we loaded
+            # was prepared from the same inputs
+            latest = stage.latest()
+            if latest is not None and stage.matches(latest):
+                m.outcome = "skipped"
+                self.log("Target '{x}' was last loaded from the same inputs in {y}, skipping".format(x=target.id, y=latest))
+                return
+
+            self.log("Loading target '{x}' from {y}".format(x=target.id, y=target.file_manager.current_instance_name))
+            target.load()
+            prepared_files = prepared.get("files", []) if prepared is not None else []
+            stage.record([f for f in fm.list_files() if not memo.is_bookkeeping(f) and f not in prepared_files])
+            target.cleanup()
@@ -7,6 +7,9 @@ from dataimport.datasource_factory import DatasourceFactory
 class Product(object):
     FORMATS = []
 
+    # the config which affects what analyse and assemble produce
+    CONFIG_KEYS = ["PRODUCT_SOURCES", "INTERMEDIATE_FORMAT", "COLUMNAR_COMPRESSION"]
+
     def __init__(self, config, id):
         self.id = id
         self.config = config
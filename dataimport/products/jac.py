@@ -1,19 +1,23 @@
-import csv, json, itertools, os, re, shutil
-from datetime import datetime
+import csv, json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from dataimport.product import Product
-from dataimport.datasource_factory import DatasourceFactory
+from dataimport.file_manager import FileManager
 from dataimport.analyses.coincident_issns import CoincidentISSNs
 from dataimport.analyses.titles import Titles
 from dataimport.analyses.publishers import Publishers
 
-from dataimport.lib import manipulators, indexing
+from dataimport.lib import manipulators, indexing, lookup, plugin, columnar, metrics, preference
 from dataimport.formats.json_feed import JSONFeed, LineByLineJSON
+from dataimport.formats.columnar import ColumnarFile
 
 
 class JAC(Product):
     FORMATS = [JSONFeed]
 
+    CONFIG_KEYS = Product.CONFIG_KEYS + ["JAC_PREF_ORDER"]
+
     def analyse(self):
         self.log("Analysing data for journal autocomplete")
 
@@ -32,103 +36,120 @@ class JAC(Product):
             if ds.provides_analysis(Publishers):
                 pubs.append(ds.analysis(Publishers))
 
-        with self.file_manager.output_file("issn_clusters.csv") as handle:
-            manipulators.issn_clusters(issns, handle)
-
-        with self.file_manager.output_file("titles.csv") as handle:
-            titlerows = manipulators.cat_and_dedupe(titles)
-            writer = csv.writer(handle)
-            writer.writerows(titlerows)
-
-        with self.file_manager.output_file("pubs.csv") as handle:
-            pubrows = manipulators.cat_and_dedupe(pubs)
-            writer = csv.writer(handle)
-            writer.writerows(pubrows)
+        # the analyses are read in shards across this many processes
+        workers = self.config.JAC_ANALYSE_WORKERS
+
+        if self.config.INTERMEDIATE_FORMAT == "columnar":
+            with self.file_manager.output_file("issn_clusters.col", mode="wb") as handle:
+                with columnar.ColumnarWriter(handle, [("issns", "strlist")], compression=self.config.COLUMNAR_COMPRESSION) as writer:
+                    clusters = manipulators.issn_cluster_rows(issns, self.file_manager, workers)
+                    writer.writerows([c] for c in metrics.counted(clusters, "rows_out"))
+        else:
+            with self.file_manager.output_file("issn_clusters.csv") as handle:
+                clusters = manipulators.issn_cluster_rows(issns, self.file_manager, workers)
+                csv.writer(handle).writerows(metrics.counted(clusters, "rows_out"))
+
+        # titles and publishers come out of cat_and_dedupe sorted by ISSN, so we can index them
+        # by ISSN as we write them, for lookup during assembly.  The lookups are memory mapped, so
+        # they are always stored uncompressed
+        with self.file_manager.output_file("titles.csv", mode="wb", raw=True) as handle, \
+                self.file_manager.output_file("titles.idx", mode="wb", raw=True) as index:
+            titlerows = manipulators.cat_and_dedupe(titles, self.file_manager, workers=workers)
+            lookup.write_indexed_csv(titlerows, handle, index)
+
+        with self.file_manager.output_file("pubs.csv", mode="wb", raw=True) as handle, \
+                self.file_manager.output_file("pubs.idx", mode="wb", raw=True) as index:
+            pubrows = manipulators.cat_and_dedupe(pubs, self.file_manager, workers=workers)
+            lookup.write_indexed_csv(pubrows, handle, index)
 
         self.log("analysed data written")
 
     def assemble(self):
         self.log("Preparing journal autocomplete data")
 
-        preference_order = self.config.JAC_PREF_ORDER
-
-        with self.file_manager.input_file("titles.csv") as f:
-            reader = csv.reader(f)
-            titlerows = [row for row in reader]
-
-        with self.file_manager.input_file("pubs.csv") as f:
-            reader = csv.reader(f)
-            pubrows = [row for row in reader]
+        workers = self.config.JAC_ASSEMBLE_WORKERS
 
-        titles = manipulators.cluster_to_dict(titlerows, 3)
-        publishers = manipulators.cluster_to_dict(pubrows, 2)
+        with self.file_manager.output_file("jac.json") as o:
+            reader = metrics.counted(self._clusters(), "rows_in")
 
-        with self.file_manager.input_file("issn_clusters.csv") as f, self.file_manager.output_file("jac.json") as o:
-            reader = csv.reader(f)
-            for vissns in reader:
-                record = {"issns": vissns}
-                main, alts = self._get_titles(vissns, titles, preference_order)
-                if main is not None:
-                    record["title"] = main
-                else:
-                    record["title"] = ""
-                if len(alts) > 0:
-                    record["alts"] = alts
-
-                publisher = self._get_publisher(vissns, publishers, preference_order)
-                if publisher is not None:
-                    record["publisher"] = publisher
-
-                self._index(record)
-
-                o.write(json.dumps(record) + "\n")
+            if workers > 1:
+                self.log("assembling with {x} workers".format(x=workers))
+                self._assemble_parallel(reader, o, workers)
+            else:
+                titles, publishers = self._open_lookups()
+                with titles, publishers:
+                    for record in self._assemble_records(reader, titles, publishers):
+                        o.write(json.dumps(record) + "\n")
+                        metrics.count("rows_out")
 
         self.log("Journal Autocomplete data assembled")
 
+    def _assemble_parallel(self, reader, o, workers):
+        # Chunks of clusters are assembled in worker processes, each of which opens its own read-only
+        # (memory mapped, so shared through the page cache) view of the title and publisher lookups.
+        # Results are written in the order the chunks were read, so the output is the same as the
+        # serial assembly, and only a bounded number of chunks are in flight at once
+        initargs = (self.__class__, self.config.__name__, self.id, self.file_manager.current_instance_name)
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_assemble_worker, initargs=initargs) as executor:
+            for chunk in manipulators.chunks(reader, self.config.JAC_ASSEMBLE_CHUNK_SIZE):
+                pending.append((executor.submit(_assemble_chunk, chunk), len(chunk)))
+                if len(pending) >= workers * 2:
+                    self._write_chunk(o, *pending.popleft())
+
+            while len(pending) > 0:
+                self._write_chunk(o, *pending.popleft())
+
+    def _write_chunk(self, o, future, size):
+        o.write(future.result())
+        metrics.count("rows_out", size)
+
+    def _clusters(self):
+        path = self.file_manager.stored_path("issn_clusters.col")
+        if self.config.INTERMEDIATE_FORMAT == "columnar" and path is not None:
+            for row in ColumnarFile(path).entries():
+                yield row[0]
+            return
+
+        with self.file_manager.input_file("issn_clusters.csv") as f:
+            for row in csv.reader(f):
+                yield row
+
+    def _open_lookups(self):
+        titles = lookup.IndexedCSV(self.file_manager.file_path("titles.csv"), self.file_manager.file_path("titles.idx"))
+        publishers = lookup.IndexedCSV(self.file_manager.file_path("pubs.csv"), self.file_manager.file_path("pubs.idx"))
+        return titles, publishers
+
+    def _assemble_records(self, clusters, titles, publishers):
+        # the title, alternative titles and publisher of each cluster are chosen from the candidates
+        # for its ISSNs, by source preference
+        ranking = preference.PreferenceRanking(self.config.JAC_PREF_ORDER)
+
+        for vissns in clusters:
+            main, alts = ranking.titles(self._candidates(vissns, titles))
+            publisher = ranking.publisher(self._candidates(vissns, publishers))
+
+            record = {"issns": vissns}
+            if main is not None:
+                record["title"] = main
+            else:
+                record["title"] = ""
+            if len(alts) > 0:
+                record["alts"] = alts
+            if publisher is not None:
+                record["publisher"] = publisher
+
+            self._index(record)
+            yield record
+
     def get_format(self, format_class):
         if format_class == JSONFeed:
-            return LineByLineJSON(path=self.file_manager.file_path("jac.json"))
+            return LineByLineJSON(path=self.file_manager.stored_path("jac.json") or self.file_manager.file_path("jac.json"))
         return None
 
-    def _get_titles(self, issns, titles, preference_order):
-        mains = []
-        alts = []
-
-        for issn in issns:
-            candidates = titles.get(issn, [])
-            for c in candidates:
-                if c[1] == "main":
-                    mains.append((c[0].strip(), c[2].strip()))
-                elif c[1] == "alt":
-                    alts.append((c[0].strip(), c[2].strip()))
-
-        if len(mains) == 0:
-            # if there are no titles, return an empty state
-            if len(alts) == 0:
-                return None, alts
-            # otherwise return the best title from the alternates
-            main = manipulators.extract_preferred(alts, preference_order)
-            return main, [x for x in list(set([a[0] for a in alts])) if x != main]
-
-        if len(mains) == 1:
-            return mains[0][0], [x for x in list(set([a[0] for a in alts])) if x != mains[0][0]]
-
-        main = manipulators.extract_preferred(mains, preference_order)
-        return main, [x for x in list(set([m[0] for m in mains] + [a[0] for a in alts])) if x != main]
-
-    def _get_publisher(self, issns, publishers, preference_order):
-        pubs = []
-
-        for issn in issns:
-            candidates = publishers.get(issn, [])
-            for c in candidates:
-                pubs.append((c[0].strip(), c[1].strip()))
-
-        if len(pubs) == 0:
-            return None
-
-        pub = manipulators.extract_preferred(pubs, preference_order)
-        return pub
+    def _candidates(self, issns, table):
+        return [c for issn in issns for c in table.get(issn, [])]
 
     def _index(self, record):
         idx = {}
@@ -146,3 +167,20 @@ class JAC(Product):
 
         record["index"] = idx
 
+
+# state for the assembly worker processes, set up once per process by _init_assemble_worker
+_WORKER = {}
+
+
+def _init_assemble_worker(klazz, config_module, product_id, instance):
+    config = plugin.load_module(config_module)
+    product = klazz(config, product_id)
+    product.file_manager = FileManager(config, product_id, instance=instance)
+    _WORKER["product"] = product
+    _WORKER["lookups"] = product._open_lookups()
+
+
+def _assemble_chunk(rows):
+    product = _WORKER["product"]
+    titles, publishers = _WORKER["lookups"]
+    return "".join([json.dumps(record) + "\n" for record in product._assemble_records(rows, titles, publishers)])
@@ -1,7 +1,9 @@
 from dataimport.file_manager import FileManager, FileManagerException
 from dataimport import logger
+from dataimport.lib import memo, metrics
 
 from datetime import datetime, timedelta
+import json
 
 
 class ResolverException(Exception):
@@ -11,6 +13,8 @@ class ResolverException(Exception):
 class Resolver(object):
     RESOLVE_PIPELINE = ["fetch", "analyse"]
 
+    FINGERPRINT_FILE = "fingerprint.json"
+
     def __init__(self, config):
         self.config = config
 
@@ -21,31 +25,102 @@ class Resolver(object):
         if not stages:
             stages = self.RESOLVE_PIPELINE
 
-        for datasource in datasources:
-            for stage in stages:
-                if stage == "fetch":
-                    self.fetch(datasource, force_update)
-                elif stage == "analyse":
+        # all the datasources are fetched together, before any of them are analysed
+        for stage in stages:
+            if stage == "fetch":
+                self.fetch_all(datasources, force_update)
+            elif stage == "analyse":
+                for datasource in datasources:
                     self.analyse(datasource)
 
+    def fetch_all(self, datasources, force_update=False):
+        if len(datasources) <= 1:
+            for datasource in datasources:
+                self.fetch(datasource, force_update)
+            return
+
+        import asyncio
+        asyncio.run(self._fetch_concurrently(datasources, force_update))
+
+    async def _fetch_concurrently(self, datasources, force_update):
+        # The fetches themselves use the blocking, but pooled, HTTP client, so each one runs in a
+        # worker thread; the per-host connection limit is enforced by the shared session's pools.
+        # The stage takes as long as the slowest fetch rather than the sum of them all.
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.config.RESOLVER_FETCH_WORKERS) as executor:
+            fetches = [loop.run_in_executor(executor, self.fetch, datasource, force_update) for datasource in datasources]
+            results = await asyncio.gather(*fetches, return_exceptions=True)
+
+        failures = [(ds.id, r) for ds, r in zip(datasources, results) if isinstance(r, Exception)]
+        for ds_id, error in failures:
+            self.log("Fetching datasource '{x}' failed: {y}".format(x=ds_id, y=error))
+        if len(failures) > 0:
+            raise ResolverException("Unable to fetch datasources: {x}".format(x=", ".join([f[0] for f in failures])))
+
     def fetch(self, datasource, force_update=False):
-        if force_update or self.requires_update(datasource):
-            self.log("Updating datasource '{x}'".format(x=datasource.id))
-            datasource.file_manager.fresh()
-            datasource.fetch()
-            datasource.cleanup()
-        else:
-            self.log("Datasource '{x}' does not require update".format(x=datasource.id))
+        with metrics.stage(self.config, "resolver", datasource.id, "fetch", datasource.file_manager) as m:
+            if force_update or self.requires_update(datasource):
+                self.log("Updating datasource '{x}'".format(x=datasource.id))
+                datasource.file_manager.fresh()
+                datasource.fetch()
+                self._record_fingerprint(datasource)
+                datasource.file_manager.commit()
+                datasource.cleanup()
+            else:
+                m.outcome = "skipped"
+                self.log("Datasource '{x}' does not require update".format(x=datasource.id))
 
     def analyse(self, datasource):
-        try:
-            datasource.file_manager.current(make_fresh=False)
-        except FileManagerException:
-            msg = "Unable to run analyse stage on {x}, as there is no current data".format(x=datasource.id)
-            self.log(msg)
-            raise ResolverException(msg)
-        self.log("Anaslysing datasource '{x}'".format(x=datasource.id))
-        datasource.analyse()
+        with metrics.stage(self.config, "resolver", datasource.id, "analyse", datasource.file_manager) as m:
+            try:
+                datasource.file_manager.current(make_fresh=False)
+            except FileManagerException:
+                msg = "Unable to run analyse stage on {x}, as there is no current data".format(x=datasource.id)
+                self.log(msg)
+                raise ResolverException(msg)
+
+            fm = datasource.file_manager
+            stage = memo.Memo(fm, "analyse", {"fetched": self._fingerprint(datasource)}, self.config, datasource.CONFIG_KEYS)
+
+            if stage.matches(fm.current_instance_name):
+                m.outcome = "skipped"
+                self.log("Datasource '{x}' has already been analysed in {y}".format(x=datasource.id, y=fm.current_instance_name))
+                return
+
+            # if the fetched data is identical to that of an instance which has already been analysed,
+            # link that instance's analysis into this one rather than re-running it
+            previous = stage.find()
+            if previous is not None:
+                m.outcome = "adopted"
+                self.log("Datasource '{x}' is unchanged since {y}, re-using its analysis".format(x=datasource.id, y=previous))
+                stage.adopt(previous)
+                return
+
+            self.log("Anaslysing datasource '{x}'".format(x=datasource.id))
+            datasource.analyse()
+
+            # everything that isn't the fetched data (or a by-product of fetching it) was derived from it
+            derived = [f for f in fm.list_files()
+                       if f != self.FINGERPRINT_FILE and not memo.is_bookkeeping(f)
+                       and not any(f.startswith(fetched) for fetched in datasource.FETCHED_FILES)]
+            stage.record(derived)
+
+    def _fingerprint(self, datasource):
+        fm = datasource.file_manager
+        if fm.exists(self.FINGERPRINT_FILE):
+            with fm.input_file(self.FINGERPRINT_FILE) as f:
+                return json.load(f)
+        return self._record_fingerprint(datasource)
+
+    def _record_fingerprint(self, datasource):
+        fingerprint = datasource.fingerprint()
+        if fingerprint is not None:
+            with datasource.file_manager.output_file(self.FINGERPRINT_FILE) as f:
+                json.dump(fingerprint, f)
+        return fingerprint
 
     def _max_age(self, datasource):
         return self.config.RESOLVER_MAX_AGE.get(datasource.id, 0)
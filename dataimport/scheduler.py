@@ -0,0 +1,154 @@
+import os
+
+from dataimport import logger
+from dataimport.resolver import Resolver
+from dataimport.assembler import Assembler
+from dataimport.loader import Loader
+from dataimport.datasource_factory import DatasourceFactory
+from dataimport.product_factory import ProductFactory
+from dataimport.target_factory import TargetFactory
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class SchedulerException(Exception):
+    pass
+
+
+class Node(object):
+    def __init__(self, kind, id, component, depends_on=None):
+        self.kind = kind
+        self.id = id
+        self.component = component
+        self.depends_on = depends_on if depends_on is not None else []
+
+    @property
+    def key(self):
+        return self.kind + ":" + self.id
+
+    def __repr__(self):
+        return self.key
+
+
+class Scheduler(object):
+    # Runs the whole import as a dependency graph: every datasource is resolved once, however many
+    # products use it, each product is assembled once all of its sources are resolved, and each
+    # target is prepared and loaded once its product is assembled.  Nodes whose dependencies are
+    # satisfied run concurrently.
+    def __init__(self, config):
+        self.config = config
+
+    def log(self, msg):
+        logger.log(msg, "SCHEDULER")
+
+    def plan(self, target_names=None):
+        if target_names is None or "_all" in target_names:
+            target_names = list(self.config.TARGETS.keys())
+
+        dsf = DatasourceFactory(self.config)
+        pf = ProductFactory(self.config)
+        tf = TargetFactory(self.config)
+
+        nodes = {}
+
+        def add(node):
+            if node.key not in nodes:
+                nodes[node.key] = node
+            return nodes[node.key]
+
+        for product_id, target_id, dir in self._target_edges():
+            if target_id not in target_names:
+                continue
+
+            product_node = nodes.get("product:" + product_id)
+            if product_node is None:
+                product = pf.get_product(product_id)
+                sources = [add(Node("datasource", ds, dsf.get_datasource(ds)))
+                           for ds in self.config.PRODUCT_SOURCES.get(product_id, [])]
+                product_node = add(Node("product", product_id, product, sources))
+
+            target = tf.get_target(target_id, product_node.component, dir)
+            add(Node("target", product_id + "__" + target_id, target, [product_node]))
+
+        return list(nodes.values())
+
+    def _target_edges(self):
+        # (product id, target id, target dir) for each product which is loaded into a target.  The
+        # edges are those of PRODUCT_TARGETS, which also gives the directory of each target, and
+        # of TARGET_PRODUCTS, whose edges are added where PRODUCT_TARGETS does not have them.  A
+        # target's store holds a single product, so those get a directory of their own under
+        # TARGET_DIRS, named as the default PRODUCT_TARGETS ones are.
+        edges = {}
+        for product_id, target_cfg in self.config.PRODUCT_TARGETS.items():
+            for tc in target_cfg:
+                edges[(product_id, tc.get("id"))] = tc.get("dir")
+
+        for target_id, product_ids in self.config.TARGET_PRODUCTS.items():
+            for product_id in product_ids:
+                if (product_id, target_id) not in edges:
+                    dir = os.path.join(self.config.TARGET_DIRS, product_id + "__" + target_id)
+                    self.log("{x} is loaded into {y} by TARGET_PRODUCTS, but not PRODUCT_TARGETS; using {z}".format(x=product_id, y=target_id, z=dir))
+                    edges[(product_id, target_id)] = dir
+
+        for (product_id, target_id), dir in edges.items():
+            if target_id not in self.config.TARGETS:
+                raise SchedulerException("{x} is to be loaded into {y}, which is not in TARGETS".format(x=product_id, y=target_id))
+            if dir is None and target_id not in self.config.STORE_SCOPES:
+                raise SchedulerException("PRODUCT_TARGETS gives no dir for {x} in {y}, and it has no STORE_SCOPES entry".format(x=product_id, y=target_id))
+
+        return [(p, t, d) for (p, t), d in edges.items()]
+
+    def run(self, nodes, force_update=False):
+        self.log("Running plan: {x}".format(x=", ".join([n.key for n in nodes])))
+
+        waiting = {n.key: set(d.key for d in n.depends_on) for n in nodes}
+        dependents = {n.key: [] for n in nodes}
+        for n in nodes:
+            for d in n.depends_on:
+                dependents[d.key].append(n)
+
+        failed = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.config.SCHEDULER_WORKERS) as executor:
+            def submit_ready():
+                for n in nodes:
+                    if n.key in waiting and len(waiting[n.key]) == 0:
+                        del waiting[n.key]
+                        running[executor.submit(self._run_node, n, force_update)] = n
+
+            submit_ready()
+            while len(running) > 0:
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        self.log("{x} failed: {y}".format(x=node.key, y=error))
+                        failed.append(node)
+                        self._skip_dependents(node, waiting, dependents)
+                        continue
+                    for dependent in dependents[node.key]:
+                        if dependent.key in waiting:
+                            waiting[dependent.key].discard(node.key)
+                submit_ready()
+
+        if len(failed) > 0:
+            raise SchedulerException("Plan did not complete; failed: {x}".format(x=", ".join([n.key for n in failed])))
+
+    def _skip_dependents(self, node, waiting, dependents):
+        for dependent in dependents[node.key]:
+            if dependent.key in waiting:
+                self.log("skipping {x}, as {y} failed".format(x=dependent.key, y=node.key))
+                del waiting[dependent.key]
+                self._skip_dependents(dependent, waiting, dependents)
+
+    def _run_node(self, node, force_update):
+        self.log("Starting {x}".format(x=node.key))
+        if node.kind == "datasource":
+            Resolver(self.config).resolve([node.component], force_update=force_update)
+        elif node.kind == "product":
+            # the product's sources have already been resolved by their own nodes
+            Assembler(self.config).assemble([node.component], stages=["analyse", "assemble"])
+        elif node.kind == "target":
+            Loader(self.config).load([node.component], stages=["prepare", "load"])
+        self.log("Finished {x}".format(x=node.key))
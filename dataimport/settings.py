@@ -10,7 +10,7 @@ DATASOURCES = {
 }
 
 PRODUCTS = {
-    "jac": "dataimport.assemblers.jac.JAC"
+    "jac": "dataimport.products.jac.JAC"
 }
 
 TARGETS = {
@@ -25,8 +25,33 @@ PRODUCT_TARGETS = {
     "jac": [{"id": "es17", "dir": os.path.join(TARGET_DIRS, "jac__es17")}]
 }
 
+TARGET_PRODUCTS = {
+    "es17": ["jac"]
+}
+
+SCHEDULER_WORKERS = 4
+
 DIR_DATE_FORMAT = "%Y-%m-%d_%H%M"
 
+HTTP_TIMEOUT = 60
+HTTP_MAX_HOSTS = 10
+HTTP_MAX_PER_HOST = 4
+
+RESOLVER_FETCH_WORKERS = 8
+
+# every stage writes its metrics to the instance it ran in, and to each of these sinks
+METRICS_SINKS = [
+    "dataimport.lib.metrics.JSONLinesSink"
+    # "dataimport.lib.metrics.PrometheusTextfileSink"
+]
+METRICS_JSONL_FILE = os.path.join(DATABASES, "metrics.jsonl")
+METRICS_PROMETHEUS_FILE = os.path.join(DATABASES, "metrics", "dataimport.prom")
+
+# "csv" or "columnar" (see dataimport.lib.columnar), and the compression for columnar files
+# (None, "zlib", "bz2" or "lzma")
+INTERMEDIATE_FORMAT = "csv"
+COLUMNAR_COMPRESSION = "zlib"
+
 RESOLVER_MAX_AGE = {
     "doaj": 60 * 60 * 24 * 7
 }
@@ -36,6 +61,16 @@ STORE_SCOPES = {
     "jac": os.path.join(DATABASES, "products", "jac")
 }
 
+# the codec ("gzip", "bz2" or "lzma", optionally with a level, e.g. "gzip:1") for files in each
+# store, by filename glob; the first matching glob wins, and files which match none are stored as
+# they are.  Files which are read by path (e.g. memory mapped) are always stored uncompressed, and
+# the DOAJ analyses are left uncompressed so that they can be memory mapped and read in shards.
+STORE_COMPRESSION = {
+    "doaj": {"origin.csv": "gzip:1", "licences.csv": "gzip:1"},
+    "jac": {"issn_clusters.csv": "gzip:1", "jac.json": "gzip:1"},
+    "es17": {"*.bulk": "gzip:1"}
+}
+
 STORE_KEEP_HISORIC = {
     "doaj": 3,
     "jac": 5,
@@ -47,9 +82,18 @@ STORE_KEEP_HISORIC = {
 
 DOAJ_PUBLIC_DATA_DUMP = "https://doaj.org/public-data-dump/journal"
 DOAJ_PUBLIC_DATA_DUMP_KEYFILE = "/home/richard/Code/External/journalcheckertool/Importer/keyfiles/doaj_public_data_dump.txt"
+DOAJ_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOAJ_DOWNLOAD_CONNECTIONS = 1
+DOAJ_DOWNLOAD_RETRIES = 5
+DOAJ_DOWNLOAD_TIMEOUT = 60
+DOAJ_JSON_CHUNK_SIZE = 64 * 1024
+DOAJ_EXTRACT_WORKERS = 1
 
 
 JAC_PREF_ORDER = ["doaj"]
+JAC_ANALYSE_WORKERS = 1
+JAC_ASSEMBLE_WORKERS = 1
+JAC_ASSEMBLE_CHUNK_SIZE = 10000
 
 
 ES17_HOST = "http://localhost:9200"
@@ -57,6 +101,16 @@ ES17_INDEX_PREFIX = 'jct'
 ES17_INDEX_SUFFIX = 'dev'
 ES17_INDEX_SUFFIX_DATE_FORMAT = "%Y%m%d%H%M%S"
 ES17_KEEP_OLD_INDICES = 2
+ES17_WRITE_BULKFILE = False
+ES17_DELTA_LOAD = False
+ES17_ID_KEYS = {
+    "jac": "issns"
+}
+ES17_BULK_WORKERS = 4
+ES17_BULK_MAX_DOCS = 5000
+ES17_BULK_MAX_BYTES = 10 * 1024 * 1024
+ES17_BULK_RETRIES = 5
+ES17_BULK_BACKOFF = 1
 ES17_DEFAULT_MAPPING = {
     "dynamic_templates": [
         {
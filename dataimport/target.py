@@ -5,10 +5,14 @@ from dataimport.assembler import Assembler
 
 
 class Target(object):
-    def __init__(self, config, id):
+    # the config which affects what prepare and load do
+    CONFIG_KEYS = []
+
+    def __init__(self, config, id, product=None, dir=None):
         self.id = id
         self.config = config
-        self.file_manager = FileManager(config, self.id)
+        self.product = product
+        self.file_manager = FileManager(config, self.id, base_dir=dir)
 
     def log(self, msg):
         logger.log(msg, self.id.upper())
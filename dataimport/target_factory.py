@@ -10,18 +10,14 @@ class TargetFactory(object):
         target_cfg = self.config.PRODUCT_TARGETS.get(product.id)
         targets = []
         for tc in target_cfg:
-            tn = tc.get("id")
-            dir = tc.get("dir")
-            ref = self.config.TARGETS.get(tn)
-            klazz = plugin.load_class(ref)
-            targets.append(klazz(self.config, tn, product, dir))
+            targets.append(self.get_target(tc.get("id"), product, tc.get("dir")))
 
         return targets
 
-    def get_target(self, name):
+    def get_target(self, name, product=None, dir=None):
         ref = self.config.TARGETS.get(name)
         klazz = plugin.load_class(ref)
-        return klazz(self.config, name)
+        return klazz(self.config, name, product, dir)
 
     def get_all_targets(self):
         all = []
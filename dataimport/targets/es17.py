@@ -1,32 +1,60 @@
 from dataimport.target import Target
 from dataimport.formats.json_feed import JSONFeed
 from dataimport.format import FormatNotSupported
+from dataimport.lib import bulk, httpclient, metrics, compression
 
 import uuid
+import hashlib
+import csv
 import esprit
 from datetime import datetime
-import requests
 import json
 import re
 
 class ES17(Target):
+    LOADED_HASHES = "loaded.csv"
+    # the row of the loaded hashes which gives the index they were loaded into, rather than a record
+    LOADED_INDEX_ROW = "#index"
+
+    CONFIG_KEYS = ["ES17_HOST", "ES17_INDEX_PREFIX", "ES17_INDEX_SUFFIX", "ES17_DEFAULT_MAPPING",
+                   "ES17_ID_KEYS", "ES17_WRITE_BULKFILE", "ES17_DELTA_LOAD"]
 
     def prepare(self):
         if not self.product.provides_format(JSONFeed):
             raise FormatNotSupported(JSONFeed)
 
-        feed = self.product.get_format(JSONFeed)
+        # unless a replayable bulk file is asked for, the load stage streams straight from the product
+        if not self.config.ES17_WRITE_BULKFILE:
+            self.file_manager.activate()
+            self.log("no bulk file requested, records will be streamed from {x} at load time".format(x=self.product.id))
+            return
+
         bulkfile = self._bulkfile_name()
+        hashes = {}
 
         with self.file_manager.output_file(bulkfile) as o:
-            for d in feed.entries():
-                if "id" not in d:
-                    d["id"] = uuid.uuid4().hex
-                bulklines = esprit.raw.to_bulk_single_rec(d)
+            for bulklines in self._bulk_records(hashes):
                 o.write(bulklines)
 
+        self._write_hashes(self._prepared_hashes_name(), hashes)
+        metrics.count("rows_out", len(hashes))
+
     def load(self):
         alias = self._get_alias_name()
+
+        if self.config.ES17_DELTA_LOAD:
+            live_index = self._aliased_index(alias)
+            previous_path = self._last_loaded_path()
+            if live_index is not None and previous_path is not None:
+                previous = self._read_hashes(previous_path)
+                loaded_into = previous.pop(self.LOADED_INDEX_ROW, None)
+                if loaded_into == live_index:
+                    self._delta_load(live_index, previous)
+                    return
+                self.log("previous load was into {x}, but {y} is behind the alias, running a full load".format(x=loaded_into, y=live_index))
+            else:
+                self.log("no previous load to compare against, running a full load")
+
         timestamped_index_name = alias + datetime.strftime(datetime.utcnow(), self.config.ES17_INDEX_SUFFIX_DATE_FORMAT)
 
         conn = esprit.raw.Connection(self.config.ES17_HOST, timestamped_index_name)
@@ -40,18 +68,25 @@ class ES17(Target):
         else:
             self.log("ES Type + Mapping already exists in index {0}".format(conn.index))
 
-        bulkfile_name = self._bulkfile_name()
-        bulkfile = self.file_manager.file_path(bulkfile_name)
+        loader = self._bulk_loader(conn)
+        if self.config.ES17_WRITE_BULKFILE:
+            bulkfile_name = self._bulkfile_name()
+            bulkfile = self.file_manager.file_path(bulkfile_name)
+
+            self.log("bulk loading from {x}".format(x=bulkfile))
+            with self.file_manager.input_file(bulkfile_name) as f:
+                loader.load(f)
+            hashes = self._read_hashes(self.file_manager.stored_path(self._prepared_hashes_name()))
+        else:
+            if not self.product.provides_format(JSONFeed):
+                raise FormatNotSupported(JSONFeed)
+            self.log("bulk loading directly from {x}".format(x=self.product.id))
+            hashes = {}
+            loader.load(self._bulk_lines(hashes))
 
-        self.log("bulk loading from {x}".format(x=bulkfile))
-        esprit.tasks.bulk_load(conn, self.product.id, bulkfile)
+        metrics.count("rows_out", len(hashes))
 
-        old_idx = None
-        aliases = self._list_aliases(conn)
-        for idx, a in aliases.items():
-            if alias in a.get("aliases", {}):
-                old_idx = idx
-                break
+        old_idx = self._aliased_index(alias)
 
         if old_idx is None:
             self.log("creating new alias {x} for {y}".format(x=alias, y=conn.index))
@@ -61,6 +96,50 @@ class ES17(Target):
             self.log("repointing existing alias {x} from {y} to {z}".format(x=alias, y=old_conn.index, z=conn.index))
             esprit.tasks.repoint_alias(old_conn, conn, alias)
 
+        # only now that the index is live are these the hashes of what is loaded, for the next
+        # delta load to compare against
+        self._write_hashes(self.LOADED_HASHES, hashes, index=conn.index)
+
+    def _last_loaded_path(self):
+        # the hashes of the most recent load, which is in this instance if it has already been
+        # loaded (e.g. by an earlier delta load), or else in the last instance which was
+        return self.file_manager.stored_path(self.LOADED_HASHES) or self.file_manager.previous_file_path(self.LOADED_HASHES)
+
+    def _delta_load(self, live_index, previous):
+        # Only send the records which have changed since the last load, straight into the index
+        # currently behind the alias.  New and changed records are (re)indexed in full, and records
+        # which have gone away are deleted
+        if not self.product.provides_format(JSONFeed):
+            raise FormatNotSupported(JSONFeed)
+
+        self.log("delta loading into live index {x}, against {y} previously loaded records".format(x=live_index, y=len(previous)))
+
+        conn = esprit.raw.Connection(self.config.ES17_HOST, live_index)
+        hashes = {}
+        counts = {"index": 0, "delete": 0}
+
+        self._bulk_loader(conn).load(self._delta_lines(previous, hashes, counts))
+        self.log("delta load sent {x} index and {y} delete actions".format(x=counts["index"], y=counts["delete"]))
+        metrics.count("rows_out", counts["index"] + counts["delete"])
+
+        self._write_hashes(self.LOADED_HASHES, hashes, index=live_index)
+
+    def _delta_lines(self, previous, hashes, counts):
+        feed = self.product.get_format(JSONFeed)
+        for d in feed.entries():
+            self._set_id(d)
+            content_hash = self._content_hash(d)
+            hashes[d["id"]] = content_hash
+            if previous.get(d["id"]) == content_hash:
+                continue
+            counts["index"] += 1
+            for line in esprit.raw.to_bulk_single_rec(d).splitlines(True):
+                yield line
+
+        for removed in previous.keys() - hashes.keys():
+            counts["delete"] += 1
+            yield json.dumps({"delete": {"_id": removed}}) + "\n"
+
     def cleanup(self):
         super(ES17, self).cleanup()
 
@@ -80,13 +159,72 @@ class ES17(Target):
             conn = esprit.raw.Connection(conn.host, r, port=conn.port)
             esprit.raw.delete(conn)
 
+    def _set_id(self, d):
+        # records get an id derived from their content, so that the same record has the same id from
+        # one load to the next.  For JAC that is the lowest ISSN in the record's cluster
+        if "id" in d:
+            return
+        key = d.get(self.config.ES17_ID_KEYS.get(self.product.id, ""))
+        if isinstance(key, list):
+            key = min(key) if len(key) > 0 else None
+        if key:
+            d["id"] = str(key).lower()
+        else:
+            d["id"] = uuid.uuid4().hex
+
+    def _content_hash(self, d):
+        return hashlib.sha1(json.dumps(_canonical(d), sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _bulk_records(self, hashes):
+        feed = self.product.get_format(JSONFeed)
+        for d in feed.entries():
+            self._set_id(d)
+            hashes[d["id"]] = self._content_hash(d)
+            yield esprit.raw.to_bulk_single_rec(d)
+
+    def _bulk_lines(self, hashes):
+        for bulklines in self._bulk_records(hashes):
+            for line in bulklines.splitlines(True):
+                yield line
+
+    def _prepared_hashes_name(self):
+        return self._bulkfile_name() + ".hashes.csv"
+
+    def _write_hashes(self, filename, hashes, index=None):
+        with self.file_manager.output_file(filename) as o:
+            writer = csv.writer(o)
+            if index is not None:
+                writer.writerow([self.LOADED_INDEX_ROW, index])
+            writer.writerows(hashes.items())
+
+    def _read_hashes(self, path):
+        with compression.open_stored(path) as f:
+            return {row[0]: row[1] for row in csv.reader(f)}
+
+    def _aliased_index(self, alias):
+        aliases = self._list_aliases()
+        for idx, a in aliases.items():
+            if alias in a.get("aliases", {}):
+                return idx
+        return None
+
     def _bulkfile_name(self):
         return self.product.id + "__" + self.id + ".bulk"
 
+    def _bulk_loader(self, conn):
+        url = conn.host + ":" + conn.port + "/" + conn.index + "/" + self.product.id + "/_bulk"
+        return bulk.BulkLoader(url,
+                               workers=self.config.ES17_BULK_WORKERS,
+                               max_docs=self.config.ES17_BULK_MAX_DOCS,
+                               max_bytes=self.config.ES17_BULK_MAX_BYTES,
+                               retries=self.config.ES17_BULK_RETRIES,
+                               backoff=self.config.ES17_BULK_BACKOFF,
+                               log=self.log)
+
     def _list_aliases(self, conn=None):
         if conn is None:
             conn = esprit.raw.Connection(self.config.ES17_HOST, "")
-        resp = requests.get(conn.host + ":" + conn.port + "/_aliases")
+        resp = httpclient.session(self.config).get(conn.host + ":" + conn.port + "/_aliases")
         aliases = json.loads(resp.text)
         return aliases
 
@@ -100,4 +238,16 @@ class ES17(Target):
             index_prefix = index_prefix + "_"
 
         alias = index_prefix + self.product.id + index_suffix
-        return alias
\ No newline at end of file
+        return alias
+
+
+def _canonical(d):
+    # for comparing records from one load to the next, the order of lists of values is not significant
+    if isinstance(d, dict):
+        return {k: _canonical(v) for k, v in d.items()}
+    if isinstance(d, list):
+        values = [_canonical(v) for v in d]
+        if all(isinstance(v, str) for v in values):
+            values.sort()
+        return values
+    return d
@@ -0,0 +1,202 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dataimport.lib import bulk
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    # A stand-in for the _bulk endpoint.  Each request takes the next entry of server.script: an
+    # int is the status of the whole request, and a dict is the status of each item by _id.  Once
+    # the script runs out every item is created.  The _ids of each request are recorded in
+    # server.requests, and the size of its body in server.sizes.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        ops = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+        actions = [op for op in ops if any(k in op for k in ("index", "create", "update", "delete"))]
+        with self.server.lock:
+            step = self.server.script.pop(0) if len(self.server.script) > 0 else {}
+            self.server.requests.append([list(a.values())[0]["_id"] for a in actions])
+            self.server.sizes.append(len(body))
+
+        if isinstance(step, int):
+            self._respond(step, {"error": {"type": "es_rejected_execution_exception"}, "status": step})
+            return
+
+        items = []
+        for action in actions:
+            kind, meta = list(action.items())[0]
+            status = step.get(meta["_id"], 201)
+            item = {"_id": meta["_id"], "status": status}
+            if status >= 300:
+                item["error"] = {"type": "es_rejected_execution_exception" if status == 429 else "mapper_parsing_exception"}
+            items.append({kind: item})
+        self._respond(200, {"errors": any(list(i.values())[0]["status"] >= 300 for i in items), "items": items})
+
+    def _respond(self, status, data):
+        out = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+class BulkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, script=None):
+        super(BulkServer, self).__init__(("127.0.0.1", 0), BulkHandler)
+        self.script = list(script or [])
+        self.requests = []
+        self.sizes = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{x}/_bulk".format(x=self.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def bulk_lines(ids, title="title"):
+    for i in ids:
+        yield json.dumps({"index": {"_index": "jac", "_type": "journal", "_id": i}}) + "\n"
+        yield json.dumps({"title": title}, ensure_ascii=False) + "\n"
+
+
+class TestBatches(unittest.TestCase):
+    def test_operations(self):
+        lines = ['{"index": {"_id": "a"}}\n', '{"x": 1}\n', "\n", '{"delete": {"_id": "b"}}', '{"create": {"_id": "c"}}', '{"x": 2}']
+        ops = list(bulk.operations(lines))
+        self.assertEqual(ops, [('{"index": {"_id": "a"}}\n', '{"x": 1}\n'),
+                               ('{"delete": {"_id": "b"}}\n', None),
+                               ('{"create": {"_id": "c"}}\n', '{"x": 2}\n')])
+
+    def test_operations_missing_source(self):
+        with self.assertRaises(bulk.BulkException):
+            list(bulk.operations(['{"index": {"_id": "a"}}\n']))
+
+    def test_doc_cap(self):
+        ops = list(bulk.operations(bulk_lines(range(10))))
+        self.assertEqual([len(b) for b in bulk.batches(ops, 4, 10 ** 6)], [4, 4, 2])
+
+    def test_byte_cap(self):
+        ops = list(bulk.operations(bulk_lines(range(10))))
+        size = len(ops[0][0]) + len(ops[0][1])
+        self.assertEqual([len(b) for b in bulk.batches(ops, 100, size * 3)], [3, 3, 3, 1])
+
+    def test_byte_cap_counts_encoded_bytes(self):
+        # each title is 100 characters, but 300 bytes of UTF-8
+        ops = list(bulk.operations(bulk_lines(range(4), title="日" * 100)))
+        chars = len(ops[0][0]) + len(ops[0][1])
+        size = len(ops[0][0].encode("utf-8")) + len(ops[0][1].encode("utf-8"))
+        self.assertGreater(size, chars * 2)
+        self.assertEqual([len(b) for b in bulk.batches(ops, 100, chars * 2)], [1, 1, 1, 1])
+        self.assertEqual([len(b) for b in bulk.batches(ops, 100, size * 2)], [2, 2])
+
+    def test_oversized_op_is_sent_alone(self):
+        ops = list(bulk.operations(bulk_lines(range(3))))
+        self.assertEqual([len(b) for b in bulk.batches(ops, 100, 1)], [1, 1, 1])
+
+
+class TestBulkLoader(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+
+    def _loader(self, server, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        kwargs.setdefault("workers", 1)
+        return bulk.BulkLoader(server.url, log=self.messages.append, **kwargs)
+
+    def _retries(self):
+        return [m for m in self.messages if "retrying" in m]
+
+    def test_load(self):
+        with BulkServer() as server:
+            report = self._loader(server, workers=3, max_docs=7).load(bulk_lines(map(str, range(50))))
+        self.assertEqual(report["docs"], 50)
+        self.assertEqual(report["batches"], 8)
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(sorted(sum(server.requests, []), key=int), [str(i) for i in range(50)])
+        self.assertEqual(sorted(len(r) for r in server.requests), [1] + [7] * 7)
+
+    def test_byte_cap(self):
+        lines = list(bulk_lines(map(str, range(20)), title="é" * 50))
+        with BulkServer() as server:
+            self._loader(server, max_bytes=500).load(lines)
+        self.assertGreater(len(server.requests), 1)
+        self.assertTrue(all(s <= 500 for s in server.sizes))
+
+    def test_rejected_request_is_retried(self):
+        # the cluster answers 429 (and then 503) to the whole request, and then accepts it
+        with BulkServer([429, 503]) as server:
+            report = self._loader(server).load(bulk_lines(["a", "b", "c"]))
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(server.requests, [["a", "b", "c"]] * 3)
+        self.assertEqual(report["bytes"], sum(server.sizes))
+
+    def test_queue_full_items_are_retried_alone(self):
+        # only the items rejected because the write queue was full are sent again
+        with BulkServer([{"b": 429, "d": 429}, {"d": 429}]) as server:
+            report = self._loader(server).load(bulk_lines(["a", "b", "c", "d"]))
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(report["docs"], 4)
+        self.assertEqual(server.requests, [["a", "b", "c", "d"], ["b", "d"], ["d"]])
+
+    def test_backoff(self):
+        # the delay doubles with each retry of a batch
+        with BulkServer([429, 429, 429]) as server:
+            self._loader(server, backoff=0.01).load(bulk_lines(["a"]))
+        self.assertEqual([m.rsplit(" ", 1)[1] for m in self._retries()], ["0.01s", "0.02s", "0.04s"])
+
+    def test_gives_up_after_retries(self):
+        with BulkServer([429] * 10) as server:
+            with self.assertRaises(bulk.BulkException) as cm:
+                self._loader(server, retries=2).load(bulk_lines(["a", "b"]))
+        self.assertEqual(len(server.requests), 3)
+        self.assertIn("2 bulk operations failed", str(cm.exception))
+        self.assertIn("gave up after 2 retries", str(cm.exception))
+
+    def test_gives_up_on_items_after_retries(self):
+        with BulkServer([{"b": 429}] * 10) as server:
+            with self.assertRaises(bulk.BulkException) as cm:
+                self._loader(server, retries=3).load(bulk_lines(["a", "b", "c"]))
+        self.assertEqual(server.requests, [["a", "b", "c"], ["b"], ["b"], ["b"]])
+        self.assertIn("1 bulk operations failed", str(cm.exception))
+
+    def test_item_errors_are_not_retried(self):
+        with BulkServer([{"b": 400}]) as server:
+            with self.assertRaises(bulk.BulkException) as cm:
+                self._loader(server).load(bulk_lines(["a", "b", "c"]))
+        self.assertEqual(server.requests, [["a", "b", "c"]])
+        self.assertIn("mapper_parsing_exception", str(cm.exception))
+        self.assertEqual(self._retries(), [])
+
+    def test_missing_delete_is_not_an_error(self):
+        lines = [json.dumps({"delete": {"_index": "jac", "_id": "a"}}) + "\n"]
+        with BulkServer([{"a": 404}]) as server:
+            report = self._loader(server).load(lines)
+        self.assertEqual(report["failed"], 0)
+
+    def test_request_error_is_not_retried(self):
+        with BulkServer([400]) as server:
+            with self.assertRaises(bulk.BulkException):
+                self._loader(server).load(bulk_lines(["a"]))
+        self.assertEqual(len(server.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from dataimport import settings
+from dataimport.datasources import doaj
+
+
+def journal(n):
+    licences = [{"type": "CC BY"}, {"type": "CC BY-SA"}][:n % 3]
+    return {"bibjson": {"eissn": "{x:04d}-000X".format(x=n), "pissn": "{x:04d}-0001".format(x=n),
+                        "title": "Journal {x} – ünïcode".format(x=n), "alternative_title": "",
+                        "publisher": {"name": "Publisher {x}".format(x=n % 7)}, "license": licences}}
+
+
+class TestExtract(unittest.TestCase):
+    MEMBERS = 20
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        values = {k: v for k, v in vars(settings).items() if k.isupper()}
+        values["STORE_SCOPES"] = {"doaj": os.path.join(self.dir, "doaj")}
+        self.config = types.SimpleNamespace(**values)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _datasource(self, workers, members=None):
+        self.config.DOAJ_EXTRACT_WORKERS = workers
+        ds = doaj.DOAJ(self.config, "doaj")
+        with tarfile.open(ds.file_manager.file_path("origin.tar.gz"), "w:gz") as tf:
+            for i, content in enumerate(members or self._members()):
+                info = tarfile.TarInfo("doaj_journal_data/journal_batch_{x}.json".format(x=i))
+                info.size = len(content)
+                tf.addfile(info, io.BytesIO(content))
+        return ds
+
+    def _members(self):
+        return [json.dumps([journal(m * 10 + i) for i in range(10)]).encode("utf-8") for m in range(self.MEMBERS)]
+
+    def _origin(self, ds):
+        with ds.file_manager.input_file("origin.csv", mode="rb") as f:
+            return f.read()
+
+    def _extract(self, workers, members=None):
+        ds = self._datasource(workers, members)
+        ds._extract_doaj_data()
+        return ds
+
+    def test_parallel_is_identical(self):
+        serial = self._origin(self._extract(1))
+        shutil.rmtree(os.path.join(self.dir, "doaj"))
+        ds = self._extract(3)
+        self.assertEqual(self._origin(ds), serial)
+        self.assertEqual(len(serial.splitlines()), self.MEMBERS * 10 + sum(1 for n in range(self.MEMBERS * 10) if n % 3 == 2))
+        self.assertFalse(os.path.exists(ds.file_manager.file_path("origin_shards")))
+
+    def test_bounded_members_on_disk(self):
+        # each time a member is read from the tarball, no more than workers * 2 members (and as many
+        # shards) are waiting on disk
+        ds = self._datasource(2)
+        shard_dir = ds.file_manager.file_path("origin_shards")
+        on_disk = []
+        extractfile = tarfile.TarFile.extractfile
+
+        def counting(tf, member):
+            files = os.listdir(shard_dir)
+            on_disk.append((len([f for f in files if f.endswith(".json")]), len(files)))
+            return extractfile(tf, member)
+
+        with mock.patch.object(tarfile.TarFile, "extractfile", counting):
+            ds._extract_doaj_data()
+
+        self.assertEqual(len(on_disk), self.MEMBERS)
+        self.assertLessEqual(max(m for m, _ in on_disk), 4)
+        self.assertLessEqual(max(n for _, n in on_disk), 8)
+
+    def test_failure_cleans_up(self):
+        members = self._members()
+        members[5] = b'[{"bibjson": '
+        ds = self._datasource(3, members)
+        opened = []
+        tarfile_open = tarfile.open
+
+        def recording(*args, **kwargs):
+            tf = tarfile_open(*args, **kwargs)
+            opened.append(tf)
+            return tf
+
+        with mock.patch.object(doaj.tarfile, "open", recording):
+            with self.assertRaises(Exception):
+                ds._extract_doaj_data()
+
+        self.assertTrue(opened[0].closed)
+        self.assertFalse(os.path.exists(ds.file_manager.file_path("origin_shards")))
+
+
+if __name__ == "__main__":
+    unittest.main()
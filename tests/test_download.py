@@ -0,0 +1,246 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dataimport.lib import download
+
+CONTENT = bytes(range(256)) * 4096 + b"tail"
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Serves server.content, honouring Range (and If-Range) only if server.ranges is set.  If
+    # server.drop_after is set, the next GET sends that many bytes of its body and then drops the
+    # connection.  Every request's method and headers are recorded in server.requests.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._record()
+        if not self.server.head:
+            self._respond(405, {}, b"")
+            return
+        self._respond(200, self._validators(), b"", length=len(self.server.content))
+
+    def do_GET(self):
+        self._record()
+        content = self.server.content
+        inm = self.headers.get("If-None-Match")
+        if inm is not None and inm == self.server.etag:
+            self._respond(304, self._validators(), b"")
+            return
+
+        rng = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if rng and self.server.ranges and (if_range is None or if_range in (self.server.etag, self.server.last_modified)):
+            start, _, end = rng[len("bytes="):].partition("-")
+            start = int(start)
+            end = int(end) if end else len(content) - 1
+            headers = self._validators()
+            headers["Content-Range"] = "bytes {x}-{y}/{z}".format(x=start, y=end, z=len(content))
+            self._respond(206, headers, content[start:end + 1])
+            return
+
+        self._respond(200, self._validators(), content)
+
+    def _record(self):
+        self.server.requests.append((self.command, dict(self.headers)))
+
+    def _validators(self):
+        headers = {}
+        if self.server.etag:
+            headers["ETag"] = self.server.etag
+        if self.server.last_modified:
+            headers["Last-Modified"] = self.server.last_modified
+        if self.server.ranges:
+            headers["Accept-Ranges"] = "bytes"
+        return headers
+
+    def _respond(self, status, headers, body, length=None):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        if self.command == "HEAD" or status == 304:
+            return
+        drop = self.server.drop_after
+        if drop is not None and self.command == "GET":
+            self.server.drop_after = None
+            self.wfile.write(body[:drop])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, content=CONTENT, etag=ETAG, last_modified=LAST_MODIFIED, ranges=True, head=True):
+        super(StandInServer, self).__init__(("127.0.0.1", 0), StandInHandler)
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ranges = ranges
+        self.head = head
+        self.drop_after = None
+        self.requests = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{x}/dump.tar.gz".format(x=self.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def gets(self):
+        return [headers for method, headers in self.requests if method == "GET"]
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "current", "origin.tar.gz")
+        os.makedirs(os.path.dirname(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _previous(self, content=CONTENT, validators=None):
+        previous = os.path.join(self.dir, "previous", "origin.tar.gz")
+        os.makedirs(os.path.dirname(previous))
+        with open(previous, "wb") as f:
+            f.write(content)
+        download.write_validators(previous, validators or {"etag": ETAG, "last_modified": LAST_MODIFIED, "length": len(content)})
+        return previous
+
+    def test_download(self):
+        with StandInServer() as server:
+            self.assertEqual(download.download(server.url, self.path, backoff=0), download.DOWNLOADED)
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(download.read_validators(self.path)["etag"], ETAG)
+        self.assertFalse(os.path.exists(download.partial_path(self.path)))
+
+    def test_resume_after_dropped_connection(self):
+        with StandInServer() as server:
+            server.drop_after = 100000
+            self.assertEqual(download.download(server.url, self.path, retries=2, backoff=0), download.DOWNLOADED)
+            gets = server.gets()
+
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(len(gets), 2)
+        self.assertNotIn("Range", gets[0])
+        self.assertEqual(gets[1]["Range"], "bytes=100000-")
+        self.assertEqual(gets[1]["If-Range"], ETAG)
+
+    def test_resume_partial_adopted_from_an_earlier_attempt(self):
+        earlier = os.path.join(self.dir, "earlier", "origin.tar.gz")
+        os.makedirs(os.path.dirname(earlier))
+        part = download.partial_path(earlier)
+        with open(part, "wb") as f:
+            f.write(CONTENT[:5000])
+        download.write_validators(part, {"etag": ETAG, "last_modified": LAST_MODIFIED, "length": len(CONTENT)})
+
+        download.adopt_partial(part, self.path)
+        self.assertFalse(os.path.exists(part))
+
+        with StandInServer() as server:
+            download.download(server.url, self.path, backoff=0)
+            gets = server.gets()
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual([g.get("Range") for g in gets], ["bytes=5000-"])
+
+    def test_partial_of_another_version_is_discarded(self):
+        part = download.partial_path(self.path)
+        with open(part, "wb") as f:
+            f.write(b"x" * 5000)
+        download.write_validators(part, {"etag": '"v0"', "last_modified": None, "length": len(CONTENT)})
+
+        with StandInServer() as server:
+            download.download(server.url, self.path, backoff=0)
+            gets = server.gets()
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertNotIn("Range", gets[0])
+
+    def test_unchanged_etag_reuses_previous(self):
+        previous = self._previous()
+        with StandInServer() as server:
+            self.assertEqual(download.download(server.url, self.path, previous=previous), download.NOT_MODIFIED)
+            self.assertEqual(server.gets(), [])
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(os.stat(self.path).st_ino, os.stat(previous).st_ino)
+
+    def test_unchanged_last_modified_reuses_previous(self):
+        previous = self._previous()
+        with StandInServer(etag=None) as server:
+            self.assertEqual(download.download(server.url, self.path, previous=previous), download.NOT_MODIFIED)
+            self.assertEqual(server.gets(), [])
+        self.assertEqual(self._read(self.path), CONTENT)
+
+    def test_304_reuses_previous(self):
+        # without a HEAD to compare validators, the conditional GET is answered with a 304
+        previous = self._previous()
+        with StandInServer(head=False) as server:
+            self.assertEqual(download.download(server.url, self.path, previous=previous), download.NOT_MODIFIED)
+            gets = server.gets()
+        self.assertEqual(gets[0]["If-None-Match"], ETAG)
+        self.assertEqual(self._read(self.path), CONTENT)
+
+    def test_changed_resource_is_downloaded(self):
+        previous = self._previous(b"old content", {"etag": '"v0"', "last_modified": None, "length": 11})
+        with StandInServer() as server:
+            self.assertEqual(download.download(server.url, self.path, previous=previous, backoff=0), download.DOWNLOADED)
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(self._read(previous), b"old content")
+
+    def test_parallel_ranges_reassemble(self):
+        with StandInServer() as server:
+            self.assertEqual(download.download(server.url, self.path, connections=4, chunk_size=4096, backoff=0), download.DOWNLOADED)
+            gets = server.gets()
+        self.assertEqual(self._read(self.path), CONTENT)
+        ranges = sorted(g["Range"] for g in gets)
+        size = -(-len(CONTENT) // 4)
+        self.assertEqual(ranges, sorted("bytes={x}-{y}".format(x=i * size, y=min((i + 1) * size, len(CONTENT)) - 1) for i in range(4)))
+        self.assertEqual([f for f in os.listdir(os.path.dirname(self.path)) if f.startswith("origin.tar.gz.part")], [])
+
+    def test_server_ignoring_range_on_resume(self):
+        # a server which does not do ranges sends the whole resource again, which replaces the
+        # partial rather than being appended to it
+        part = download.partial_path(self.path)
+        with open(part, "wb") as f:
+            f.write(CONTENT[:5000])
+        download.write_validators(part, {"etag": ETAG, "last_modified": LAST_MODIFIED, "length": len(CONTENT)})
+
+        with StandInServer(ranges=False) as server:
+            download.download(server.url, self.path, backoff=0)
+            gets = server.gets()
+        self.assertEqual(gets[0]["Range"], "bytes=5000-")
+        self.assertEqual(self._read(self.path), CONTENT)
+
+    def test_server_ignoring_range_downloads_in_one_stream(self):
+        with StandInServer(ranges=False) as server:
+            download.download(server.url, self.path, connections=4, backoff=0)
+            gets = server.gets()
+        self.assertEqual(len(gets), 1)
+        self.assertNotIn("Range", gets[0])
+        self.assertEqual(self._read(self.path), CONTENT)
+
+
+if __name__ == "__main__":
+    unittest.main()
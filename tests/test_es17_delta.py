@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from dataimport import settings
+from dataimport.file_manager import FileManager
+from dataimport.formats.json_feed import JSONFeed
+
+try:
+    from dataimport.targets import es17
+except ImportError:
+    es17 = None
+
+
+class Feed(JSONFeed):
+    def __init__(self, records):
+        super(Feed, self).__init__()
+        self.records = records
+
+    def entries(self):
+        for r in self.records:
+            yield dict(r)
+
+
+class Product(object):
+    id = "jac"
+
+    def __init__(self):
+        self.records = []
+
+    def provides_format(self, format_class):
+        return format_class == JSONFeed
+
+    def get_format(self, format_class):
+        return Feed(self.records)
+
+
+class Loader(object):
+    def __init__(self):
+        self.actions = []
+
+    def load(self, lines):
+        for line in lines:
+            action = json.loads(line)
+            for kind in ("index", "delete"):
+                if kind in action:
+                    self.actions.append((kind, action[kind]["_id"]))
+
+
+def record(issn, title="Journal"):
+    return {"issns": [issn], "title": title}
+
+
+@unittest.skipIf(es17 is None, "esprit is not installed")
+class TestDeltaLoad(unittest.TestCase):
+    LIVE_INDEX = "jct_jac_dev20200101000000"
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        values = {k: v for k, v in vars(settings).items() if k.isupper()}
+        values["ES17_DELTA_LOAD"] = True
+        self.config = types.SimpleNamespace(**values)
+        self.product = Product()
+
+        patches = [
+            mock.patch.object(es17.ES17, "_aliased_index", return_value=self.LIVE_INDEX),
+            mock.patch.object(es17.ES17, "_bulk_loader", side_effect=lambda conn: self._new_loader()),
+            mock.patch.object(es17.esprit.raw, "Connection", create=True)
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.loaders = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _new_loader(self):
+        loader = Loader()
+        self.loaders.append(loader)
+        return loader
+
+    def _target(self, instance):
+        target = es17.ES17(self.config, "es17", self.product, self.dir)
+        target.file_manager = FileManager(self.config, "es17", instance=os.path.join(self.dir, instance), base_dir=self.dir)
+        return target
+
+    def _earlier_load(self, records):
+        target = self._target("2020-01-01_0000")
+        hashes = {}
+        for r in records:
+            target._set_id(r)
+            hashes[r["id"]] = target._content_hash(r)
+        target._write_hashes(target.LOADED_HASHES, hashes, index=self.LIVE_INDEX)
+        target.file_manager.commit()
+
+    def test_consecutive_delta_loads(self):
+        self._earlier_load([record("0000-0001"), record("0000-0002")])
+        target = self._target("2020-01-08_0000")
+
+        self.product.records = [record("0000-0001"), record("0000-0002", "Renamed"), record("0000-0003")]
+        target.load()
+        self.assertEqual(sorted(self.loaders[-1].actions), [("index", "0000-0002"), ("index", "0000-0003")])
+
+        # loaded again in the same instance, against what the first delta load left in the index
+        self.product.records = [record("0000-0001"), record("0000-0002", "Renamed")]
+        target.load()
+        self.assertEqual(self.loaders[-1].actions, [("delete", "0000-0003")])
+
+        self.product.records = [record("0000-0001"), record("0000-0002", "Renamed")]
+        target.load()
+        self.assertEqual(self.loaders[-1].actions, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
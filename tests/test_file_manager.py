@@ -0,0 +1,88 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from dataimport.file_manager import FileManager, INSTANCES_FILE, LATEST_FILE
+
+
+class Config(object):
+    DIR_DATE_FORMAT = "%Y-%m-%d_%H%M"
+    STORE_KEEP_HISORIC = {"jac": 2}
+    STORE_SCOPES = {}
+
+
+def commit_instances(base_dir, names):
+    config = Config()
+    for name in names:
+        FileManager(config, "jac", instance=os.path.join(base_dir, name), base_dir=base_dir).commit()
+
+
+class TestFileManager(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = Config()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _manager(self, name=None):
+        instance = os.path.join(self.dir, name) if name is not None else None
+        return FileManager(self.config, "jac", instance=instance, base_dir=self.dir)
+
+    def _manifest(self):
+        with open(os.path.join(self.dir, INSTANCES_FILE), "r") as f:
+            return json.load(f)["instances"]
+
+    def test_commit(self):
+        self._manager("2020-01-01_000000000000").commit()
+        self._manager("2020-01-02_000000000000").activate()
+        self.assertEqual(self._manifest(), ["2020-01-01_000000000000"])
+        self.assertEqual(os.path.basename(self._manager().current_instance_name), "2020-01-01_000000000000")
+
+    def test_commits_from_several_processes(self):
+        # every process reads, changes and replaces the manifest; none of their commits may be lost
+        ctx = multiprocessing.get_context("fork")
+        names = [["2020-01-{d:02d}_{p:02d}0000000000".format(d=d, p=p) for d in range(1, 11)] for p in range(4)]
+        procs = [ctx.Process(target=commit_instances, args=(self.dir, n)) for n in names]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        self.assertEqual(self._manifest(), sorted(sum(names, []), reverse=True))
+        with open(os.path.join(self.dir, LATEST_FILE), "r") as f:
+            self.assertEqual(f.read(), "2020-01-10_030000000000")
+
+    def test_cleanup(self):
+        for d in range(1, 5):
+            self._manager("2020-01-0{d}_000000000000".format(d=d)).commit()
+        abandoned = self._manager("2020-01-01_120000000000")
+        abandoned.activate()
+        self._manager().cleanup()
+
+        self.assertEqual(self._manifest(), ["2020-01-04_000000000000", "2020-01-03_000000000000"])
+        self.assertEqual(sorted(d for d in os.listdir(self.dir) if d.startswith("2020")),
+                         ["2020-01-03_000000000000", "2020-01-04_000000000000"])
+
+    def test_cleanup_keeping_none(self):
+        self.config.STORE_KEEP_HISORIC = {"jac": 0}
+        self._manager("2020-01-01_000000000000").commit()
+        self._manager("2020-01-02_000000000000").activate()
+        self._manager().cleanup()
+
+        self.assertEqual(self._manifest(), [])
+        self.assertEqual([d for d in os.listdir(self.dir) if d.startswith("2020")], ["2020-01-02_000000000000"])
+
+    def test_cleanup_nothing_committed(self):
+        self.config.STORE_KEEP_HISORIC = {"jac": 0}
+        self._manager().cleanup()
+        os.makedirs(self.dir, exist_ok=True)
+        self._manager().cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import itertools
+import random
+import unittest
+
+from dataimport.lib import manipulators
+from dataimport.lib.disjoint_set import DisjointSet
+
+
+class RowsAnalysis(object):
+    # a stand-in for a coincident ISSNs analysis, over rows in memory
+    def __init__(self, rows, source="test"):
+        self.rows = rows
+        self.source = source
+
+    def entries(self, shard=0, shards=1):
+        return iter([list(row) for row in self.rows[shard::shards]])
+
+
+def transitive_consumption(analyses):
+    # The clustering which union-find replaced, as it was: rows grouped by their first ISSN, and
+    # then each group's members' groups folded into it, one level deep
+    inputs = []
+    for analysis in analyses:
+        inputs += [row + [analysis.source] for row in analysis.entries()]
+    inputs.sort()
+    inputs = list(k for k, _ in itertools.groupby(inputs))
+    inputs = manipulators.remove_invalid_issns(inputs)
+    inputs.sort(key=lambda x: x[0])
+
+    issn_clusters = []
+    current_issn_root = None
+    current_cluster = []
+    for row in inputs:
+        if not current_issn_root:
+            current_issn_root = row[0]
+            current_cluster.append(row[0])
+        if current_issn_root != row[0]:
+            current_cluster = list(set(current_cluster))
+            current_cluster.sort()
+            issn_clusters.append(current_cluster)
+
+            current_cluster = [row[0]]
+            current_issn_root = row[0]
+
+        if len(row) > 1 and row[1]:
+            current_cluster.append(row[1])
+
+    issn_clusters.sort()
+    issn_clusters = list(k for k, _ in itertools.groupby(issn_clusters))
+
+    d = {}
+    for row in issn_clusters:
+        if row[0] not in d:
+            d[row[0]] = []
+        d[row[0]] += [row[x + 1] for x in range(len(row) - 1)]
+
+    keys = list(d.keys())
+    for k in keys:
+        if k not in d:
+            continue
+        additions = []
+        for e in d[k]:
+            if e in d:
+                additions += [x for x in d[e] if x != k and x not in d[k]]
+                del d[e]
+        d[k] = list(set(d[k] + additions))
+
+    return sorted([k] + sorted(v) for k, v in d.items())
+
+
+def random_issn(rng):
+    return "{x:04d}-{y:03d}{z}".format(x=rng.randint(0, 9999), y=rng.randint(0, 999), z=rng.choice("0123456789X"))
+
+
+def coincident_rows(clusters):
+    # the rows the DOAJ analysis gives for clusters: every pair of members, both ways round, and
+    # a member alone if it has no other
+    rows = []
+    for cluster in clusters:
+        if len(cluster) == 1:
+            rows.append([cluster[0], ""])
+        for a, b in itertools.permutations(cluster, 2):
+            rows.append([a, b])
+    return rows
+
+
+def chain_rows(issns):
+    rows = []
+    for a, b in zip(issns, issns[1:]):
+        rows += [[a, b], [b, a]]
+    return rows
+
+
+class TestISSNClusters(unittest.TestCase):
+    def test_matches_transitive_consumption(self):
+        # On input the old loop got right - clusters whose members are all paired with each
+        # other, and whose highest ISSN is not on its own - the two must agree exactly
+        rng = random.Random(5)
+        for trial in range(200):
+            issns = list({random_issn(rng) for _ in range(rng.randint(1, 300))} - {"9999-999X", "9999-9998"})
+            rng.shuffle(issns)
+            clusters = [["9999-999X", "9999-9998"]]
+            while issns:
+                size = rng.choice([1, 1, 2, 2, 2, 3])
+                clusters.append(issns[:size])
+                issns = issns[size:]
+
+            rows = coincident_rows(clusters)
+            rng.shuffle(rows)
+            # some noise the validation has to remove
+            rows += [["not an issn", ""], ["", ""], ["1234-567", "abcd-efgh"]]
+            analyses = [RowsAnalysis(rows[:len(rows) // 2], "a"), RowsAnalysis(rows[len(rows) // 2:], "b")]
+
+            expected = transitive_consumption(analyses)
+            self.assertEqual(manipulators.issn_cluster_rows(analyses), expected)
+            self.assertEqual(manipulators.issn_cluster_rows(analyses, run_size=rng.randint(1, 50)), expected)
+
+    def test_lower_case_check_digit(self):
+        analyses = [RowsAnalysis([["1234-567x", "2345-6789"], ["2345-6789", "1234-567X"]])]
+        self.assertEqual(manipulators.issn_cluster_rows(analyses), transitive_consumption(analyses))
+        self.assertEqual(manipulators.issn_cluster_rows(analyses), [["1234-567X", "2345-6789"]])
+
+    def test_long_chain_is_one_cluster(self):
+        # the old loop only folded in one level of each group, so a long chain came out in pieces
+        chain = ["{x:04d}-0000".format(x=i) for i in range(20)]
+        analyses = [RowsAnalysis(chain_rows(chain))]
+        self.assertEqual(manipulators.issn_cluster_rows(analyses), [chain])
+        self.assertNotEqual(transitive_consumption(analyses), [chain])
+
+    def test_chain_given_out_of_order(self):
+        chain = ["{x:04d}-0000".format(x=i) for i in range(12)]
+        shuffled = list(chain)
+        random.Random(1).shuffle(shuffled)
+        analyses = [RowsAnalysis(chain_rows(shuffled))]
+        self.assertEqual(manipulators.issn_cluster_rows(analyses), [chain])
+
+    def test_chains_joined_through_a_shared_issn(self):
+        left = ["1000-0000", "1001-0000", "1002-0000", "1003-0000"]
+        right = ["2000-0000", "2001-0000", "2002-0000", "1003-0000"]
+        analyses = [RowsAnalysis(chain_rows(left)), RowsAnalysis(chain_rows(right))]
+        self.assertEqual(manipulators.issn_cluster_rows(analyses), [sorted(set(left + right))])
+
+    def test_highest_issn_alone_is_kept(self):
+        # the old loop never wrote out its last group, which lost the highest ISSN if it was alone
+        analyses = [RowsAnalysis([["1000-0000", "1001-0000"], ["1001-0000", "1000-0000"], ["9000-0000", ""]])]
+        self.assertEqual(manipulators.issn_cluster_rows(analyses), [["1000-0000", "1001-0000"], ["9000-0000"]])
+        self.assertNotIn(["9000-0000"], transitive_consumption(analyses))
+
+
+class TestDisjointSet(unittest.TestCase):
+    def test_groups(self):
+        clusters = DisjointSet()
+        for a, b in [(5, 3), (3, 9), (1, 2), (7, 7)]:
+            clusters.union(a, b)
+        clusters.add(4)
+        self.assertEqual(clusters.groups(), [[1, 2], [3, 5, 9], [4], [7]])
+        self.assertEqual(clusters.find(9), clusters.find(5))
+        self.assertEqual(len(clusters), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from dataimport.lib import metrics
+
+
+class Config(object):
+    METRICS_SINKS = []
+
+
+class TestPeakRSS(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, "_reset_peak_rss", return_value=True)
+        self.reset = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stage_alone(self):
+        with metrics.stage(Config(), "resolver", "doaj", "fetch") as m:
+            pass
+        self.assertEqual(self.reset.call_count, 1)
+        self.assertTrue(m.record()["peak_rss_is_stage"])
+        self.assertGreater(m.peak_rss_bytes, 0)
+
+    def test_nested_stage_does_not_reset(self):
+        with metrics.stage(Config(), "product", "jac", "assemble") as outer:
+            with metrics.stage(Config(), "resolver", "doaj", "analyse") as inner:
+                pass
+        self.assertEqual(self.reset.call_count, 1)
+        self.assertFalse(outer.record()["peak_rss_is_stage"])
+        self.assertFalse(inner.record()["peak_rss_is_stage"])
+
+    def test_concurrent_stages_do_not_reset(self):
+        started = threading.Event()
+        finish = threading.Event()
+        records = {}
+
+        def run():
+            with metrics.stage(Config(), "resolver", "doaj", "fetch") as m:
+                started.set()
+                finish.wait(10)
+            records["first"] = m.record()
+
+        t = threading.Thread(target=run)
+        t.start()
+        started.wait(10)
+        with metrics.stage(Config(), "resolver", "crossref", "fetch") as m:
+            pass
+        finish.set()
+        t.join()
+
+        self.assertEqual(self.reset.call_count, 1)
+        self.assertFalse(m.record()["peak_rss_is_stage"])
+        self.assertFalse(records["first"]["peak_rss_is_stage"])
+
+        # with nothing else running, the next stage resets it again
+        with metrics.stage(Config(), "resolver", "crossref", "analyse") as m:
+            pass
+        self.assertEqual(self.reset.call_count, 2)
+        self.assertTrue(m.record()["peak_rss_is_stage"])
+
+
+class TestWriteAtomically(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_concurrent_writers(self):
+        path = os.path.join(self.dir, "metrics.prom")
+        contents = ["{x}\n".format(x=i) * 1000 for i in range(8)]
+        threads = [threading.Thread(target=lambda c=c: [metrics._write_atomically(path, c) for _ in range(20)]) for c in contents]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        with open(path, "r") as f:
+            self.assertIn(f.read(), contents)
+        self.assertEqual(os.listdir(self.dir), ["metrics.prom"])
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+
+if __name__ == "__main__":
+    unittest.main()
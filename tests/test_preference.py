@@ -0,0 +1,213 @@
+import random
+import unittest
+
+from dataimport.lib.preference import PreferenceRanking
+
+
+# The selection as it was before PreferenceRanking, copied verbatim from manipulators.extract_preferred
+# and JAC._get_titles / JAC._get_publisher, to check that the results (including how ties are broken,
+# and the order of the alternative titles) are the same
+
+def extract_preferred(source_pairs, preference_order):
+    selected = None
+    idx = -1
+    for pref in preference_order:
+        opts = []
+        for i, tup in enumerate(source_pairs):
+            title, source = tup
+            if pref == source:
+                opts.append((i, title))
+
+        if len(opts) == 0:
+            continue
+
+        countopts = {}
+        for opt in opts:
+            if opt[1] not in countopts:
+                countopts[opt[1]] = {"count": 1, "idx": [opt[0]]}
+            else:
+                countopts[opt[1]]["count"] += 1
+                countopts[opt[1]]["idx"].append(opt[0])
+
+        selected_count = 0
+        for k, v in countopts.items():
+            if v["count"] > selected_count:
+                selected = k
+                selected_count = v["count"]
+                idx = v["idx"][0]
+
+        break
+
+    if selected is None:
+        selected = source_pairs[0][0]
+        idx = 0
+
+    del source_pairs[idx]
+    return selected
+
+
+def get_titles(issns, titles, preference_order):
+    mains = []
+    alts = []
+
+    for issn in issns:
+        candidates = titles.get(issn, [])
+        for c in candidates:
+            if c[1] == "main":
+                mains.append((c[0].strip(), c[2].strip()))
+            elif c[1] == "alt":
+                alts.append((c[0].strip(), c[2].strip()))
+
+    if len(mains) == 0:
+        # if there are no titles, return an empty state
+        if len(alts) == 0:
+            return None, alts
+        # otherwise return the best title from the alternates
+        main = extract_preferred(alts, preference_order)
+        return main, [x for x in list(set([a[0] for a in alts])) if x != main]
+
+    if len(mains) == 1:
+        return mains[0][0], [x for x in list(set([a[0] for a in alts])) if x != mains[0][0]]
+
+    main = extract_preferred(mains, preference_order)
+    return main, [x for x in list(set([m[0] for m in mains] + [a[0] for a in alts])) if x != main]
+
+
+def get_publisher(issns, publishers, preference_order):
+    pubs = []
+
+    for issn in issns:
+        candidates = publishers.get(issn, [])
+        for c in candidates:
+            pubs.append((c[0].strip(), c[1].strip()))
+
+    if len(pubs) == 0:
+        return None
+
+    pub = extract_preferred(pubs, preference_order)
+    return pub
+
+
+ISSNS = ["0000-0001", "0000-0002", "0000-0003"]
+
+
+class TestPreferenceRanking(unittest.TestCase):
+    def assertSameTitles(self, titles, preference_order):
+        expected = get_titles(ISSNS, titles, preference_order)
+        candidates = [c for issn in ISSNS for c in titles.get(issn, [])]
+        self.assertEqual(PreferenceRanking(preference_order).titles(candidates), expected)
+        return expected
+
+    def assertSamePublisher(self, publishers, preference_order):
+        expected = get_publisher(ISSNS, publishers, preference_order)
+        candidates = [c for issn in ISSNS for c in publishers.get(issn, [])]
+        self.assertEqual(PreferenceRanking(preference_order).publisher(candidates), expected)
+        return expected
+
+    def test_tied_counts(self):
+        # equally often offered by the preferred source, so the first offered wins
+        titles = {
+            "0000-0001": [["Beta", "main", "doaj"], ["Alpha", "main", "doaj"]],
+            "0000-0002": [["Alpha", "main", "doaj"], ["Beta", "main", "doaj"], ["Gamma", "main", "crossref"]]
+        }
+        self.assertEqual(self.assertSameTitles(titles, ["doaj", "crossref"])[0], "Beta")
+
+        publishers = {"0000-0001": [["B", "doaj"], ["A", "doaj"]], "0000-0002": [["A", "doaj"], ["B", "doaj"]]}
+        self.assertEqual(self.assertSamePublisher(publishers, ["doaj"]), "B")
+
+    def test_most_offered_wins(self):
+        titles = {
+            "0000-0001": [["Beta", "main", "crossref"], ["Alpha", "main", "doaj"]],
+            "0000-0002": [["Beta", "main", "crossref"], ["Beta", "main", "crossref"], ["Gamma", "main", "crossref"]],
+            "0000-0003": [["Gamma", "main", "crossref"]]
+        }
+        self.assertEqual(self.assertSameTitles(titles, ["crossref", "doaj"])[0], "Beta")
+        self.assertEqual(self.assertSameTitles(titles, ["doaj", "crossref"])[0], "Alpha")
+
+    def test_duplicate_sources_in_preference_order(self):
+        titles = {
+            "0000-0001": [["Alpha", "main", "crossref"], ["Beta", "main", "doaj"]],
+            "0000-0002": [["Gamma", "main", "sherpa"]]
+        }
+        for order in (["doaj", "crossref", "doaj"], ["crossref", "doaj", "crossref"], ["sherpa", "sherpa", "doaj"]):
+            self.assertSameTitles(titles, order)
+
+        publishers = {"0000-0001": [["A", "crossref"], ["B", "doaj"]]}
+        self.assertEqual(self.assertSamePublisher(publishers, ["doaj", "crossref", "doaj"]), "B")
+
+    def test_unranked_sources_only(self):
+        # no source is in the preference order, so the first candidate wins
+        titles = {
+            "0000-0001": [["Beta", "main", "sherpa"]],
+            "0000-0002": [["Alpha", "main", "crossref"], ["Alpha", "main", "crossref"]]
+        }
+        self.assertEqual(self.assertSameTitles(titles, ["doaj"])[0], "Beta")
+        self.assertEqual(self.assertSameTitles(titles, [])[0], "Beta")
+
+        publishers = {"0000-0002": [["B", "sherpa"], ["A", "crossref"], ["A", "crossref"]]}
+        self.assertEqual(self.assertSamePublisher(publishers, ["doaj"]), "B")
+
+    def test_single_main_title(self):
+        # a single main title is the main title, whatever the source of the alternatives
+        titles = {
+            "0000-0001": [["Alt", "alt", "doaj"], ["Main", "main", "sherpa"]],
+            "0000-0002": [["Other Alt", "alt", "doaj"], ["Main", "alt", "doaj"], ["Alt", "alt", "crossref"]]
+        }
+        main, alts = self.assertSameTitles(titles, ["doaj"])
+        self.assertEqual(main, "Main")
+        self.assertEqual(sorted(alts), ["Alt", "Other Alt"])
+
+    def test_alternatives_only(self):
+        titles = {
+            "0000-0001": [["Alt B", "alt", "crossref"], ["Alt A", "alt", "doaj"]],
+            "0000-0002": [["Alt C", "alt", "doaj"], ["Alt A", "alt", "doaj"], ["Alt B", "alt", "crossref"]]
+        }
+        main, alts = self.assertSameTitles(titles, ["doaj", "crossref"])
+        self.assertEqual(main, "Alt A")
+        self.assertEqual(sorted(alts), ["Alt B", "Alt C"])
+
+    def test_no_candidates(self):
+        self.assertEqual(self.assertSameTitles({}, ["doaj"]), (None, []))
+        self.assertIsNone(self.assertSamePublisher({}, ["doaj"]))
+
+    def test_whitespace_is_stripped(self):
+        titles = {"0000-0001": [[" Beta ", "main", " crossref"], ["Alpha", "main", "doaj "], ["Beta", "main", "crossref"]]}
+        self.assertEqual(self.assertSameTitles(titles, ["crossref", "doaj"])[0], "Beta")
+        self.assertEqual(self.assertSameTitles(titles, ["doaj", "crossref"])[0], "Alpha")
+
+    def test_all_values_equal(self):
+        # when every candidate is the same value the sources are not ranked at all, and the result
+        # is still the one the preference order would give
+        titles = {
+            "0000-0001": [["Alpha", "main", "crossref"], ["Alpha", "main", "doaj"]],
+            "0000-0002": [["Alpha ", "main", "sherpa"], ["Alt", "alt", "doaj"]]
+        }
+        candidates = [c for issn in ISSNS for c in titles.get(issn, [])]
+        ranking = PreferenceRanking(["doaj", "crossref"])
+        self.assertEqual(ranking.titles(candidates), get_titles(ISSNS, titles, ["doaj", "crossref"]))
+        self.assertEqual(ranking.publisher([["Pub", "crossref"], [" Pub", "doaj"]]), "Pub")
+        self.assertEqual(len(ranking._source_ranks), 0)
+
+        self.assertEqual(ranking._choose(["x", "x", "x"], ["a", "b", "c"]), 0)
+        self.assertEqual(ranking._choose(["x", "y", "x"], ["crossref", "doaj", "crossref"]), 1)
+        self.assertEqual(len(ranking._source_ranks), 2)
+
+    def test_random(self):
+        rand = random.Random(24)
+        values = ["Alpha", "Beta", "Gamma", " Alpha", "Delta "]
+        sources = ["doaj", "crossref", "sherpa", " doaj", "wos"]
+        orders = [["doaj"], ["crossref", "doaj"], ["sherpa", "doaj", "crossref", "doaj"], [], ["wos"]]
+        for _ in range(2000):
+            titles = {}
+            publishers = {}
+            for issn in ISSNS:
+                titles[issn] = [[rand.choice(values), rand.choice(["main", "alt", "alt"]), rand.choice(sources)]
+                                for _ in range(rand.randint(0, 4))]
+                publishers[issn] = [[rand.choice(values), rand.choice(sources)] for _ in range(rand.randint(0, 3))]
+            order = rand.choice(orders)
+            self.assertSameTitles(titles, order)
+            self.assertSamePublisher(publishers, order)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dataimport.scheduler import Scheduler, SchedulerException
+from dataimport.target import Target
+
+
+class Component(object):
+    def __init__(self, config, id, product=None, dir=None):
+        self.config = config
+        self.id = id
+        self.product = product
+        self.dir = dir
+
+
+class Config(object):
+    DATASOURCES = {"doaj": "tests.test_scheduler.Component", "crossref": "tests.test_scheduler.Component"}
+    PRODUCTS = {"jac": "tests.test_scheduler.Component", "titles": "tests.test_scheduler.Component"}
+    TARGETS = {"es17": "tests.test_scheduler.Component", "csv": "tests.test_scheduler.Component"}
+    PRODUCT_SOURCES = {"jac": ["doaj", "crossref"], "titles": ["doaj"]}
+    PRODUCT_TARGETS = {"jac": [{"id": "es17", "dir": "/targets/jac__es17"}]}
+    TARGET_PRODUCTS = {"es17": ["jac", "titles"], "csv": ["titles"]}
+    TARGET_DIRS = "/targets"
+    STORE_SCOPES = {}
+    DIR_DATE_FORMAT = "%Y-%m-%d_%H%M"
+
+
+class TestPlan(unittest.TestCase):
+    def _plan(self, target_names=None, config=None):
+        return {n.key: n for n in Scheduler(config or Config()).plan(target_names)}
+
+    def test_edges_from_both_settings(self):
+        nodes = self._plan()
+        self.assertEqual(sorted(nodes.keys()), [
+            "datasource:crossref", "datasource:doaj",
+            "product:jac", "product:titles",
+            "target:jac__es17", "target:titles__csv", "target:titles__es17"
+        ])
+
+        # each datasource and product is a single node, however many depend on it
+        self.assertIs(nodes["product:titles"].depends_on[0], nodes["datasource:doaj"])
+        self.assertIn(nodes["datasource:doaj"], nodes["product:jac"].depends_on)
+        self.assertIs(nodes["target:titles__csv"].depends_on[0], nodes["product:titles"])
+        self.assertIs(nodes["target:titles__es17"].depends_on[0], nodes["product:titles"])
+
+    def test_target_dirs(self):
+        nodes = self._plan()
+        jac = nodes["target:jac__es17"].component
+        self.assertEqual(jac.dir, "/targets/jac__es17")
+        self.assertEqual(jac.product.id, "jac")
+
+        # an edge only in TARGET_PRODUCTS has a directory of its own, named as in PRODUCT_TARGETS
+        titles = nodes["target:titles__es17"].component
+        self.assertEqual(titles.dir, "/targets/titles__es17")
+        self.assertEqual(titles.product.id, "titles")
+        self.assertEqual(nodes["target:titles__csv"].component.dir, "/targets/titles__csv")
+
+    def test_real_targets(self):
+        # targets built through TargetFactory, with a store for each product they load
+        class RealTargets(Config):
+            TARGETS = {"es17": "dataimport.target.Target", "csv": "dataimport.target.Target"}
+            TARGET_DIRS = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, RealTargets.TARGET_DIRS)
+
+        nodes = self._plan(config=RealTargets())
+        targets = [n.component for n in nodes.values() if n.kind == "target"]
+        self.assertTrue(all(isinstance(t, Target) for t in targets))
+
+        stores = {t.product.id + "__" + t.id: os.path.dirname(t.file_manager.current_instance_name) for t in targets}
+        self.assertEqual(stores, {
+            "jac__es17": "/targets/jac__es17",
+            "titles__es17": os.path.join(RealTargets.TARGET_DIRS, "titles__es17"),
+            "titles__csv": os.path.join(RealTargets.TARGET_DIRS, "titles__csv")
+        })
+
+    def test_unknown_target(self):
+        class UnknownTarget(Config):
+            TARGET_PRODUCTS = {"solr": ["jac"]}
+        with self.assertRaises(SchedulerException):
+            self._plan(config=UnknownTarget())
+
+    def test_target_without_dir(self):
+        class NoDir(Config):
+            PRODUCT_TARGETS = {"jac": [{"id": "es17"}]}
+        with self.assertRaises(SchedulerException):
+            self._plan(config=NoDir())
+
+    def test_selected_targets(self):
+        nodes = self._plan(["csv"])
+        self.assertEqual(sorted(nodes.keys()), ["datasource:doaj", "product:titles", "target:titles__csv"])
+
+
+if __name__ == "__main__":
+    unittest.main()